@@ -0,0 +1,183 @@
+''' Offline stand-ins for GitHub (PyGithub surface used by CommitExtractor) and OpenAI '''
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import json
+import re
+import threading
+import time
+
+MESSAGES = [
+    'feat: add {n} endpoint',
+    'fix typo in {n}',
+    'Refactor {n} helpers',
+    'Merge branch main into feature-{n}',
+    'Bump requests from 2.{n}.0 to 2.{n}.1',
+    'update readme for {n}',
+    'tweak {n} layout',
+    'add tests for {n}'
+]
+
+
+class CallCounter:
+    """Thread-safe named counters"""
+
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def hit(self, name, amount=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def total(self):
+        with self.lock:
+            return sum(self.counts.values())
+
+
+class FakeCommit:
+    def __init__(self, github, sha, message, date, files):
+        self._github = github
+        self.sha = sha
+        self.commit = SimpleNamespace(
+            message=message,
+            author=SimpleNamespace(date=date),
+            committer=SimpleNamespace(date=date)
+        )
+        self._files = files
+
+    @property
+    def files(self):
+        # lazy in PyGithub: one REST round trip per commit
+        self._github.request('commit_files')
+        return self._files
+
+
+class FakePaginatedList:
+    def __init__(self, github, items, kind='commit_page'):
+        self._github = github
+        self._items = items
+        self._kind = kind
+
+    def get_page(self, page):
+        self._github.request(self._kind)
+        per_page = self._github.per_page
+        return self._items[page * per_page:(page + 1) * per_page]
+
+
+class FakeRepo:
+    def __init__(self, github, repo_id, name, commits):
+        self._github = github
+        self.id = repo_id
+        self.name = name
+        self.full_name = f'bench/{name}'
+        self.owner = SimpleNamespace(login='bench')
+        self.commits = commits  # newest first, like the API
+        self.pushed_at = commits[0].commit.committer.date if commits else None
+
+    def get_commits(self, author=None, since=None):
+        commits = self.commits
+        if since is not None:
+            since = since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+            commits = [commit for commit in commits if commit.commit.committer.date >= since]
+        return FakePaginatedList(self._github, commits)
+
+    def get_commit(self, sha):
+        self._github.request('commit')
+        return next(commit for commit in self.commits if commit.sha == sha)
+
+
+class FakeRequester:
+    def __init__(self, github):
+        self._github = github
+
+    @property
+    def rate_limiting(self):
+        return self._github.rate_limiting
+
+    def graphql_query(self, query, variables):
+        self._github.request('graphql')
+        repo = self._github.repos_by_name[variables['name']]
+        files = {commit.sha: commit._files for commit in repo.commits}
+        nodes = {}
+        for alias, sha in re.findall(r'(c\d+): object\(oid: "([0-9a-f]+)"\)', query):
+            commit_files = files[sha]
+            nodes[alias] = {
+                'additions': sum(f.additions for f in commit_files),
+                'deletions': sum(f.deletions for f in commit_files),
+                'changedFilesIfAvailable': len(commit_files)
+            }
+        return {}, {'data': {'repository': nodes}}
+
+
+class FakeGithub:
+    """Generated repos and commits behind the subset of PyGithub the extractor touches
+
+    Every simulated request sleeps `latency` seconds and is counted per kind.
+    """
+
+    def __init__(self, repos=5, commits=200, files=3, latency=0.0, per_page=100):
+        self.latency = latency
+        self.per_page = per_page
+        self.calls = CallCounter()
+        self.requester = FakeRequester(self)
+        self.rate_limiting = (1_000_000, 1_000_000)
+        self.rate_limiting_resettime = int(time.time()) + 3600
+
+        start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        self.repos = []
+        for r in range(repos):
+            repo_commits = []
+            for c in range(commits):
+                date = start + timedelta(hours=c, minutes=r)
+                sha = f'{r:08x}{c:032x}'
+                commit_files = [
+                    SimpleNamespace(filename=f'src/module_{f}.py', additions=(c + f) % 40, deletions=(c * f) % 15)
+                    for f in range(files)
+                ]
+                message = MESSAGES[c % len(MESSAGES)].format(n=c)
+                repo_commits.append(FakeCommit(self, sha, message, date, commit_files))
+            repo_commits.reverse()
+            self.repos.append(FakeRepo(self, 1000 + r, f'repo-{r}', repo_commits))
+        self.repos_by_name = {repo.name: repo for repo in self.repos}
+        self.user = SimpleNamespace(login='bench', get_repos=self._get_repos)
+
+    def request(self, kind):
+        self.calls.hit(kind)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get_repos(self):
+        # lazy like PyGithub's, each page is a request
+        return FakePaginatedList(self, list(self.repos), 'repos')
+
+    def get_user(self, login=None):
+        return self.user
+
+    def get_repo(self, full_name, lazy=False):
+        return self.repos_by_name[full_name.split('/')[-1]]
+
+
+class StubOpenAI:
+    """Answers chat completions with deterministic types after `latency` seconds"""
+
+    def __init__(self, latency=0.0):
+        self.calls = CallCounter()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.latency = latency
+
+    def _create(self, messages, **kwargs):
+        self.calls.hit('chat')
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = messages[-1]['content']
+        batch = re.search(r'each of these (\d+) commit messages', prompt)
+        if batch:
+            content = json.dumps({'types': [(i % 9) + 1 for i in range(int(batch.group(1)))]})
+        else:
+            content = json.dumps({'type': len(prompt) % 9 + 1})
+        tokens = len(prompt) // 4
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=tokens, completion_tokens=10, total_tokens=tokens + 10)
+        )
@@ -0,0 +1,351 @@
+''' Offline benchmarks for sync, storage, classification and read paths
+
+Usage:
+    python -m benchmarks.run [--repos 5 --commits 200 --github-latency 0.01 ...]
+    python -m benchmarks.run --output new.json --compare baseline.json
+
+Runs against mongomock by default (pip install mongomock) or a local MongoDB
+via --mongo-uri (the database is dropped first, never point it at real data).
+'''
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from .fakes import CallCounter, FakeGithub, StubOpenAI
+
+BENCH_DB = 'learning-logs-bench'
+
+# metrics ending in one of these are better when higher, everything else when lower
+HIGHER_IS_BETTER = ('_per_sec',)
+
+
+class CountingCollection:
+    """Counts every collection-level call, each being at least one server round trip"""
+
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self._counter.hit(name)
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingDatabase:
+    """Database proxy handing out CountingCollections"""
+
+    def __init__(self, db, counter):
+        self._db = db
+        self._counter = counter
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            return getattr(self._db, name)
+        return self[name]
+
+    def __getitem__(self, name):
+        return CountingCollection(self._db[name], self._counter)
+
+    def command(self, *args, **kwargs):
+        self._counter.hit('command')
+        return self._db.command(*args, **kwargs)
+
+
+def make_client(mongo_uri):
+    if mongo_uri:
+        from pymongo import MongoClient
+        return MongoClient(mongo_uri)
+
+    import mongomock
+    from mongomock.collection import BulkOperationBuilder
+    # pymongo >= 4.9 passes `sort` to bulk updates, which mongomock doesn't accept yet
+    add_update = BulkOperationBuilder.add_update
+    BulkOperationBuilder.add_update = lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs)
+    return mongomock.MongoClient()
+
+
+def setup_app(args):
+    """Build the app against the benchmark database
+
+    Returns:
+        tuple: (app, mongo, db_counter)
+    """
+    os.environ.setdefault('MONGO_URI', f'mongodb://localhost:27017/{BENCH_DB}')
+
+    client = make_client(args.mongo_uri)
+    client.drop_database(BENCH_DB)
+    import flask_pymongo
+    # whatever MONGO_URI .env provides, every connection the app opens goes to the bench backend
+    flask_pymongo.MongoClient = lambda *a, **kw: client
+
+    from learning_log import create_app, mongo
+    app = create_app({'MONGO_ENSURE_INDEXES': False, 'SYNC_RESUME_JOBS': False})
+    # after create_app, which reloads .env over the environment
+    os.environ['GITHUB_MAX_REQUESTS_PER_SECOND'] = str(args.github_rps)
+    db_counter = CallCounter()
+    mongo.db = CountingDatabase(client[BENCH_DB], db_counter)
+    return app, mongo, db_counter
+
+
+def reset_state(mongo):
+    """Empty every collection and in-process cache between phases"""
+    from learning_log.models import Repository
+    from learning_log.services.classification_cache import classification_cache
+    from learning_log.services.response_cache import response_cache
+
+    for name in mongo.db._db.list_collection_names():
+        mongo.db._db[name].delete_many({})
+    classification_cache.entries.clear()
+    response_cache.clear()
+    Repository.forget()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def bench_sync(app, mongo, db_counter, args):
+    from learning_log.models import LearningLog
+    from learning_log.services.commit_extractor import CommitExtractor
+    from learning_log.services.token_pool import GitHubAccount, TokenPool
+
+    reset_state(mongo)
+    LearningLog.ensure_indexes()
+    github = FakeGithub(repos=args.repos, commits=args.commits, files=args.files, latency=args.github_latency)
+    pool = TokenPool([GitHubAccount('bench', 'bench-token', client=github)])
+    extractor = CommitExtractor(workers=args.workers, pool=pool)
+    total = args.repos * args.commits
+
+    db_before = db_counter.total()
+    start = time.perf_counter()
+    with app.app_context():
+        extractor.sync_logs(full=True)
+    elapsed = time.perf_counter() - start
+    api_calls = github.calls.total()
+    db_ops = db_counter.total() - db_before
+
+    # second run with nothing new: should cost about one listing per repo
+    with app.app_context():
+        extractor.sync_logs()
+    noop_calls = github.calls.total() - api_calls
+
+    return {
+        'commits': total,
+        'seconds': round(elapsed, 4),
+        'commits_per_sec': round(total / elapsed, 1),
+        'api_calls': api_calls,
+        'api_calls_per_commit': round(api_calls / total, 3),
+        'db_ops_per_commit': round(db_ops / total, 3),
+        'noop_sync_api_calls': noop_calls,
+        'api_calls_by_kind': dict(github.calls.counts)
+    }
+
+
+def _storage_data(prefix, count):
+    return [{
+        'commit_hash': f'{prefix}{i:036x}',
+        'commit_message': f'bench commit {i}',
+        'commit_date': f'2023-01-01T{i % 24:02d}:00:00Z',
+        'repository': f'repo-{i % 5}',
+        'lines_added': i % 50,
+        'lines_deleted': i % 10,
+        'files_changed': i % 7 + 1
+    } for i in range(count)]
+
+
+def bench_storage(mongo, db_counter, args):
+    from learning_log.models import LearningLog
+    from learning_log.services.commit_extractor import CommitExtractor
+
+    extractor = CommitExtractor('bench-token', workers=1)
+    variants = {
+        'single': lambda data: [extractor.process_and_store_commit(commit_data) for commit_data in data],
+        'bulk': lambda data: LearningLog.bulk_upsert(extractor.to_learning_log(commit_data) for commit_data in data)
+    }
+    results = {}
+
+    for name, store in variants.items():
+        # same commits into an empty collection each time, so the numbers compare
+        reset_state(mongo)
+        LearningLog.ensure_indexes()
+        data = _storage_data('s', args.storage_commits)
+        db_before = db_counter.total()
+        start = time.perf_counter()
+        store(data)
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            'commits_per_sec': round(len(data) / elapsed, 1),
+            'db_ops_per_commit': round((db_counter.total() - db_before) / len(data), 3)
+        }
+    return results
+
+
+def bench_classification(mongo, args):
+    from learning_log.services.commit_classifier import CommitClassifier
+    from learning_log.services.classification_cache import classification_cache
+
+    reset_state(mongo)
+    github = FakeGithub(repos=1, commits=args.classify_commits, files=1)
+    messages = [commit.commit.message for commit in github.repos[0].commits]
+    results = {}
+
+    for run in ('cold', 'warm'):
+        openai = StubOpenAI(latency=args.openai_latency)
+        classifier = CommitClassifier(client=openai)
+        stats_before = classification_cache.stats()
+        start = time.perf_counter()
+        classifier.classify_batch(messages)
+        elapsed = time.perf_counter() - start
+        stats = classification_cache.stats()
+        results[run] = {
+            'commits_per_sec': round(len(messages) / elapsed, 1),
+            'model_calls': openai.calls.total(),
+            'model_calls_per_commit': round(openai.calls.total() / len(messages), 4),
+            'rule_hits': stats['rule_hits'] - stats_before['rule_hits'],
+            'cache_hits': (stats['memory_hits'] + stats['db_hits']) - (stats_before['memory_hits'] + stats_before['db_hits'])
+        }
+    return results
+
+
+def bench_reads(app, mongo, db_counter, args):
+    from learning_log.models import LearningLog
+    from learning_log.services.commit_extractor import CommitExtractor
+    from learning_log.services.response_cache import response_cache
+
+    reset_state(mongo)
+    LearningLog.ensure_indexes()
+    extractor = CommitExtractor('bench-token', workers=1)
+    LearningLog.bulk_upsert(extractor.to_learning_log(commit_data) for commit_data in _storage_data('r', args.read_commits))
+
+    client = app.test_client()
+    results = {}
+    for path in ('/logs?limit=50', '/stats?group_by=repository,week'):
+        for run in ('uncached', 'cached'):
+            samples = []
+            db_before = db_counter.total()
+            for _ in range(args.requests):
+                if run == 'uncached':
+                    response_cache.clear()
+                start = time.perf_counter()
+                response = client.get(path)
+                samples.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200, response.status_code
+            results[f'{path.split("?")[0]} {run}'] = {
+                'p50_ms': round(statistics.median(samples), 3),
+                'p99_ms': round(percentile(samples, 99), 3),
+                'db_ops_per_request': round((db_counter.total() - db_before) / args.requests, 3)
+            }
+
+    # full export through the streaming path
+    start = time.perf_counter()
+    lines = sum(1 for _ in client.get('/logs?format=ndjson').response)
+    results['/logs ndjson export'] = {
+        'rows': lines,
+        'rows_per_sec': round(lines / (time.perf_counter() - start), 1)
+    }
+    return results
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(current, baseline, threshold):
+    """Print metric changes against a baseline run, returns the regressed metric names"""
+    regressions = []
+    now, before = flatten(current['results']), flatten(baseline['results'])
+    for name in sorted(now.keys() & before.keys()):
+        if not before[name]:
+            continue
+        change = (now[name] - before[name]) / before[name]
+        higher_is_better = name.endswith(HIGHER_IS_BETTER)
+        regressed = change < -threshold if higher_is_better else change > threshold
+        marker = 'REGRESSION' if regressed else ''
+        print(f"{name:60} {before[name]:>12} -> {now[name]:>12} ({change:+.1%}) {marker}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repos', type=int, default=5)
+    parser.add_argument('--commits', type=int, default=200, help='commits per repo')
+    parser.add_argument('--files', type=int, default=3, help='files per commit')
+    parser.add_argument('--github-latency', type=float, default=0.0, help='seconds per simulated GitHub request')
+    parser.add_argument('--github-rps', type=float, default=1000, help='GITHUB_MAX_REQUESTS_PER_SECOND for the run')
+    parser.add_argument('--openai-latency', type=float, default=0.0, help='seconds per simulated chat completion')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--storage-commits', type=int, default=2000)
+    parser.add_argument('--classify-commits', type=int, default=1000)
+    parser.add_argument('--read-commits', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200, help='requests per read endpoint')
+    parser.add_argument('--mongo-uri', help='local MongoDB instead of mongomock')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='baseline results JSON to diff against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative change counted as a regression')
+    args = parser.parse_args(argv)
+
+    app, mongo, db_counter = setup_app(args)
+    results = {
+        'sync': bench_sync(app, mongo, db_counter, args),
+        'storage': bench_storage(mongo, db_counter, args),
+        'classification': bench_classification(mongo, args),
+        'reads': bench_reads(app, mongo, db_counter, args),
+        # ru_maxrss is KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'revision': git_revision(),
+            'backend': 'mongodb' if args.mongo_uri else 'mongomock',
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'mongo_uri')}
+        },
+        'results': results
+    }
+
+    print(json.dumps(results, indent=2))
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,45 +1,209 @@
 from flask import Flask
 from flask_pymongo import PyMongo
+from .services.metrics import MongoCommandMetrics
+import click
 import os
 import logging
+import threading
 from dotenv import load_dotenv
 from pathlib import Path
 
-# Force reload environment variables
-base_dir = Path(__file__).parent.parent
-env_path = base_dir / '.env'
-load_dotenv(env_path, override=True)
-
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-
-# MongoDB Configuration
-mongo_uri = os.getenv('MONGO_URI')
-
-logger.debug(f"Mongo URI: {mongo_uri}")
-app.config.update(
-    MONGO_URI=mongo_uri,
-    MONGO_DBNAME='learning-logs',
-    MONGO_TLS=True,
-    MONGO_CONNECT=True
-)
-
-try:
-    # Initialize MongoDB
-    mongo = PyMongo(app)
-    
-    # Test connection explicitly
-    mongo.db.command('ping')
-    logger.debug("Successfully connected to MongoDB")
-    logger.debug(f"Available collections: {mongo.db.list_collection_names()}")
-    
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB: {str(e)}", exc_info=True)
-    raise RuntimeError(f"MongoDB connection failed: {str(e)}")
-
-# Import routes after app is created
-from .routes import bp
-app.register_blueprint(bp)
\ No newline at end of file
+# one pooled client per process, bound to the app (and configured) in create_app
+mongo = PyMongo()
+
+_bootstrap_lock = threading.Lock()
+_indexes_started = False
+
+
+def create_app(config=None):
+    """Build the Flask app without touching the network
+
+    Mongo connects on first use; GitHub and OpenAI clients are created on first
+    use by learning_log.clients and then shared.
+
+    Args:
+        config (dict, optional): overrides applied on top of the environment
+
+    Env:
+        MONGO_MAX_POOL_SIZE (default 50), MONGO_TIMEOUT_MS (server selection, default 5000),
+        MONGO_CONNECT_TIMEOUT_MS (default 5000), MONGO_ENSURE_INDEXES (indexes and a first rollup build, default 1),
+        SYNC_RESUME_JOBS (serving processes resume sync jobs left behind by dead ones, default 1),
+        CLASSIFICATION_SCHEDULER_ENABLED (default 0)
+
+    Index bootstrap, the sync job watcher and the classification scheduler start
+    on the first request, so CLI commands never run them.
+    """
+    # Force reload environment variables (once, before any service reads them)
+    base_dir = Path(__file__).parent.parent
+    env_path = base_dir / '.env'
+    load_dotenv(env_path, override=True)
+
+    app = Flask(__name__)
+
+    # MongoDB Configuration
+    mongo_uri = os.getenv('MONGO_URI')
+
+    logger.debug(f"Mongo URI: {mongo_uri}")
+    app.config.update(
+        MONGO_URI=mongo_uri,
+        MONGO_DBNAME='learning-logs',
+        MONGO_TLS=True,
+        MONGO_ENSURE_INDEXES=os.getenv('MONGO_ENSURE_INDEXES', '1') == '1',
+        SYNC_RESUME_JOBS=os.getenv('SYNC_RESUME_JOBS', '1') == '1'
+    )
+    app.config.update(config or {})
+
+    # connect=False: the pool opens on the first operation, so startup does no network I/O.
+    # every command is timed for /metrics
+    mongo.init_app(
+        app,
+        connect=False,
+        maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+        serverSelectionTimeoutMS=int(os.getenv('MONGO_TIMEOUT_MS', 5000)),
+        connectTimeoutMS=int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+        event_listeners=[MongoCommandMetrics()]
+    )
+
+    # Import routes after mongo is configured
+    from .routes import bp
+    app.register_blueprint(bp)
+
+    # background work starts on the first request: only processes that serve requests run it,
+    # `flask <command>` (and anything else that just builds the app) starts no threads
+    if app.config['MONGO_ENSURE_INDEXES']:
+        app.before_request(_start_ensure_indexes)
+
+    from .services.sync_jobs import sync_jobs
+
+    # picks up jobs whose process died mid-run, every half lease;
+    # a CLI process would claim a job and exit mid-run
+    if app.config['SYNC_RESUME_JOBS']:
+        app.before_request(sync_jobs.start_watcher)
+
+    from .services.scheduler import classification_scheduler
+
+    # every serving process may run one; leases keep them from classifying the same commits
+    if os.getenv('CLASSIFICATION_SCHEDULER_ENABLED', '0') == '1':
+        app.before_request(classification_scheduler.start)
+
+    for command in (classify_pending, rebuild_rollups, check_indexes, retrain_classifier, export_snapshot, backfill_author_account, migrate_schema,
+                    dead_letters, retry_dead_letters):
+        app.cli.add_command(command)
+    return app
+
+
+def _start_ensure_indexes():
+    """One-time index (and first rollup) bootstrap in the background, so a slow or unreachable server doesn't hold up the request"""
+    global _indexes_started
+    if _indexes_started:
+        return
+    with _bootstrap_lock:
+        if _indexes_started:
+            return
+        _indexes_started = True
+    threading.Thread(target=_ensure_indexes, name='ensure-indexes', daemon=True).start()
+
+
+def _ensure_indexes():
+    from .models import CommitRollup, LearningLog
+    try:
+        LearningLog.ensure_indexes()
+    except Exception as e:
+        # a failure (e.g. duplicate hashes) shouldn't keep the app down
+        logger.error(f"Failed to ensure indexes: {str(e)}", exc_info=True)
+    try:
+        # /stats only reads rollups, logs stored before they existed need one rebuild
+        CommitRollup.ensure_built()
+    except Exception as e:
+        logger.error(f"Failed to build commit rollups: {str(e)}", exc_info=True)
+
+
+@click.command('classify-pending')
+def classify_pending():
+    """Classify every unclassified commit now"""
+    from .services.scheduler import classification_scheduler
+    click.echo(f"Claimed {classification_scheduler.drain()} commits")
+
+@click.command('rebuild-rollups')
+def rebuild_rollups():
+    """Recompute the commit_rollups collection from learning_logs
+
+    Safe while the app runs: writes made during the rebuild are replayed into it, except
+    one landing right before the new collection is swapped in.
+    """
+    from .models import CommitRollup
+    click.echo(f"Rebuilt {CommitRollup.rebuild()} rollup buckets")
+
+@click.command('check-indexes')
+def check_indexes():
+    """Report missing, extra and unused learning_logs indexes, and duplicate commit hashes"""
+    from .models import LearningLog
+    report = LearningLog.check_indexes()
+    for key, names in report.items():
+        click.echo(f"{key}: {', '.join(names) if names else ('n/a' if names is None else 'none')}")
+
+@click.command('retrain-classifier')
+def retrain_classifier():
+    """Train the local classifier on the LLM labels and print its accuracy report"""
+    from .services.local_classifier import local_classifier
+    report = local_classifier.retrain()
+    if report['model_id'] is None:
+        click.echo(f"Not enough LLM-labeled commits to train ({report['samples']}, need {local_classifier.min_samples})")
+        return
+    click.echo(f"Model {report['model_id']} trained on {report['samples']} messages in {report['train_seconds']}s")
+    click.echo(f"Held-out accuracy: {report['accuracy']:.1%} on {report['held_out']} messages")
+    confident = 'n/a' if report['confident_accuracy'] is None else f"{report['confident_accuracy']:.1%}"
+    click.echo(f"Above {report['threshold']}: {report['coverage']:.1%} of messages answered locally, {confident} accurate")
+    for commit_type, accuracy in sorted(report['per_type'].items()):
+        click.echo(f"  {commit_type}: {accuracy:.1%}")
+
+@click.command('export-snapshot')
+def export_snapshot():
+    """Rewrite every static snapshot shard under SNAPSHOT_DIR"""
+    from .services.snapshot import snapshot_exporter
+    if not snapshot_exporter.directory:
+        click.echo("SNAPSHOT_DIR is not set", err=True)
+        return
+    stats = snapshot_exporter.export()
+    click.echo(f"Snapshot in {snapshot_exporter.directory}: {stats['written']} shards written, {stats['unchanged']} unchanged, {stats['removed']} removed")
+
+@click.command('backfill-author-account')
+def backfill_author_account():
+    """Set author_account on logs stored before multi-account sync (they're the primary account's)"""
+    from .clients import get_token_pool
+    from .models import LearningLog
+    login = get_token_pool().primary.login
+    click.echo(f"Set author_account={login} on {LearningLog.backfill_author_account(login)} logs")
+
+@click.command('migrate-schema')
+@click.option('--batch-size', default=500, show_default=True, help='Documents per batch')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to wait between batches')
+@click.option('--restart', is_flag=True, help='Walk the whole collection instead of resuming')
+def migrate_schema(batch_size, pause, restart):
+    """Rewrite learning logs stored in an older layout, safe to run while the app serves requests"""
+    from .models import LearningLog
+    stats = LearningLog.migrate(batch_size=batch_size, pause=pause, restart=restart)
+    click.echo(f"Rewrote {stats['migrated']} logs as schema v{LearningLog.SCHEMA_VERSION} ({stats['retried']} read again after concurrent updates)")
+    if stats['skipped']:
+        click.echo(f"{stats['skipped']} logs kept changing during the migration, run it again to retry them")
+
+@click.command('dead-letters')
+@click.option('--kind', type=click.Choice(['sync_repo', 'classify', 'webhook']), help='Only this kind of item')
+@click.option('--limit', default=50, show_default=True)
+def dead_letters(kind, limit):
+    """List work that failed for good, newest first"""
+    from .models import DeadLetter
+    for letter in DeadLetter.find(kind, limit):
+        click.echo(f"{letter['last_failed_at'].isoformat()} {letter['kind']} {letter['key']} ({letter['failures']}x): {letter['error']}")
+
+@click.command('retry-dead-letters')
+@click.option('--kind', type=click.Choice(['sync_repo', 'classify', 'webhook']), help='Only this kind of item')
+def retry_dead_letters(kind):
+    """Clear dead letters, putting parked commits back in the classification queue and replaying failed pushes"""
+    from .models import DeadLetter
+    cleared = DeadLetter.retry(kind)
+    click.echo(f"Cleared {', '.join(f'{count} {name}' for name, count in cleared.items()) or 'no'} dead letters")
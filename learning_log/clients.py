@@ -0,0 +1,80 @@
+''' Process-wide API clients, built on first use and shared by every request and worker '''
+
+from github import Github, Auth
+import os
+import threading
+
+_lock = threading.Lock()
+_pool_lock = threading.Lock()
+_github_clients = {}  # token -> Github
+_openai_client = None
+
+
+def get_github(token):
+    """Pooled Github client for `token`
+
+    Pool size, timeout and page size come from GITHUB_POOL_SIZE (default 16, enough
+    for the repo and commit-detail pools of a sync), GITHUB_TIMEOUT (seconds, default 15).
+    GITHUB_API_URL lets the extractor run against a local fake GitHub. GETs go through
+    the conditional-request cache (services/github_cache.py) unless GITHUB_HTTP_CACHE=0.
+    PyGithub's own retries are off: services/resilience.py retries every call in one place.
+    """
+    client = _github_clients.get(token)
+    if client is not None:
+        return client
+    with _lock:
+        if token not in _github_clients:
+            from .services.commit_extractor import PER_PAGE
+            from .services.github_cache import github_response_cache, install
+            client = Github(
+                auth=Auth.Token(token) if token else None,
+                base_url=os.getenv('GITHUB_API_URL', 'https://api.github.com'),
+                per_page=PER_PAGE,
+                pool_size=int(os.getenv('GITHUB_POOL_SIZE', 16)),
+                timeout=int(os.getenv('GITHUB_TIMEOUT', 15)),
+                retry=None
+            )
+            if os.getenv('GITHUB_HTTP_CACHE', '1') == '1':
+                install(client, github_response_cache)
+            _github_clients[token] = client
+        return _github_clients[token]
+
+
+def get_openai():
+    """Pooled OpenAI client
+
+    OPENAI_POOL_SIZE caps open connections (default 20), OPENAI_TIMEOUT is the
+    request timeout in seconds (default 30) and OPENAI_MAX_RETRIES the SDK's own retries
+    (default 0, services/resilience.py retries completions).
+    """
+    global _openai_client
+    if _openai_client is not None:
+        return _openai_client
+    with _lock:
+        if _openai_client is None:
+            import httpx
+            from openai import OpenAI, DefaultHttpxClient
+            pool_size = int(os.getenv('OPENAI_POOL_SIZE', 20))
+            _openai_client = OpenAI(
+                api_key=os.getenv('OPENAI_API_KEY'),
+                timeout=float(os.getenv('OPENAI_TIMEOUT', 30)),
+                max_retries=int(os.getenv('OPENAI_MAX_RETRIES', 0)),
+                http_client=DefaultHttpxClient(
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+                )
+            )
+        return _openai_client
+
+
+_token_pool = None
+
+def get_token_pool():
+    """The configured GitHub accounts (GITHUB_ACCOUNTS, or GITHUB_USERNAME/GITHUB_TOKEN), built once"""
+    global _token_pool
+    if _token_pool is not None:
+        return _token_pool
+    with _pool_lock:
+        if _token_pool is None:
+            from .services.token_pool import TokenPool
+            _token_pool = TokenPool.from_env()
+        return _token_pool
@@ -1,11 +1,18 @@
-from datetime import datetime
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne, IndexModel, ReturnDocument, ASCENDING, DESCENDING, TEXT
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 from learning_log import mongo
+from learning_log.services.metrics import STAGE_SECONDS
 import logging
+import os
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
 class LearningLog:
-    # Define document structure with type hints
+    # Define document structure with type hints (as decode() returns it, see SCHEMA_VERSION for storage)
     SCHEMA = {
         # Required fields
         'commit_hash': str,
@@ -16,25 +23,165 @@ class LearningLog:
         'lines_deleted': int,
         'files_changed': int,  # number of files changed
         'created_at': datetime,
+        'author_account': str | None,  # tracked GitHub login the commit was synced for
         
         # Optional field - will be populated by classification endpoint later
         'commit_type': str | None  # make it optional by allowing None
     }
     
+    # Stored layout, written as `v` on every document (v1 documents have none):
+    #   v1: SCHEMA as is
+    #   v2: commit_type as its COMMIT_TYPES code, repository as a Repository id, dates always
+    #       BSON dates, and SHORT_FIELDS under short keys
+    # Queried fields keep their names, so one index and one query cover both layouts while
+    # `flask migrate-schema` rewrites old documents; reads go through decode().
+    SCHEMA_VERSION = 2
+    SHORT_FIELDS = {'lines_added': 'la', 'lines_deleted': 'ld', 'files_changed': 'fc', 'created_at': 'ca'}
+    LONG_FIELDS = {short: field for field, short in SHORT_FIELDS.items()}
+    
+    # Indexes bootstrapped at startup, keys must be SCHEMA fields (or _id)
+    # _id breaks commit_date ties so keyset pages (find_page) sort straight off the index
+    INDEXES = {
+        'commit_hash_unique': {'keys': [('commit_hash', ASCENDING)], 'unique': True},  # find_by_commit_hash, upserts
+        'commit_date_id': {'keys': [('commit_date', DESCENDING), ('_id', DESCENDING)]},  # get_all, find_page
+        'commit_type_commit_date_id': {'keys': [('commit_type', ASCENDING), ('commit_date', DESCENDING), ('_id', DESCENDING)]},  # find_by_type, find_unclassified
+        'repository_commit_date_id': {'keys': [('repository', ASCENDING), ('commit_date', DESCENDING), ('_id', DESCENDING)]},
+        'author_account_commit_date_id': {'keys': [('author_account', ASCENDING), ('commit_date', DESCENDING), ('_id', DESCENDING)]},
+        # optional: some Mongo-compatible servers have no text indexes, /search then uses services/search.py's own index
+        'commit_message_text': {'keys': [('commit_message', TEXT)], 'optional': True},  # search
+    }
+    
+    # Fields returned by the read API
+    PUBLIC_FIELDS = (
+        'commit_hash', 'commit_message', 'commit_date', 'repository', 'commit_type',
+        'lines_added', 'lines_deleted', 'files_changed', 'created_at', 'author_account'
+    )
+    
+    # Bumped by every write so read caches (services/response_cache.py) can drop stale entries
+    generation = 0
+    
+    _type_codes = None  # commit type description -> COMMIT_TYPES code
+    
+    # lease_expires of commits whose classification failed CLASSIFY_MAX_ATTEMPTS times, never claimed again
+    PARKED = datetime(9999, 12, 31)
+    
     def __init__(self, **kwargs):
         for key, value in kwargs.items():
             setattr(self, key, value)
     
     @classmethod
-    def create(cls, data: dict):
-        logger.debug("Attempting to create learning log...")
-        logger.debug(f"Current app db exists: {hasattr(mongo, 'db')}")
-        
-        if hasattr(mongo, 'db'):
-            logger.debug(f"DB collections: {mongo.db.list_collection_names()}")
+    def _bump_generation(cls):
+        # += on a class attribute isn't atomic, but a lost bump still changes the value
+        cls.generation += 1
+    
+    @classmethod
+    def _on_insert(cls, logs):
+        """Keep derived data in step with newly inserted logs"""
+        if not logs:
+            return
+        from learning_log.services.search import commit_search
+        from learning_log.services.snapshot import snapshot_exporter
+        CommitRollup.add(logs)
+        snapshot_exporter.mark_changed(logs)
+        commit_search.on_insert(logs)
+        cls._bump_generation()
+    
+    @classmethod
+    def _on_classify(cls, logs, types):
+        """Keep derived data in step with classifications (logs as they were before)"""
+        if not logs:
+            return
+        from learning_log.services.search import commit_search
+        from learning_log.services.snapshot import snapshot_exporter
+        CommitRollup.reclassify(logs, types)
+        snapshot_exporter.mark_changed(logs, types)
+        commit_search.on_classify(types)
+        cls._bump_generation()
+    
+    @classmethod
+    def _type_code(cls, commit_type):
+        """COMMIT_TYPES code of a type description (anything else is stored as it is)"""
+        if cls._type_codes is None:
+            from learning_log.services.commit_classifier import COMMIT_TYPES
+            cls._type_codes = {description: code for code, description in COMMIT_TYPES.items()}
+        return cls._type_codes.get(commit_type, commit_type)
+    
+    @classmethod
+    def _decode_value(cls, field, value):
+        """Logical value of a stored repository or commit_type, whichever layout it came from"""
+        if field == 'repository' and isinstance(value, int):
+            return Repository.name_of(value)
+        if field == 'commit_type' and isinstance(value, int):
+            from learning_log.services.commit_classifier import COMMIT_TYPES
+            return COMMIT_TYPES.get(value, value)
+        return value
+    
+    @staticmethod
+    def _date(value):
+        """Naive UTC datetime of a date, ISO strings included"""
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return SyncState.utc(value)
+    
+    @classmethod
+    def encode(cls, log):
+        """Stored (SCHEMA_VERSION) form of a log"""
+        doc = {cls.SHORT_FIELDS.get(field, field): value for field, value in log.items()}
+        doc['v'] = cls.SCHEMA_VERSION
+        if 'repository' in doc:
+            doc['repository'] = Repository.ref(doc['repository'])
+        if 'commit_type' in doc:
+            doc['commit_type'] = cls._type_code(doc['commit_type'])
+        for field in ('commit_date', cls.SHORT_FIELDS['created_at']):
+            if doc.get(field) is not None:
+                doc[field] = cls._date(doc[field])
+        return doc
+    
+    @classmethod
+    def decode(cls, doc):
+        """Logical (SCHEMA) form of a stored log of any version, None stays None"""
+        if doc is None:
+            return None
+        if doc.get('v', 1) == 1:
+            # v1 never checked types, dates may have been written as strings
+            log = dict(doc)
+            for field in ('commit_date', 'created_at'):
+                if isinstance(log.get(field), str):
+                    log[field] = cls._date(log[field])
         else:
-            logger.error("No db attribute found on db")
-            
+            log = {cls.LONG_FIELDS.get(key, key): value for key, value in doc.items() if key != 'v'}
+        # by value, not version: classifications of not yet migrated v1 documents are stored as codes
+        for field in ('repository', 'commit_type'):
+            if field in log:
+                log[field] = cls._decode_value(field, log[field])
+        return log
+    
+    @classmethod
+    def _projection(cls, fields):
+        """Projection of logical `fields` that works on every stored layout"""
+        projection = {cls.SHORT_FIELDS.get(field, field): 1 for field in fields}
+        projection.update({field: 1 for field in fields}, v=1)
+        return projection
+    
+    @classmethod
+    def distinct(cls, field):
+        """Distinct logical values of repository or commit_type, None left out"""
+        values = {cls._decode_value(field, value) for value in mongo.db.learning_logs.distinct(field)}
+        return values - {None}
+    
+    @classmethod
+    def to_public(cls, log):
+        """JSON-ready PUBLIC_FIELDS of a stored log, as served by /logs and the snapshot export"""
+        return {
+            'id': str(log['_id']),
+            **{field: log.get(field) for field in cls.PUBLIC_FIELDS},
+            'commit_date': log['commit_date'].isoformat(),
+            'created_at': log['created_at'].isoformat() if log.get('created_at') else None
+        }
+    
+    @classmethod
+    def _prepare(cls, data: dict):
+        """Validate a new learning log and fill in server-side defaults"""
         # Only validate required fields
         if not isinstance(data.get('files_changed'), int):
             logger.error("files_changed must be an integer")
@@ -45,25 +192,341 @@ class LearningLog:
         
         # commit_type can be None or omitted entirely
         data.setdefault('commit_type', None)
+        return data
+    
+    @classmethod
+    def ensure_indexes(cls):
+        """Create any missing INDEXES (also creates the collection on first run)"""
+        models, unique, optional = [], [], []
+        for name, spec in cls.INDEXES.items():
+            for field, _ in spec['keys']:
+                if field != '_id' and field not in cls.SCHEMA:
+                    raise ValueError(f"Index {name} uses unknown field {field}")
+            model = IndexModel(spec['keys'], name=name, unique=spec.get('unique', False))
+            if spec.get('optional'):
+                optional.append(model)
+            elif spec.get('unique'):
+                unique.append(model)
+            else:
+                models.append(model)
+        
+        created = mongo.db.learning_logs.create_indexes(models)
+        for model in unique:
+            # on their own: the server rejects the whole call when stored documents break one
+            try:
+                created += mongo.db.learning_logs.create_indexes([model])
+            except OperationFailure as e:
+                if e.code != 11000:
+                    raise
+                logger.error(f"Can't create unique index {model.document['name']}, duplicates are stored "
+                             f"(listed by `flask check-indexes`): {str(e)}")
+        for model in optional:
+            # one at a time so an unsupported index type doesn't take the others down with it
+            try:
+                created += mongo.db.learning_logs.create_indexes([model])
+            except (OperationFailure, NotImplementedError) as e:
+                logger.warning(f"Skipping optional index {model.document['name']}: {str(e)}")
+        logger.info(f"Ensured learning_logs indexes: {', '.join(created)}")
+        return created
+    
+    @classmethod
+    def check_indexes(cls):
+        """Compare INDEXES against the collection without changing anything
+        
+        Returns:
+            dict: missing (declared but absent), extra (present but undeclared),
+                unused (no accesses since the server started, None if $indexStats is unavailable)
+                and duplicates (commit hashes stored more than once, which block the unique index)
+        """
+        existing = mongo.db.learning_logs.index_information()
+        existing.pop('_id_', None)
+        
+        try:
+            stats = mongo.db.learning_logs.aggregate([{'$indexStats': {}}])
+            unused = sorted(s['name'] for s in stats if s['name'] != '_id_' and s['accesses']['ops'] == 0)
+        except (OperationFailure, NotImplementedError) as e:
+            logger.warning(f"$indexStats unavailable: {str(e)}")
+            unused = None
+        
+        return {
+            'missing': sorted(name for name in cls.INDEXES if name not in existing),
+            'extra': sorted(name for name in existing if name not in cls.INDEXES),
+            'unused': unused,
+            'duplicates': [doc['_id'] for doc in mongo.db.learning_logs.aggregate([
+                {'$group': {'_id': '$commit_hash', 'count': {'$sum': 1}}},
+                {'$match': {'count': {'$gt': 1}}},
+                {'$sort': {'_id': 1}}
+            ], allowDiskUse=True)]
+        }
+    
+    @classmethod
+    def create(cls, data: dict):
+        cls._prepare(data)
+        result = mongo.db.learning_logs.insert_one(cls.encode(data))
+        data['_id'] = result.inserted_id
+        cls._on_insert([data])
+        return result
+    
+    @classmethod
+    def bulk_upsert(cls, logs, batch_size=500, inserted=None):
+        """Insert learning logs in unordered batches, skipping commit hashes already stored
+        
+        Each batch is one `bulk_write` of `$setOnInsert` upserts keyed on commit_hash,
+        so existing documents are never touched and no per-commit lookup is needed.
+        
+        Args:
+            logs (iterable): learning log dicts, consumed lazily
+            batch_size (int, optional): documents per bulk_write (default: 500)
+            inserted (list, optional): gets the newly inserted documents appended
+        
+        Returns:
+            dict: {'inserted': int, 'skipped': int}
+        """
+        results = {'inserted': 0, 'skipped': 0}
+        batch = []
+        for data in logs:
+            batch.append(cls._prepare(data))
+            if len(batch) >= batch_size:
+                cls._flush_upserts(batch, results, inserted)
+                batch = []
+        
+        if batch:
+            cls._flush_upserts(batch, results, inserted)
+        return results
+    
+    @classmethod
+    def _flush_upserts(cls, batch, results, inserted=None):
+        operations = [
+            UpdateOne({'commit_hash': data['commit_hash']}, {'$setOnInsert': cls.encode(data)}, upsert=True)
+            for data in batch
+        ]
+        try:
+            with STAGE_SECONDS.time(stage='store'):
+                upserted = mongo.db.learning_logs.bulk_write(operations, ordered=False).upserted_ids
+        except BulkWriteError as e:
+            # concurrent writers can race on the same hash; the loser is just a skip
+            errors = e.details.get('writeErrors', [])
+            if any(error.get('code') != 11000 for error in errors):
+                raise
+            upserted = {upsert['index']: upsert['_id'] for upsert in e.details.get('upserted', [])}
         
-        # Create collection if it doesn't exist
-        if 'learning_logs' not in mongo.db.list_collection_names():
-            logger.debug("Creating learning_logs collection...")
-            mongo.db.create_collection('learning_logs')
+        for index, _id in upserted.items():
+            batch[index]['_id'] = _id
+        new_logs = [batch[index] for index in upserted]
+        cls._on_insert(new_logs)
+        if inserted is not None:
+            inserted.extend(new_logs)
+        results['inserted'] += len(upserted)
+        results['skipped'] += len(batch) - len(upserted)
+    
+    @classmethod
+    def backfill_author_account(cls, login):
+        """Attribute logs without an author_account to `login`, returns how many were updated"""
+        updated = mongo.db.learning_logs.update_many(
+            {'author_account': None},
+            {'$set': {'author_account': login}}
+        ).modified_count
+        if updated:
+            cls._bump_generation()
+        return updated
+    
+    @classmethod
+    def migrate(cls, batch_size=500, pause=0, restart=False):
+        """Rewrite documents stored in an older layout as SCHEMA_VERSION, while the app keeps running
+        
+        Walks _id upwards in batches from the checkpoint kept in `schema_migrations`, so an
+        interrupted run resumes where it stopped and a rerun picks up documents inserted
+        since by processes still on the old code. A rewrite only lands if the document's
+        commit_type didn't change since it was read; ones that did are read again, and
+        the few still changing after that are kept in the checkpoint for the next run.
+        
+        Args:
+            batch_size (int, optional): documents per read and bulk_write (default: 500)
+            pause (float, optional): seconds to sleep between batches, to go easy on a busy server (default: 0)
+            restart (bool, optional): ignore the checkpoint and walk the whole collection (default False)
+        
+        Returns:
+            dict: migrated, retried (changed underneath) and skipped (left for the next run) document counts
+        """
+        checkpoint = None if restart else mongo.db.schema_migrations.find_one({'_id': 'learning_logs'})
+        if checkpoint and checkpoint.get('version') != cls.SCHEMA_VERSION:
+            checkpoint = None
+        last_id = checkpoint['last_id'] if checkpoint else None
+        stats = {'migrated': 0, 'retried': 0}
+        
+        # documents a previous run had to leave behind go first
+        skipped = checkpoint.get('skipped', []) if checkpoint else []
+        if skipped:
+            docs = list(mongo.db.learning_logs.find({'_id': {'$in': skipped}, 'v': {'$ne': cls.SCHEMA_VERSION}}))
+            rewritten, skipped = cls._migrate_docs(docs, stats)
+            stats['migrated'] += rewritten
+            mongo.db.schema_migrations.update_one(
+                {'_id': 'learning_logs'},
+                {'$set': {'skipped': skipped, 'updated_at': datetime.utcnow()}, '$inc': {'migrated': rewritten}}
+            )
+        
+        while True:
+            query = {'v': {'$ne': cls.SCHEMA_VERSION}}
+            if last_id is not None:
+                query['_id'] = {'$gt': last_id}
+            docs = list(mongo.db.learning_logs.find(query).sort('_id', ASCENDING).limit(batch_size))
+            if not docs:
+                break
+            last_id = docs[-1]['_id']
+            rewritten, left = cls._migrate_docs(docs, stats)
+            # the checkpoint moves past them, so they're kept to be retried
+            skipped += left
             
-        return mongo.db.learning_logs.insert_one(data)
+            mongo.db.schema_migrations.update_one(
+                {'_id': 'learning_logs'},
+                {'$set': {'version': cls.SCHEMA_VERSION, 'last_id': last_id, 'skipped': skipped, 'updated_at': datetime.utcnow()},
+                 '$inc': {'migrated': rewritten}},
+                upsert=True
+            )
+            stats['migrated'] += rewritten
+            logger.info(f"Schema migration: {stats['migrated']} logs rewritten, up to {last_id}")
+            if pause:
+                time.sleep(pause)
+        
+        stats['skipped'] = len(skipped)
+        if skipped:
+            logger.warning(f"Schema migration: {len(skipped)} logs kept changing, the next run retries them")
+        return stats
+    
+    @classmethod
+    def _migrate_docs(cls, docs, stats):
+        """Migrate `docs`, reading the ones changed underneath again, returns (rewritten count, _ids still left)"""
+        # classifications landing mid-batch are rare, a few rounds settle them
+        rewritten = 0
+        for _ in range(3):
+            migrated = cls._migrate_batch(docs)
+            rewritten += len(migrated)
+            changed = [doc['_id'] for doc in docs if doc['_id'] not in migrated]
+            if not changed:
+                return rewritten, []
+            stats['retried'] += len(changed)
+            docs = list(mongo.db.learning_logs.find({'_id': {'$in': changed}, 'v': {'$ne': cls.SCHEMA_VERSION}}))
+        return rewritten, [doc['_id'] for doc in docs]
+    
+    @classmethod
+    def _migrate_batch(cls, docs):
+        """Rewrite one batch in place, returns the _ids that were rewritten"""
+        operations = []
+        for doc in docs:
+            log = cls.decode(doc)
+            update = {'$set': cls.encode({field: log[field] for field in cls.SCHEMA if field in log})}
+            old_fields = [field for field in cls.SHORT_FIELDS if field in doc]
+            if old_fields:
+                update['$unset'] = dict.fromkeys(old_fields, '')
+            operations.append(UpdateOne(
+                # commit_type is the one field that changes after insert (the lease fields are left alone)
+                {'_id': doc['_id'], 'v': doc.get('v'), 'commit_type': doc.get('commit_type')},
+                update
+            ))
+        if not operations:
+            return set()
+        mongo.db.learning_logs.bulk_write(operations, ordered=False)
+        # bulk results don't say which ones matched
+        return {doc['_id'] for doc in mongo.db.learning_logs.find(
+            {'_id': {'$in': [doc['_id'] for doc in docs]}, 'v': cls.SCHEMA_VERSION}, {'_id': 1}
+        )}
     
     @classmethod
     def find_by_commit_hash(cls, commit_hash):
-        return mongo.db.learning_logs.find_one({'commit_hash': commit_hash})
+        return cls.decode(mongo.db.learning_logs.find_one({'commit_hash': commit_hash}))
     
     @classmethod
     def get_all(cls):
-        return mongo.db.learning_logs.find().sort('commit_date', -1)
+        return map(cls.decode, mongo.db.learning_logs.find().sort('commit_date', -1))
+    
+    @classmethod
+    def find_page(cls, limit=None, after=None, repository=None, commit_type=None, author_account=None, fields=PUBLIC_FIELDS, batch_size=None):
+        """Newest-first learning logs, keyset paginated on (commit_date, _id)
+        
+        Args:
+            limit (int, optional): maximum documents to return, None for all
+            after (tuple, optional): (commit_date, _id) of the last document of the previous page
+            repository (str, optional): only logs from this repository
+            commit_type (str, optional): only logs of this type
+            author_account (str, optional): only logs synced for this GitHub login
+            fields (iterable, optional): projection, defaults to PUBLIC_FIELDS
+            batch_size (int, optional): documents per cursor batch, for long exports
+        
+        Returns:
+            iterator: decoded logs
+        """
+        query = cls._filters(repository=repository, commit_type=commit_type, author_account=author_account)
+        if after:
+            commit_date, _id = after
+            query['$or'] = [
+                {'commit_date': {'$lt': commit_date}},
+                {'commit_date': commit_date, '_id': {'$lt': _id}}
+            ]
+        
+        cursor = mongo.db.learning_logs.find(query, cls._projection(fields))
+        cursor = cursor.sort([('commit_date', DESCENDING), ('_id', DESCENDING)])
+        if limit:
+            cursor = cursor.limit(limit)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return map(cls.decode, cursor)
+    
+    @classmethod
+    def _filters(cls, since=None, until=None, **fields):
+        """Equality filters for the fields that are set, plus a commit_date range [since, until)
+        
+        repository and commit_type match both stored layouts; $in on the leading index
+        field still reads the index in commit_date order (one merged range per value).
+        """
+        query = {field: value for field, value in fields.items() if value}
+        stored = {
+            'repository': lambda name: Repository.ref(name, create=False),
+            'commit_type': cls._type_code
+        }
+        for field, encode in stored.items():
+            if field in query:
+                value = encode(query[field])
+                if value is not None and value != query[field]:
+                    query[field] = {'$in': [query[field], value]}
+        if since or until:
+            query['commit_date'] = {**({'$gte': since} if since else {}), **({'$lt': until} if until else {})}
+        return query
+    
+    @classmethod
+    def text_search(cls, text, limit, after=None, by_date=False, fields=PUBLIC_FIELDS, **filters):
+        """Logs matching `text` through the commit_message text index, best match first
+        
+        Raises OperationFailure when the server has no text index (see services/search.py).
+        
+        Args:
+            text (str): Mongo $text search string (words, "phrases", -negations)
+            limit (int): maximum documents to return
+            after (tuple, optional): (score, _id), or (commit_date, _id) when by_date, of the previous page's last log
+            by_date (bool, optional): newest first instead of by relevance (default False)
+            fields (iterable, optional): projection, defaults to PUBLIC_FIELDS
+            **filters: repository, commit_type, author_account, since, until
+        """
+        sort_key = 'commit_date' if by_date else 'score'
+        pipeline = [
+            {'$match': {'$text': {'$search': text}, **cls._filters(**filters)}},
+            {'$addFields': {'score': {'$meta': 'textScore'}}}
+        ]
+        if after:
+            value, _id = after
+            pipeline.append({'$match': {'$or': [
+                {sort_key: {'$lt': value}},
+                {sort_key: value, '_id': {'$lt': _id}}
+            ]}})
+        pipeline += [
+            {'$sort': {sort_key: DESCENDING, '_id': DESCENDING}},
+            {'$limit': limit},
+            {'$project': {**cls._projection(fields), 'score': 1}}
+        ]
+        return map(cls.decode, mongo.db.learning_logs.aggregate(pipeline))
     
     @classmethod
     def find_by_type(cls, commit_type):
-        return mongo.db.learning_logs.find({'commit_type': commit_type})
+        return map(cls.decode, mongo.db.learning_logs.find(cls._filters(commit_type=commit_type)))
     
     @classmethod
     def find_unclassified(cls, limit=5):  # default to 15 for safety
@@ -79,4 +542,597 @@ class LearningLog:
             {'$limit': limit}                   # limit at database level
         ]
         
-        return mongo.db.learning_logs.aggregate(pipeline) 
\ No newline at end of file
+        return map(cls.decode, mongo.db.learning_logs.aggregate(pipeline))
+    
+    @classmethod
+    def claim_unclassified(cls, owner, limit=50, lease_seconds=300):
+        """Lease a batch of unclassified commits, newest first
+        
+        Each claim is an atomic find_one_and_update, so concurrent workers never get
+        the same commit; leases left behind by a crashed worker expire and get reclaimed.
+        
+        Args:
+            owner (str): id of the claiming worker
+            limit (int, optional): maximum commits to claim (default: 50)
+            lease_seconds (int, optional): how long the claim holds (default: 300)
+        """
+        now = datetime.utcnow()
+        claimed = []
+        for _ in range(limit):
+            log = mongo.db.learning_logs.find_one_and_update(
+                # missing, null or past expiry all count as unleased
+                {'commit_type': None, 'lease_expires': {'$not': {'$gte': now}}},
+                {'$set': {'lease_owner': owner, 'lease_expires': now + timedelta(seconds=lease_seconds)}},
+                projection={'commit_hash': 1, 'commit_message': 1},
+                sort=[('commit_date', DESCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+            if log is None:
+                break
+            claimed.append(cls.decode(log))
+        return claimed
+    
+    @classmethod
+    def set_types(cls, types, owner):
+        """Write classifications for commits leased by `owner` and release their leases
+        
+        Commits whose lease was lost (expired and reclaimed elsewhere) are left alone.
+        
+        Args:
+            types (dict): commit_hash -> commit_type
+            owner (str): id of the worker holding the leases
+        
+        Returns:
+            int: number of commits updated
+        """
+        if not types:
+            return 0
+        
+        # pre-images for the rollups; the lease keeps them from changing underneath us
+        logs = [cls.decode(log) for log in mongo.db.learning_logs.find(
+            {'commit_hash': {'$in': list(types)}, 'lease_owner': owner, 'commit_type': None},
+            cls._projection(('commit_hash', 'commit_type', 'repository', 'commit_date', *CommitRollup.METRICS[1:]))
+        )]
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {'commit_hash': commit_hash, 'lease_owner': owner, 'commit_type': None},
+                # classified_at lets CommitRollup.rebuild catch classifications made while it scans
+                {'$set': {'commit_type': cls._type_code(commit_type), 'classified_at': now},
+                 '$unset': {'lease_owner': '', 'lease_expires': '', 'classify_attempts': ''}}
+            )
+            for commit_hash, commit_type in types.items()
+        ]
+        with STAGE_SECONDS.time(stage='store_types'):
+            updated = mongo.db.learning_logs.bulk_write(operations, ordered=False).modified_count
+        # only the commits we still held: the others belong to whoever reclaimed them
+        cls._on_classify(logs, {log['commit_hash']: types[log['commit_hash']] for log in logs})
+        return updated
+    
+    @classmethod
+    def retry_later(cls, errors, owner, max_attempts=None):
+        """Push back commits leased by `owner` whose classification failed
+        
+        Each failure moves the lease expiry out by a jittered exponential backoff
+        (CLASSIFY_RETRY_SECONDS doubling, up to 6 hours), so commits that failed together
+        don't come back together. After CLASSIFY_MAX_ATTEMPTS failures a commit is parked
+        with a dead letter until `flask retry-dead-letters` puts it back.
+        
+        Args:
+            errors (dict): commit_hash -> error message
+            owner (str): id of the worker holding the leases
+            max_attempts (int, optional): failures before parking (default: CLASSIFY_MAX_ATTEMPTS or 5)
+        
+        Returns:
+            int: number of commits parked
+        """
+        from learning_log.services.resilience import backoff_delay
+        max_attempts = max_attempts or int(os.getenv('CLASSIFY_MAX_ATTEMPTS', 5))
+        retry_seconds = float(os.getenv('CLASSIFY_RETRY_SECONDS', 300))
+        parked = 0
+        for commit_hash, error in errors.items():
+            log = mongo.db.learning_logs.find_one_and_update(
+                {'commit_hash': commit_hash, 'lease_owner': owner, 'commit_type': None},
+                {'$inc': {'classify_attempts': 1}},
+                projection={'commit_message': 1, 'classify_attempts': 1},
+                return_document=ReturnDocument.AFTER
+            )
+            if log is None:  # lease lost, the new holder deals with it
+                continue
+            if log['classify_attempts'] >= max_attempts:
+                retry_at = cls.PARKED
+                DeadLetter.record('classify', commit_hash, error, commit_message=log['commit_message'])
+                parked += 1
+            else:
+                retry_at = datetime.utcnow() + timedelta(seconds=backoff_delay(log['classify_attempts'] - 1, retry_seconds, 6 * 3600))
+            mongo.db.learning_logs.update_one({'_id': log['_id'], 'lease_owner': owner}, {'$set': {'lease_expires': retry_at}})
+        if parked:
+            logger.warning(f"Parked {parked} commits after {max_attempts} failed classifications")
+        return parked
+    
+    @classmethod
+    def unpark(cls, commit_hashes):
+        """Make parked (or backed off) commits claimable again, returns how many"""
+        return mongo.db.learning_logs.update_many(
+            {'commit_hash': {'$in': list(commit_hashes)}, 'commit_type': None},
+            {'$unset': {'lease_owner': '', 'lease_expires': '', 'classify_attempts': ''}}
+        ).modified_count
+
+class Repository:
+    """Small integer ids for repository names, stored on v2 learning logs instead of the name
+
+    `repos` holds {_id, name}; ids come from a counter in `counters` and never change,
+    so both directions are cached for the life of the process.
+    """
+
+    _ids = {}  # name -> id
+    _names = {}  # id -> name
+    _lock = threading.Lock()
+    _indexed = False
+
+    @classmethod
+    def _remember(cls, doc):
+        cls._ids[doc['name']] = doc['_id']
+        cls._names[doc['_id']] = doc['name']
+
+    @classmethod
+    def ref(cls, name, create=True):
+        """Id of a repository name, registered on first use (None for an unknown name when not `create`)"""
+        ref = cls._ids.get(name)
+        if ref is not None:
+            return ref
+        doc = mongo.db.repos.find_one({'name': name})
+        if doc is None:
+            if not create:
+                return None
+            doc = cls._register(name)
+        cls._remember(doc)
+        return doc['_id']
+
+    @classmethod
+    def _register(cls, name):
+        with cls._lock:
+            if not cls._indexed:
+                # the unique name is what settles two processes registering the same repo
+                mongo.db.repos.create_index('name', unique=True, name='name_unique')
+                cls._indexed = True
+        counter = mongo.db.counters.find_one_and_update(
+            {'_id': 'repos'}, {'$inc': {'seq': 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        doc = {'_id': counter['seq'], 'name': name, 'created_at': datetime.utcnow()}
+        try:
+            mongo.db.repos.insert_one(doc)
+        except DuplicateKeyError:
+            # another process registered it first, its id wins (ours is just skipped)
+            doc = mongo.db.repos.find_one({'name': name})
+        return doc
+
+    @classmethod
+    def forget(cls):
+        """Drop the cached ids (after the repos collection was emptied)"""
+        cls._ids.clear()
+        cls._names.clear()
+
+    @classmethod
+    def name_of(cls, ref):
+        """Name of a repository id (None if it was never registered)"""
+        if ref not in cls._names:
+            # a repo registered by another process, one read picks up every new one
+            for doc in mongo.db.repos.find():
+                cls._remember(doc)
+        return cls._names.get(ref)
+
+
+class SyncState:
+    """Per-repository sync cursor so /sync only walks commits newer than the last run"""
+
+    @classmethod
+    def get_cursor(cls, repository):
+        return mongo.db.sync_state.find_one({'_id': repository})
+
+    @classmethod
+    def save_cursor(cls, repository, commit_sha=None, commit_date=None, pushed_at=None):
+        """Record the newest synced commit for a repository
+
+        Args:
+            repository (str): repository name (same value stored on learning logs)
+            commit_sha (str, optional): sha of the newest commit that was synced
+            commit_date (datetime, optional): committer date of that commit, used as `since` next time
+            pushed_at (datetime, optional): repo's pushed_at when the sync finished, unchanged means nothing to fetch
+        """
+        fields = {'updated_at': datetime.utcnow()}
+        if commit_sha:
+            fields.update(commit_sha=commit_sha, commit_date=commit_date)
+        if pushed_at:
+            fields['pushed_at'] = cls.utc(pushed_at).replace(microsecond=0)
+        return mongo.db.sync_state.update_one({'_id': repository}, {'$set': fields}, upsert=True)
+
+    @staticmethod
+    def utc(value):
+        """Naive UTC datetime, the way Mongo hands dates back"""
+        if value is not None and value.tzinfo:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    @classmethod
+    def is_unchanged(cls, cursor, pushed_at):
+        """True if nothing was pushed to the repo since the sync that saved `cursor`"""
+        # GitHub's pushed_at has second precision, like Mongo dates
+        return bool(cursor) and pushed_at is not None and cursor.get('pushed_at') == cls.utc(pushed_at).replace(microsecond=0)
+
+
+class SyncJob:
+    """Background sync runs (services/sync_jobs.py), checkpointed per repo and listing page
+
+    `repos` is keyed by GitHub repo id (names may contain dots; `login:id` for secondary accounts) and holds each repo's
+    status (pending, running, done, failed), next listing page, newest commit seen and counts.
+    A job belongs to whoever holds its lease, one owner token per run (so a resumed job never shares its
+    owner with the run it replaced); a job whose lease ran out is resumed by the next claimer.
+    """
+
+    @classmethod
+    def create(cls, owner, full=False, workers=None, lease_seconds=600, classify=False):
+        """Insert a running job, or return None if one is already running (in any process)"""
+        # the partial unique index is what keeps two processes from both starting a sync
+        mongo.db.sync_jobs.create_index(
+            'status', unique=True, partialFilterExpression={'status': 'running'}, name='one_running'
+        )
+        now = datetime.utcnow()
+        job = {
+            'status': 'running',
+            'full': full,
+            'classify': classify,
+            'workers': workers,
+            'repos': {},
+            'totals': {'processed': 0, 'skipped': 0},
+            'owner': owner,
+            'lease_expires': now + timedelta(seconds=lease_seconds),
+            'resumes': 0,
+            'created_at': now,
+            'updated_at': now,
+            'finished_at': None,
+            'error': None,
+            'summary': None
+        }
+        try:
+            job['_id'] = mongo.db.sync_jobs.insert_one(job).inserted_id
+        except DuplicateKeyError:
+            return None
+        return job
+
+    @classmethod
+    def get(cls, job_id):
+        return mongo.db.sync_jobs.find_one({'_id': job_id})
+
+    @classmethod
+    def find_running(cls):
+        """The running job, alive or waiting to be resumed, if any"""
+        return mongo.db.sync_jobs.find_one({'status': 'running'})
+
+    @classmethod
+    def claim_stale(cls, owner, lease_seconds=600):
+        """Take over the oldest running job whose lease expired (its owner died), or None"""
+        now = datetime.utcnow()
+        return mongo.db.sync_jobs.find_one_and_update(
+            {'status': 'running', 'lease_expires': {'$lt': now}},
+            {'$set': {'owner': owner, 'lease_expires': now + timedelta(seconds=lease_seconds), 'updated_at': now},
+             '$inc': {'resumes': 1}},
+            sort=[('created_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    @classmethod
+    def renew(cls, job_id, owner, lease_seconds=600):
+        """Extend the lease without recording progress, returns False if `owner` no longer holds the job"""
+        now = datetime.utcnow()
+        return mongo.db.sync_jobs.update_one(
+            {'_id': job_id, 'owner': owner, 'status': 'running'},
+            {'$set': {'lease_expires': now + timedelta(seconds=lease_seconds), 'updated_at': now}}
+        ).matched_count == 1
+
+    @classmethod
+    def add_repos(cls, job, repos):
+        """Register repos the job hasn't seen yet, returns the updated job
+        
+        Args:
+            job (dict): the job
+            repos (dict): key (repo id, prefixed by the login for secondary accounts) -> (repo name, account login)
+        """
+        new = {
+            f'repos.{key}': {'name': name, 'account': login, 'status': 'pending', 'next_page': 0, 'processed': 0, 'skipped': 0}
+            for key, (name, login) in repos.items()
+            if key not in job['repos']
+        }
+        if not new:
+            return job
+        return mongo.db.sync_jobs.find_one_and_update(
+            {'_id': job['_id']},
+            {'$set': {**new, 'updated_at': datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    @classmethod
+    def checkpoint(cls, job_id, owner, repo_id, state, processed=0, skipped=0, lease_seconds=600):
+        """Record one repo's progress and renew the lease
+
+        Args:
+            job_id (ObjectId): job to update
+            owner (str): lease holder, nothing is written if the job was taken over
+            repo_id (int): GitHub repo id
+            state (dict): repo fields to set (status, next_page, newest_sha, ...)
+            processed (int, optional): newly stored commits to add to the totals
+            skipped (int, optional): newly skipped commits to add to the totals
+
+        Returns:
+            bool: False if `owner` no longer holds the job
+        """
+        now = datetime.utcnow()
+        result = mongo.db.sync_jobs.update_one(
+            {'_id': job_id, 'owner': owner, 'status': 'running'},
+            {'$set': {
+                **{f'repos.{repo_id}.{field}': value for field, value in state.items()},
+                'lease_expires': now + timedelta(seconds=lease_seconds),
+                'updated_at': now
+            },
+             '$inc': {
+                f'repos.{repo_id}.processed': processed,
+                f'repos.{repo_id}.skipped': skipped,
+                'totals.processed': processed,
+                'totals.skipped': skipped
+            }}
+        )
+        return result.matched_count == 1
+
+    @classmethod
+    def finish(cls, job_id, owner, status, error=None, summary=None):
+        now = datetime.utcnow()
+        mongo.db.sync_jobs.update_one(
+            {'_id': job_id, 'owner': owner},
+            {'$set': {'status': status, 'error': error, 'summary': summary, 'finished_at': now, 'updated_at': now}}
+        )
+
+
+class DeadLetter:
+    """Work items that failed for good (retries spent, or an error retrying can't fix), kept to inspect and replay
+
+    One document per item, _id '<kind>:<key>', with the last error, a failure count and
+    whatever describes the item. Kinds: 'sync_repo' (key: the repo's sync cursor key; the
+    next sync tries the repo again and clears it), 'classify' (key: commit hash; the
+    commit stays parked until `flask retry-dead-letters`) and 'webhook' (key: repo full
+    name@head sha; the push payload is kept and replayed by `flask retry-dead-letters`).
+    """
+
+    @classmethod
+    def record(cls, kind, key, error, **item):
+        now = datetime.utcnow()
+        mongo.db.dead_letters.update_one(
+            {'_id': f'{kind}:{key}'},
+            {'$set': {'kind': kind, 'key': key, 'item': item, 'error': error, 'last_failed_at': now},
+             '$inc': {'failures': 1},
+             '$setOnInsert': {'first_failed_at': now}},
+            upsert=True
+        )
+
+    @classmethod
+    def resolve(cls, kind, key):
+        mongo.db.dead_letters.delete_one({'_id': f'{kind}:{key}'})
+
+    @classmethod
+    def find(cls, kind=None, limit=100):
+        """Newest failures first"""
+        query = {'kind': kind} if kind else {}
+        return mongo.db.dead_letters.find(query).sort('last_failed_at', DESCENDING).limit(limit)
+
+    @classmethod
+    def retry(cls, kind=None):
+        """Drop the dead letters (of one kind), put parked commits back in the classification queue and replay failed pushes
+
+        Returns:
+            dict: kind -> number of dead letters cleared
+        """
+        query = {'kind': kind} if kind else {}
+        cleared = {}
+        for letter in mongo.db.dead_letters.find(query, {'kind': 1, 'key': 1, 'item': 1}):
+            cleared.setdefault(letter['kind'], []).append(letter)
+        # cleared first, so an item failing again gets a fresh dead letter
+        mongo.db.dead_letters.delete_many({'_id': {'$in': [f"{name}:{letter['key']}" for name, letters in cleared.items() for letter in letters]}})
+        if 'classify' in cleared:
+            LearningLog.unpark([letter['key'] for letter in cleared['classify']])
+        if 'webhook' in cleared:
+            from learning_log.services.webhook_handler import webhook_handler
+            webhook_handler.process([letter['item']['payload'] for letter in cleared['webhook']])
+        return {name: len(letters) for name, letters in cleared.items()}
+
+
+class CommitRollup:
+    """Totals per (repository, week, commit_type) bucket, updated incrementally with $inc upserts
+
+    Weeks are ISO weeks, stored as the UTC Monday they start on. Unclassified
+    commits sit in the commit_type None bucket until their classification moves them.
+    """
+
+    METRICS = ('commits', 'lines_added', 'lines_deleted', 'files_changed')
+    DIMENSIONS = ('repository', 'week', 'commit_type')
+
+    @staticmethod
+    def week_start(commit_date):
+        if commit_date.tzinfo:
+            commit_date = commit_date.astimezone(timezone.utc).replace(tzinfo=None)
+        day = datetime(commit_date.year, commit_date.month, commit_date.day)
+        return day - timedelta(days=day.weekday())
+
+    @classmethod
+    def _deltas(cls, logs, commit_type_of, sign):
+        deltas = {}
+        for log in logs:
+            bucket = (log['repository'], cls.week_start(log['commit_date']), commit_type_of(log))
+            totals = deltas.setdefault(bucket, dict.fromkeys(cls.METRICS, 0))
+            totals['commits'] += sign
+            for metric in cls.METRICS[1:]:
+                totals[metric] += sign * log.get(metric, 0)
+        return deltas
+
+    @classmethod
+    def _apply(cls, *delta_sets, collection=None):
+        operations = []
+        for deltas in delta_sets:
+            for (repository, week, commit_type), totals in deltas.items():
+                operations.append(UpdateOne(
+                    {'_id': {'repository': repository, 'week': week, 'commit_type': commit_type}},
+                    {'$inc': totals},
+                    upsert=True
+                ))
+        if operations:
+            (collection if collection is not None else mongo.db.commit_rollups).bulk_write(operations, ordered=False)
+
+    @classmethod
+    def add(cls, logs):
+        """Count newly inserted logs into their buckets"""
+        cls._apply(cls._deltas(logs, lambda log: log.get('commit_type'), 1))
+
+    @classmethod
+    def reclassify(cls, logs, types):
+        """Move logs from their previous commit_type bucket to the new one
+
+        Args:
+            logs (list): logs as stored before the update
+            types (dict): commit_hash -> new commit_type
+        """
+        cls._apply(
+            cls._deltas(logs, lambda log: log.get('commit_type'), -1),
+            cls._deltas(logs, lambda log: types[log['commit_hash']], 1)
+        )
+
+    @classmethod
+    def ensure_built(cls):
+        """Rebuild once if the rollups never were, so logs stored before they existed are counted
+
+        Returns:
+            int: rebuilt buckets, None when nothing needed doing
+        """
+        if not mongo.db.learning_logs.find_one({}, {'_id': 1}):
+            return None
+        try:
+            # the marker doubles as a claim, so processes starting together don't all rebuild
+            mongo.db.schema_migrations.insert_one({'_id': 'commit_rollups', 'started_at': datetime.utcnow()})
+        except DuplicateKeyError:
+            return None
+        logger.info("Commit rollups were never built, rebuilding them from learning_logs")
+        try:
+            return cls.rebuild()
+        except Exception:
+            mongo.db.schema_migrations.delete_one({'_id': 'commit_rollups', 'built_at': {'$exists': False}})
+            raise
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every bucket from learning_logs and swap the result in
+
+        The buckets go to a staging collection that is then renamed over commit_rollups
+        (not $out, so a failed run leaves the live rollups alone). Live $inc updates made
+        meanwhile go to the collection being replaced, so the scan stops at a high-water
+        mark and what was inserted or classified after it is replayed into staging until
+        a pass finds nothing new; only a write landing between that last pass and the
+        rename is missed (rebuild again if that matters).
+        """
+        # a minute of overlap covers clock skew between app servers (their clocks set _id and classified_at)
+        since = datetime.utcnow() - timedelta(minutes=1)
+        high_water = ObjectId.from_datetime(since)
+        buckets = {}
+        groups = mongo.db.learning_logs.aggregate([
+            {'$match': {'_id': {'$lt': high_water}}},
+            {'$group': {
+                '_id': {
+                    'repository': '$repository',
+                    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$commit_date'}},
+                    # classified past the mark: counted as unclassified here, whenever the scan saw it, and moved by the replay
+                    'commit_type': {'$cond': [{'$gte': ['$classified_at', since]}, None, '$commit_type']}
+                },
+                'commits': {'$sum': 1},
+                # v2 logs keep these under short keys
+                **{metric: {'$sum': {'$ifNull': [f'${LearningLog.SHORT_FIELDS[metric]}', f'${metric}']}} for metric in cls.METRICS[1:]}
+            }}
+        ])
+        # days roll up into weeks here; mid-migration, the same bucket also comes back once per stored layout
+        for group in groups:
+            key = (
+                LearningLog._decode_value('repository', group['_id']['repository']),
+                cls.week_start(datetime.strptime(group['_id']['day'], '%Y-%m-%d')),
+                LearningLog._decode_value('commit_type', group['_id']['commit_type'])
+            )
+            totals = buckets.setdefault(key, dict.fromkeys(cls.METRICS, 0))
+            for metric in cls.METRICS:
+                totals[metric] += group[metric]
+
+        staging = mongo.db.commit_rollups_rebuild
+        staging.drop()
+        if buckets:
+            staging.insert_many([
+                {'_id': dict(zip(cls.DIMENSIONS, key)), **totals} for key, totals in buckets.items()
+            ])
+        cls._replay(staging, high_water, since)
+
+        if staging.estimated_document_count():
+            staging.rename('commit_rollups', dropTarget=True)
+        else:
+            mongo.db.commit_rollups.drop()
+        mongo.db.schema_migrations.update_one(
+            {'_id': 'commit_rollups'}, {'$set': {'built_at': datetime.utcnow(), 'buckets': len(buckets)}}, upsert=True
+        )
+        LearningLog._bump_generation()
+        return len(buckets)
+
+    @classmethod
+    def _replay(cls, staging, high_water, since, max_passes=5):
+        """Apply logs inserted from `high_water` or classified from `since` on to the staging buckets"""
+        counted = {}  # _id -> commit_type it is counted under in staging
+        fields = LearningLog._projection(('commit_hash', 'commit_type', 'repository', 'commit_date', *cls.METRICS[1:]))
+        for _ in range(max_passes):
+            removed, added = [], []
+            for doc in mongo.db.learning_logs.find({'$or': [{'_id': {'$gte': high_water}}, {'classified_at': {'$gte': since}}]}, fields):
+                log = LearningLog.decode(doc)
+                if doc['_id'] in counted:
+                    previous = counted[doc['_id']]
+                    if previous == log.get('commit_type'):
+                        continue
+                    removed.append({**log, 'commit_type': previous})
+                elif doc['_id'] < high_water:
+                    # the scan counted it unclassified
+                    removed.append({**log, 'commit_type': None})
+                added.append(log)
+                counted[doc['_id']] = log.get('commit_type')
+            if not added:
+                return
+            cls._apply(
+                cls._deltas(removed, lambda log: log.get('commit_type'), -1),
+                cls._deltas(added, lambda log: log.get('commit_type'), 1),
+                collection=staging
+            )
+
+    @classmethod
+    def query(cls, group_by=DIMENSIONS, repository=None, commit_type=None, since=None):
+        """Sum buckets over the chosen dimensions, reading only the rollup collection
+
+        Args:
+            group_by (iterable, optional): subset of DIMENSIONS to keep (default: all)
+            repository (str, optional): only this repository
+            commit_type (str, optional): only this commit type
+            since (datetime, optional): only weeks starting on or after this date's week
+        """
+        match = {}
+        if repository:
+            match['_id.repository'] = repository
+        if commit_type:
+            match['_id.commit_type'] = commit_type
+        if since:
+            match['_id.week'] = {'$gte': cls.week_start(since)}
+
+        return mongo.db.commit_rollups.aggregate([
+            {'$match': match},
+            {'$group': {
+                '_id': {dimension: f'$_id.{dimension}' for dimension in group_by},
+                **{metric: {'$sum': f'${metric}'} for metric in cls.METRICS}
+            }},
+            {'$match': {'commits': {'$gt': 0}}},  # buckets emptied by reclassification
+            {'$sort': {f'_id.{dimension}': 1 for dimension in group_by} or {'_id': 1}}
+        ])
@@ -1,7 +1,17 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime
 from .services.commit_extractor import CommitExtractor
-from .models import LearningLog
-import os
+from .services.classification_cache import classification_cache
+from .services.response_cache import cached_response
+from .services.webhook_handler import webhook_handler
+from .services.sync_jobs import sync_jobs, job_progress
+from .services.metrics import metrics
+from .services.search import commit_search
+from .models import LearningLog, CommitRollup, SyncJob, SyncState
+import base64
+import json
 
 bp = Blueprint('main', __name__)
 
@@ -9,41 +19,234 @@ bp = Blueprint('main', __name__)
 def index():
     return 'Learning Log'
 
+@bp.route('/metrics')
+def get_metrics():
+    # GitHub / Mongo / OpenAI latencies, stage histograms and counters for Prometheus to scrape
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 ''' STAGE 1: COMMIT EXTRACTION AND STORAGE '''
 
 @bp.route('/testExtractor')
 def testCommitExtractor():
-    extractor = CommitExtractor(os.getenv('GITHUB_TOKEN'))
+    extractor = CommitExtractor()
     return jsonify(extractor.test_extractor())
 
 @bp.route('/testDB')
 def testDB():
-    extractor = CommitExtractor(os.getenv('GITHUB_TOKEN'))
+    extractor = CommitExtractor()
     return extractor.test_db()
 
 @bp.route('/testExtractorAndStore')
 def testExtractorAndStore():
-    extractor = CommitExtractor(os.getenv('GITHUB_TOKEN'))
+    extractor = CommitExtractor()
     return extractor.test_extractor_and_store()
 
 @bp.route('/sync')
 def sync_logs():
-    # create extractor instance with github token
-    extractor = CommitExtractor(os.getenv('GITHUB_TOKEN'))
-    # call the sync_logs method
-    return extractor.sync_logs()
+    # runs in the background, poll /sync/<job_id> for progress;
+    # ?full=1 ignores the stored per-repo cursors and ?workers=N overrides the SYNC_WORKERS pool size;
+    # ?classify=1 runs the pipelined sync that classifies new commits as they're stored
+    job, created = sync_jobs.submit(
+        full=request.args.get('full', '0') == '1',
+        workers=request.args.get('workers', type=int),
+        classify=request.args.get('classify', '0') == '1'
+    )
+    # only one sync at a time: a second request gets the job that's already running
+    return jsonify({'job_id': str(job['_id']), 'created': created}), 202
+
+@bp.route('/sync/<job_id>')
+def sync_status(job_id):
+    try:
+        job = SyncJob.get(ObjectId(job_id))
+    except InvalidId:
+        return jsonify({'error': 'Invalid job id'}), 400
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_progress(job))
 
 
 ''' END STAGE 1 '''
 
+''' STAGE 2: COMMIT CLASSIFICATION '''
+
+@bp.route('/classification/stats')
+def classification_stats():
+    # where classifications came from: rules, in-memory cache, Mongo cache or the model
+    return jsonify(classification_cache.stats())
+
+''' END STAGE 2 '''
+
+''' STAGE 3: REAL-TIME UPDATES '''
+
+@bp.route('/webhook/github', methods=['POST'])
+def github_webhook():
+    # verify and queue only; the webhook worker does the storing
+    if not webhook_handler.verify_signature(request.get_data(), request.headers.get('X-Hub-Signature-256')):
+        return jsonify({'error': 'Invalid signature'}), 401
+    
+    event = request.headers.get('X-GitHub-Event')
+    if event == 'ping':
+        return jsonify({'status': 'pong'})
+    if event != 'push':
+        return jsonify({'status': 'ignored', 'event': event}), 202
+    
+    # GitHub sends either content type, depending on the hook's settings
+    if request.is_json:
+        payload = request.get_json(silent=True)
+    else:
+        try:
+            payload = json.loads(request.form.get('payload', ''))
+        except ValueError:
+            payload = None
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON body or a form-encoded payload field'}), 400
+
+    if not webhook_handler.enqueue(payload):
+        # queue is full: fail the delivery so it shows up for redelivery on GitHub
+        return jsonify({'status': 'dropped'}), 503
+    return jsonify({'status': 'queued'}), 202
+
+@bp.route('/webhook/stats')
+def webhook_stats():
+    return jsonify(webhook_handler.stats())
+
+''' END STAGE 3 '''
+
+''' STAGE 5: API INTEGRATION '''
+
+# page size bounds for /logs
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def _serialize_log(log):
+    return LearningLog.to_public(log)
+
+def _encode_cursor(log):
+    payload = json.dumps({'d': log['commit_date'].isoformat(), 'i': str(log['_id'])})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def _decode_cursor(cursor):
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    # valid base64 json isn't enough, a hand-made cursor can be any shape
+    if not isinstance(payload, dict) or not isinstance(payload.get('d'), str) or not isinstance(payload.get('i'), str):
+        raise ValueError(f"Malformed cursor: {cursor}")
+    return datetime.fromisoformat(payload['d']), ObjectId(payload['i'])
+
 @bp.route('/logs')
+@cached_response
 def get_logs():
-    logs = LearningLog.query.order_by(LearningLog.commit_date.desc()).all()
-    return jsonify([{
-        'id': log.id,
-        'commit_hash': log.commit_hash,
-        'commit_message': log.commit_message,
-        'commit_date': log.commit_date.isoformat(),
-        'repository': log.repository,
-        'created_at': log.created_at.isoformat()
-    } for log in logs]) 
\ No newline at end of file
+    """Newest-first learning logs
+
+    Query params: limit, cursor (next_cursor of the previous page), repository,
+    commit_type, author_account, and format=ndjson to stream every matching log for export.
+    """
+    filters = {
+        'repository': request.args.get('repository'),
+        'commit_type': request.args.get('commit_type'),
+        'author_account': request.args.get('author_account')
+    }
+    
+    if request.args.get('format') == 'ndjson':
+        logs = LearningLog.find_page(batch_size=500, **filters)
+        # one line per document as the cursor advances, never the whole result in memory
+        return Response(
+            stream_with_context(json.dumps(_serialize_log(log)) + '\n' for log in logs),
+            mimetype='application/x-ndjson'
+        )
+    
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = _decode_cursor(request.args['cursor'])
+        except (ValueError, KeyError, TypeError, InvalidId):
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    # one extra row tells us whether there is a next page
+    logs = list(LearningLog.find_page(limit=limit + 1, after=after, **filters))
+    next_cursor = _encode_cursor(logs[limit - 1]) if len(logs) > limit else None
+    return jsonify({
+        'logs': [_serialize_log(log) for log in logs[:limit]],
+        'next_cursor': next_cursor
+    })
+
+@bp.route('/search')
+@cached_response
+def search_logs():
+    """Commits whose message matches `q`, best match first
+
+    Query params: q (required), sort (relevance or date), limit, cursor (next_cursor
+    of the previous page), repository, commit_type, author_account, since and until (ISO dates).
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({'error': 'q is required'}), 400
+    by_date = request.args.get('sort', 'relevance') == 'date'
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    try:
+        # naive UTC like the stored dates
+        since = SyncState.utc(datetime.fromisoformat(request.args['since'])) if request.args.get('since') else None
+        until = SyncState.utc(datetime.fromisoformat(request.args['until'])) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid since/until date'}), 400
+    after = None
+    if request.args.get('cursor'):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(request.args['cursor'].encode()))
+            after = (datetime.fromisoformat(payload['v']) if by_date else float(payload['v']), ObjectId(payload['i']))
+        except (ValueError, KeyError, TypeError, InvalidId):
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    # one extra row tells us whether there is a next page
+    backend, logs = commit_search.search(
+        text, limit + 1, after, by_date,
+        repository=request.args.get('repository'),
+        commit_type=request.args.get('commit_type'),
+        author_account=request.args.get('author_account'),
+        since=since,
+        until=until
+    )
+    next_cursor = None
+    if len(logs) > limit:
+        last = logs[limit - 1]
+        value = last['commit_date'].isoformat() if by_date else last['score']
+        next_cursor = base64.urlsafe_b64encode(json.dumps({'v': value, 'i': str(last['_id'])}).encode()).decode()
+    return jsonify({
+        'results': [{**_serialize_log(log), 'score': round(log['score'], 4)} for log in logs[:limit]],
+        'next_cursor': next_cursor,
+        'backend': backend
+    })
+
+@bp.route('/stats')
+@cached_response
+def get_stats():
+    """Commit and line totals from the rollups, never scanning learning_logs
+
+    Query params: group_by (comma separated repository, week, commit_type; default all),
+    repository, commit_type, since (ISO date).
+    """
+    group_by = [dimension for dimension in request.args.get('group_by', ','.join(CommitRollup.DIMENSIONS)).split(',') if dimension]
+    if any(dimension not in CommitRollup.DIMENSIONS for dimension in group_by):
+        return jsonify({'error': f"group_by must be among {', '.join(CommitRollup.DIMENSIONS)}"}), 400
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid since date'}), 400
+    
+    buckets = CommitRollup.query(
+        group_by=group_by,
+        repository=request.args.get('repository'),
+        commit_type=request.args.get('commit_type'),
+        since=since
+    )
+    
+    def serialize(bucket):
+        keys = dict(bucket['_id'])
+        if 'week' in keys:
+            year, week, _ = keys['week'].isocalendar()
+            keys['week'] = f"{year}-W{week:02d}"
+        return {**keys, **{metric: bucket[metric] for metric in CommitRollup.METRICS}}
+    
+    return jsonify({'group_by': group_by, 'buckets': [serialize(bucket) for bucket in buckets]})
+
+''' END STAGE 5 '''
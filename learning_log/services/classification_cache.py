@@ -0,0 +1,105 @@
+''' Persistent classification cache keyed by normalized commit message '''
+
+from collections import OrderedDict
+from datetime import datetime
+from pymongo import UpdateOne
+import hashlib
+import logging
+import os
+import re
+import threading
+from learning_log import mongo
+
+logger = logging.getLogger(__name__)
+
+_SHA_RE = re.compile(r'\b[0-9a-f]{7,40}\b')
+_NUMBER_RE = re.compile(r'\d+')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_message(message):
+    """Lowercase, collapse whitespace and mask shas/numbers so near-identical messages share a key"""
+    message = _SHA_RE.sub('<sha>', message.strip().lower())
+    message = _NUMBER_RE.sub('<n>', message)
+    return _SPACE_RE.sub(' ', message)
+
+
+def message_key(message):
+    return hashlib.sha1(normalize_message(message).encode('utf-8')).hexdigest()
+
+
+class ClassificationCache:
+    """In-process LRU in front of the `classification_cache` collection
+
+    Counters track where each classification came from: rules, memory, Mongo or a miss (model call).
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or int(os.getenv('CLASSIFICATION_CACHE_SIZE', 10000))
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'rule_hits': 0, 'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, 'memory_entries': len(self.entries)}
+
+    def _remember(self, key, commit_type):
+        # caller holds the lock
+        self.entries[key] = commit_type
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get_many(self, keys):
+        """Cached types for message keys, memory first then one Mongo query for the rest
+
+        Returns:
+            dict: key -> commit type, only for keys that were found
+        """
+        found = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+                else:
+                    missing.append(key)
+            self.counters['memory_hits'] += len(found)
+
+        if missing:
+            for doc in mongo.db.classification_cache.find({'_id': {'$in': missing}}, {'commit_type': 1}):
+                found[doc['_id']] = doc['commit_type']
+            with self.lock:
+                db_hits = sum(1 for key in missing if key in found)
+                self.counters['db_hits'] += db_hits
+                self.counters['misses'] += len(missing) - db_hits
+                for key in missing:
+                    if key in found:
+                        self._remember(key, found[key])
+        return found
+
+    def set_many(self, types):
+        """Store key -> commit type pairs in memory and Mongo"""
+        if not types:
+            return
+        with self.lock:
+            for key, commit_type in types.items():
+                self._remember(key, commit_type)
+        mongo.db.classification_cache.bulk_write([
+            UpdateOne(
+                {'_id': key},
+                {'$set': {'commit_type': commit_type, 'updated_at': datetime.utcnow()}},
+                upsert=True
+            )
+            for key, commit_type in types.items()
+        ], ordered=False)
+
+
+# shared by every CommitClassifier so the LRU and counters outlive a single request
+classification_cache = ClassificationCache()
@@ -1,9 +1,17 @@
 ''' STAGE 2: COMMIT CLASSIFICATION '''
 
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
+import re
 import logging
 from learning_log.models import LearningLog
+from learning_log.clients import get_openai
+from .rate_limiter import RateLimiter
+from .classification_cache import classification_cache, message_key
+from .local_classifier import local_classifier
+from .metrics import OPENAI_REQUEST_SECONDS, OPENAI_REQUEST_ERRORS, OPENAI_TOKENS, STAGE_SECONDS, COMMITS
+from .resilience import CircuitOpen, openai_service
 
 COMMIT_TYPES = {
     1: 'New feature or functionality addition',
@@ -17,25 +25,31 @@ COMMIT_TYPES = {
     9: 'Dependency updates'
 }
 
-logger = logging.getLogger(__name__)
+# types the model may answer with
+MODEL_TYPES = range(1, 10)
 
-class CommitClassifier:
-    # Initialize OpenAI client
-    openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-    
-    def __init__(self):
-        self.client = OpenAI()
+# Conventional Commits type -> COMMIT_TYPES key; chore/ci/revert are left to the model
+CONVENTIONAL_TYPES = {
+    'feat': 1,
+    'feature': 1,
+    'fix': 2,
+    'bugfix': 2,
+    'refactor': 3,
+    'test': 4,
+    'tests': 4,
+    'docs': 5,
+    'doc': 5,
+    'style': 7,
+    'perf': 8,
+    'deps': 9,
+    'build': 9
+}
 
-    def classify_commit(self, commit_message):
-        """Classify commit using OpenAI"""
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a commit classifier. Respond with a number 1-9 based on the commit type."},
-                    {"role": "user", "content": f"""
-                        Classify this commit message into one of these types:
-                        1: Feature - New functionality
+CONVENTIONAL_RE = re.compile(r'^(\w+)(?:\(([^)]*)\))?!?:\s')
+MERGE_RE = re.compile(r"^merge (branch|pull request|remote-tracking branch|tag|commit) |^merge .+ into ", re.IGNORECASE)
+DEPENDENCY_RE = re.compile(r'^(bump|update|upgrade) \S+ (from \S+ )?to \S+|^update dependency ', re.IGNORECASE)
+
+TYPE_LIST = """1: Feature - New functionality
                         2: Bugfix - Bug fixes
                         3: Refactor - Code restructuring
                         4: Test - Testing changes
@@ -43,37 +57,261 @@ class CommitClassifier:
                         6: Integration - External services
                         7: Style - Formatting
                         8: Performance - Optimizations
-                        9: Dependencies - Package updates
+                        9: Dependencies - Package updates"""
+
+# longer messages are cut before they go into a batch prompt
+MAX_MESSAGE_CHARS = 500
+
+logger = logging.getLogger(__name__)
+
+def estimate_tokens(text):
+    """Rough token count (~4 chars per token), good enough for budgeting"""
+    return len(text) // 4 + 1
+
+def rule_based_type(commit_message):
+    """Deterministic type for messages that don't need the model, None otherwise"""
+    subject = commit_message.strip().split('\n', 1)[0]
+    if MERGE_RE.match(subject):
+        # a merge brings in commits that are classified on their own, it adds no behavior itself
+        return COMMIT_TYPES[3]
+    if DEPENDENCY_RE.match(subject):
+        return COMMIT_TYPES[9]
+
+    match = CONVENTIONAL_RE.match(subject)
+    if match:
+        prefix, scope = match.group(1).lower(), (match.group(2) or '').lower()
+        if scope in ('deps', 'deps-dev'):  # e.g. chore(deps): bump x
+            return COMMIT_TYPES[9]
+        if prefix in CONVENTIONAL_TYPES:
+            return COMMIT_TYPES[CONVENTIONAL_TYPES[prefix]]
+    return None
+
+class CommitClassifier:
+    def __init__(self, concurrency=None, batch_tokens=None, batch_size=None, client=None, local=None):
+        """
+        Args:
+            concurrency (int, optional): batch requests in flight (default: CLASSIFIER_CONCURRENCY or 4)
+            batch_tokens (int, optional): prompt token budget per batch (default: CLASSIFIER_BATCH_TOKENS or 3000)
+            batch_size (int, optional): max messages per batch (default: CLASSIFIER_BATCH_SIZE or 50)
+            client (OpenAI, optional): chat completions client (default: the shared pooled client)
+            local (LocalClassifier, optional): answers confident predictions before the model (default: the shared one)
+        """
+        self.client = client or get_openai()
+        self.cache = classification_cache
+        self.local = local or local_classifier
+        self.concurrency = concurrency or int(os.getenv('CLASSIFIER_CONCURRENCY', 4))
+        self.batch_tokens = batch_tokens or int(os.getenv('CLASSIFIER_BATCH_TOKENS', 3000))
+        self.batch_size = batch_size or int(os.getenv('CLASSIFIER_BATCH_SIZE', 50))
+        # tokens-per-minute budget shared by all concurrent batches
+        tokens_per_minute = int(os.getenv('CLASSIFIER_TOKENS_PER_MINUTE', 60000))
+        self.token_budget = RateLimiter(
+            max_rate=tokens_per_minute / 60,
+            burst=max(self.batch_tokens * self.concurrency, 1),
+            reserve=0
+        )
+
+    def _parse_type(self, type_num):
+        type_num = int(type_num)
+        if type_num not in MODEL_TYPES:
+            raise ValueError(f"Type out of range: {type_num}")
+        return COMMIT_TYPES[type_num]
+
+    def _complete(self, kind, **kwargs):
+        """One chat completion, timed and with its token usage counted, retried by the shared openai_service"""
+        def attempt():
+            try:
+                with OPENAI_REQUEST_SECONDS.time(kind=kind):
+                    return self.client.chat.completions.create(**kwargs)
+            except Exception:
+                OPENAI_REQUEST_ERRORS.inc(kind=kind)
+                raise
+        
+        response = openai_service.call(attempt)
+        if getattr(response, 'usage', None):
+            OPENAI_TOKENS.inc(response.usage.prompt_tokens, kind='prompt')
+            OPENAI_TOKENS.inc(response.usage.completion_tokens, kind='completion')
+        return response
+
+    def classify_commit(self, commit_message):
+        """Classify one commit: rules, then cache, then OpenAI (None if that failed)"""
+        return self.classify_batch([commit_message])[0]
+
+    def _request_single(self, commit_message):
+        """Classify one commit with OpenAI, raises if there's no usable answer"""
+        self.token_budget.acquire(estimate_tokens(commit_message) + 150)  # prompt template + answer
+        response = self._complete(
+            'single',
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "You are a commit classifier. Respond with a number 1-9 based on the commit type."},
+                {"role": "user", "content": f"""
+                        Classify this commit message into one of these types:
+                        {TYPE_LIST}
 
                         Commit message: {commit_message}
 
                         Respond with a JSON object containing only a 'type' field with a number 1-9."""}
-                ],
-                max_tokens=20,  # need very few tokens now
-                temperature=0.3,
-                response_format={ "type": "json_object" }
-            )
-            type_num = response.choices[0].message.content.strip()['type']
-            return COMMIT_TYPES[type_num]
+            ],
+            max_tokens=20,  # need very few tokens now
+            temperature=0.3,
+            response_format={ "type": "json_object" }
+        )
+        type_num = json.loads(response.choices[0].message.content)['type']
+        return self._parse_type(type_num)
+
+    def _request_batch(self, messages):
+        """One chat completion for a whole batch, raises if the answer doesn't line up"""
+        numbered = '\n'.join(f"{i + 1}. {json.dumps(message)}" for i, message in enumerate(messages))
+        prompt = f"""
+                        Classify each of these {len(messages)} commit messages into one of these types:
+                        {TYPE_LIST}
+
+                        Commit messages:
+                        {numbered}
+
+                        Respond with a JSON object containing only a 'types' field: an array of
+                        {len(messages)} numbers 1-9, in the same order as the messages."""
+
+        max_tokens = 4 * len(messages) + 20
+        self.token_budget.acquire(estimate_tokens(prompt) + max_tokens)
+        response = self._complete(
+            'batch',
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "You are a commit classifier. Respond with one number 1-9 per commit based on the commit type."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            temperature=0.3,
+            response_format={ "type": "json_object" }
+        )
+        types = json.loads(response.choices[0].message.content)['types']
+        if len(types) != len(messages):
+            raise ValueError(f"Expected {len(messages)} types, got {len(types)}")
+        return [self._parse_type(type_num) for type_num in types]
+
+    def _classify_chunk(self, messages):
+        """Classify one batch, splitting it in half and retrying when the answer is unusable
+        
+        Returns:
+            list: commit type, or the exception that stopped it, per message
+        """
+        if len(messages) == 1:
+            try:
+                return [self._request_single(messages[0])]
+            except Exception as e:
+                logger.error(f"Classification error: {str(e)}")
+                return [e]
+        try:
+            return self._request_batch(messages)
         except Exception as e:
-            logger.error(f"Classification error: {str(e)}")
-            return "UNKNOWN"
+            if isinstance(e, CircuitOpen) or openai_service.is_transient(e):
+                # the service is down (retries already spent), smaller requests would only add load
+                logger.error(f"Batch of {len(messages)} failed: {str(e)}")
+                return [e] * len(messages)
+            logger.warning(f"Batch of {len(messages)} failed, splitting: {str(e)}")
+            middle = len(messages) // 2
+            return self._classify_chunk(messages[:middle]) + self._classify_chunk(messages[middle:])
+
+    def _pack(self, messages):
+        """Group messages into batches that fit the per-batch token budget and size"""
+        batches, batch, batch_tokens = [], [], 0
+        for message in messages:
+            message = message[:MAX_MESSAGE_CHARS]
+            tokens = estimate_tokens(message) + 5  # numbering and quoting overhead
+            if batch and (batch_tokens + tokens > self.batch_tokens or len(batch) >= self.batch_size):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(message)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def classify_batch(self, messages, errors=None):
+        """Classify many commit messages with few requests
+
+        Rules and the cache answer first, then the local classifier where it's
+        confident; each remaining distinct message is sent to the model once, packed into batches (one chat completion each) that run
+        `concurrency` at a time under the shared token budget.
+
+        Args:
+            messages (list): commit messages
+            errors (dict, optional): gets index -> error message for every message that couldn't be classified
+
+        Returns:
+            list: commit type per message, in order (None where classification failed)
+        """
+        types = [None] * len(messages)
+        pending = {}  # message key -> indexes of messages sharing it
+        for i, message in enumerate(messages):
+            commit_type = rule_based_type(message)
+            if commit_type:
+                types[i] = commit_type
+            else:
+                pending.setdefault(message_key(message), []).append(i)
+        self.cache.count('rule_hits', len(messages) - sum(len(indexes) for indexes in pending.values()))
+
+        for key, commit_type in self.cache.get_many(list(pending)).items():
+            for i in pending.pop(key):
+                types[i] = commit_type
+
+        # local predictions aren't cached: a retrained model may answer differently
+        keys = list(pending)
+        local_count = 0
+        for n, commit_type in self.local.predict_many([messages[pending[key][0]] for key in keys]).items():
+            for i in pending.pop(keys[n]):
+                types[i] = commit_type
+                local_count += 1
+
+        keys = list(pending)
+        with STAGE_SECONDS.time(stage='classify'):
+            model_types = self._classify_with_model([messages[pending[key][0]] for key in keys])
+        model_count = failed_count = 0
+        for key, commit_type in zip(keys, model_types):
+            failed = isinstance(commit_type, Exception)
+            for i in pending[key]:
+                types[i] = None if failed else commit_type
+                if failed and errors is not None:
+                    errors[i] = str(commit_type) or type(commit_type).__name__
+            if failed:
+                failed_count += len(pending[key])
+            else:
+                model_count += len(pending[key])
+        COMMITS.inc(len(messages) - model_count - failed_count - local_count, stage='classify', result='rule_or_cache')
+        COMMITS.inc(local_count, stage='classify', result='local')
+        COMMITS.inc(model_count, stage='classify', result='model')
+        COMMITS.inc(failed_count, stage='classify', result='failed')
+
+        # failures aren't cached so they get another chance next time
+        self.cache.set_many({key: commit_type for key, commit_type in zip(keys, model_types) if not isinstance(commit_type, Exception)})
+        return types
+
+    def _classify_with_model(self, messages):
+        """Send messages to OpenAI in concurrent token-budgeted batches"""
+        batches = self._pack(messages)
+        if not batches:
+            return []
+
+        logger.info(f"Classifying {len(messages)} commits in {len(batches)} batches...")
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='classify') as pool:
+            return [commit_type for types in pool.map(self._classify_chunk, batches) for commit_type in types]
 
     def test_classification(self, limit=15):
         """Test classification on a few commits without storing results"""
         logger.info(f"Testing classification with {limit} commits...")
         results = []
-        
+
         # Get some unclassified commits
-        unclassified = LearningLog.find_unclassified(limit=limit)
-        
-        for commit in unclassified:
-            predicted_type = self.classify_commit(commit['commit_message'])
+        unclassified = list(LearningLog.find_unclassified(limit=limit))
+        predicted_types = self.classify_batch([commit['commit_message'] for commit in unclassified])
+
+        for commit, predicted_type in zip(unclassified, predicted_types):
             results.append({
                 'commit_hash': commit['commit_hash'],
                 'commit_message': commit['commit_message'],
                 'predicted_type': predicted_type
             })
             logger.info(f"Classified '{commit['commit_message'][:50]}...' as {predicted_type}")
-        
-        return results 
\ No newline at end of file
+
+        return results
@@ -0,0 +1,111 @@
+''' Commit stats (lines added/deleted, files changed) for many commits per request '''
+
+import logging
+import github
+
+logger = logging.getLogger(__name__)
+
+
+def summarize_files(file_changes):
+    """Collapse per-file changes into the counts stored on a learning log"""
+    return {
+        'files_changed': len(file_changes),
+        'lines_added': sum(f['additions'] for f in file_changes),
+        'lines_deleted': sum(f['deletions'] for f in file_changes)
+    }
+
+
+class RestCommitDetailFetcher:
+    """One REST request per commit via lazy `commit.files`, fanned out over the extractor's pool"""
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+
+    def fetch_stats(self, repo, commits):
+        """Stats for a page of commits
+
+        Returns:
+            dict: sha -> {'files_changed', 'lines_added', 'lines_deleted'}
+        """
+        files = self.extractor._fetch_files(commits)
+        return {commit.sha: summarize_files(file_changes) for commit, file_changes in zip(commits, files)}
+
+
+class GraphQLCommitDetailFetcher:
+    """Stats for up to `batch_size` commits per GraphQL query, REST for anything it can't answer"""
+
+    def __init__(self, extractor, batch_size=100, fallback=None):
+        self.extractor = extractor
+        self.batch_size = batch_size
+        self.fallback = fallback or RestCommitDetailFetcher(extractor)
+
+    def _build_query(self, shas):
+        # one aliased object lookup per sha, all in a single round trip
+        lookups = '\n'.join(
+            f'c{i}: object(oid: "{sha}") {{ ... on Commit {{ additions deletions changedFilesIfAvailable }} }}'
+            for i, sha in enumerate(shas)
+        )
+        return f'''query($owner: String!, $name: String!) {{
+            repository(owner: $owner, name: $name) {{
+                {lookups}
+            }}
+        }}'''
+
+    def fetch_stats(self, repo, commits):
+        """Stats for a page of commits
+
+        Returns:
+            dict: sha -> {'files_changed', 'lines_added', 'lines_deleted'}
+        """
+        stats = {}
+        missing = []
+        for start in range(0, len(commits), self.batch_size):
+            chunk = commits[start:start + self.batch_size]
+            # any token can read a public repo, so this goes through the one with the most quota left
+            account = self.extractor.pool.for_repo(repo)
+            try:
+                _, data = self.extractor._call(
+                    account.client.requester.graphql_query,
+                    self._build_query([commit.sha for commit in chunk]),
+                    {'owner': repo.owner.login, 'name': repo.name},
+                    account=account
+                )
+            except github.GithubException as e:
+                logger.warning(f"GraphQL commit details failed for {repo.name}, using REST: {str(e)}")
+                missing.extend(chunk)
+                continue
+
+            nodes = (data.get('data') or {}).get('repository')
+            if data.get('errors') or not nodes:
+                # repository is null when this token can't see the repo
+                logger.warning(f"GraphQL commit details unavailable for {repo.name}, using REST: {data.get('errors') or 'no repository'}")
+                missing.extend(chunk)
+                continue
+            for i, commit in enumerate(chunk):
+                node = nodes.get(f'c{i}')
+                # changedFilesIfAvailable is null for very large commits
+                if not node or node.get('changedFilesIfAvailable') is None:
+                    missing.append(commit)
+                    continue
+                stats[commit.sha] = {
+                    'files_changed': node['changedFilesIfAvailable'],
+                    'lines_added': node['additions'],
+                    'lines_deleted': node['deletions']
+                }
+
+        if missing:
+            stats.update(self.fallback.fetch_stats(repo, missing))
+        return stats
+
+
+DETAIL_FETCHERS = {
+    'graphql': GraphQLCommitDetailFetcher,
+    'rest': RestCommitDetailFetcher
+}
+
+
+def make_detail_fetcher(extractor, name='graphql'):
+    """Build the fetcher registered under `name` (COMMIT_DETAIL_FETCHER)"""
+    if name not in DETAIL_FETCHERS:
+        raise ValueError(f"Unknown commit detail fetcher: {name}")
+    return DETAIL_FETCHERS[name](extractor)
@@ -1,253 +1,450 @@
 ''' STAGE 1: COMMIT EXTRACTION AND STORAGE '''
 
-from github import Github, Auth
 from datetime import datetime
-from ..models import LearningLog
+from fnmatch import fnmatchcase
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from ..models import LearningLog, SyncState, DeadLetter
+from ..clients import get_github, get_token_pool
+from .token_pool import GitHubAccount, TokenPool
+from .commit_details import make_detail_fetcher
+from .metrics import GITHUB_REQUEST_SECONDS, GITHUB_REQUEST_ERRORS, GITHUB_RATE_LIMIT_REMAINING, STAGE_SECONDS, COMMITS, ProgressLog
+from .resilience import github_service, retry_after
+from .snapshot import snapshot_exporter
 import os
 from flask import jsonify
 import logging
+import time
 import github
 
 logger = logging.getLogger(__name__)
 
+# commits per listing page, 100 is the most GitHub allows
+PER_PAGE = 100
+
+# Repos to exclude (school/assignment repos), EXCLUDED_REPOS (comma separated, globs allowed) replaces these
+DEFAULT_EXCLUDED_REPOS = (
+    'fa23-lab-Martinlacsamana',
+    'fa23-proj1-a-khani',
+    'fa23-proj2-Martinlacsamana',
+    'fa23-proj3-a-khani',
+    'fa23-proj4-Martinlacsamana',
+    'prog-02-programming-practice-starter',
+    'programming-assignment-1-modal-medley-Martinlacsamana',
+    'programming-assignment-2-programming-practice-Martinlacsamana',
+    'programming-assignment-3-speedy-smarts-Martinlacsamana',
+    'programming-assignment-3-speedy-smarts-starter',
+    'sp24-proj2-martin',
+    'fa24-proj0-Martinlacsamana',
+    'fa24-proj1-Martinlacsamana',
+    'fa24-proj2-Martinlacsamana',
+    'fa24-proj3-Martinlacsamana',
+    'fa24-proj4-Martinlacsamana',
+    'fa24-proj5-Martinlacsamana',
+    'fa24-proj6-Martinlacsamana',
+    'enigma-transit'
+)
+
+
+class RepoMatcher:
+    """Matches repo names against exact names and glob patterns (fnmatch, case-sensitive)"""
+
+    def __init__(self, patterns):
+        patterns = [pattern.strip() for pattern in patterns if pattern.strip()]
+        self.names = {pattern for pattern in patterns if not any(char in pattern for char in '*?[')}
+        self.globs = [pattern for pattern in patterns if pattern not in self.names]
+
+    @classmethod
+    def excluded_from_env(cls):
+        patterns = os.getenv('EXCLUDED_REPOS')
+        return cls(patterns.split(',') if patterns is not None else DEFAULT_EXCLUDED_REPOS)
+
+    def __call__(self, name):
+        return name in self.names or any(fnmatchcase(name, pattern) for pattern in self.globs)
+
+
 class CommitExtractor:
-    def __init__(self, github_token):
-        # store token in instance to avoid reading env multiple times
-        self.github_token = github_token
-        self.github = Github(auth=Auth.Token(github_token))
+    def __init__(self, github_token=None, workers=None, pool=None):
+        """
+        Args:
+            github_token (str, optional): sync only this token's account instead of the configured ones
+            workers (int, optional): concurrent repo/commit fetches (default: SYNC_WORKERS env or 4)
+            pool (TokenPool, optional): accounts to sync (default: GITHUB_ACCOUNTS, see clients.get_token_pool)
+        """
+        if pool is None:
+            pool = TokenPool([GitHubAccount(None, github_token)]) if github_token else get_token_pool()
+        self.pool = pool
+        # the primary account's client, for lookups that don't belong to a particular account
+        self.github = pool.primary.client
+        self.workers = workers or int(os.getenv('SYNC_WORKERS', 4))
+        self.is_excluded = RepoMatcher.excluded_from_env()
+        self._detail_pool = None
+        # commit stats for sync; per-file data is only loaded by the paths that return it
+        self.detail_fetcher = make_detail_fetcher(self, os.getenv('COMMIT_DETAIL_FETCHER', 'graphql'))
     
-    def fetch_filtered_commits(self, username=None):
-        """Fetch all commits from non-excluded GitHub repos
+    def _call(self, fn, *args, account=None, **kwargs):
+        """Run one GitHub request through its account's rate limiter, timed per call name
+        
+        Transient failures are retried by the shared github_service (backoff, circuit breaker).
+        `account` is the one whose client `fn` belongs to (default: the primary account).
+        """
+        account = account or self.pool.primary
+        call = getattr(fn, '__name__', 'request')
+        
+        def attempt():
+            account.rate_limiter.acquire()
+            try:
+                with GITHUB_REQUEST_SECONDS.time(call=call):
+                    return fn(*args, **kwargs)
+            except github.GithubException as e:
+                GITHUB_REQUEST_ERRORS.inc(call=call, status=e.status)
+                wait = retry_after(e) if e.status in (403, 429) else None
+                if wait:
+                    # rate limited: every worker on this token waits, not just the retrying one
+                    account.rate_limiter.update(0, time.time() + wait)
+                raise
+        
+        result = github_service.call(attempt)
+        account.rate_limiter.update_from_github(account.client)
+        GITHUB_RATE_LIMIT_REMAINING.set(account.remaining(), account=account.username or 'default')
+        return result
+    
+    @contextmanager
+    def _worker_pools(self, workers=None):
+        """Thread pools for a concurrent run: one for repos, one for commit details
+        
+        Details get their own pool so repo workers can wait on them without deadlocking.
+        """
+        workers = workers or self.workers
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='repo') as repo_pool, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix='commit-detail') as detail_pool:
+            self._detail_pool = detail_pool
+            try:
+                yield repo_pool
+            finally:
+                self._detail_pool = None
+    
+    def _iter_commit_pages(self, repo, start_page=0, **kwargs):
+        """Yield a repo's commits one listing page at a time, each page through the rate limiter
+        
+        Every page goes through the token the pool picks for it at that moment.
+        """
+        owner = self.pool.owner_of(repo)
+        listings = {}  # account -> the listing over that account's client
+        page = start_page
+        while True:
+            account = self.pool.for_repo(repo)
+            if account not in listings:
+                # lazy: rebinding the repo to another token costs no request
+                bound = repo if account is owner else account.client.get_repo(repo.full_name, lazy=True)
+                listings[account] = bound.get_commits(**kwargs)
+            commits = self._call(listings[account].get_page, page, account=account)
+            if not commits:
+                return
+            yield commits
+            if len(commits) < PER_PAGE:
+                return
+            page += 1
+    
+    def _commit_files(self, commit):
+        """Per-file changes of one commit (lazy `commit.files` costs one request)"""
+        def commit_files():
+            return [{
+                'filename': f.filename,
+                'additions': f.additions,
+                'deletions': f.deletions,
+            } for f in commit.files]
+        return self._call(commit_files, account=self.pool.owner_of(commit))
+    
+    def _fetch_files(self, commits):
+        """Per-file changes for a page of commits, fanned out over the detail pool when one is running"""
+        if self._detail_pool is None:
+            return [self._commit_files(commit) for commit in commits]
+        return list(self._detail_pool.map(self._commit_files, commits))
+    
+    def iter_repos(self, user, repos=None, account=None):
+        """Yield the repositories to extract from, lazily
         
         Args:
-            username (str, optional): GitHub username to fetch commits from
+            user (NamedUser): owner of the repos
+            repos (iterable, optional): repo names or Repository objects to use instead of
+                all of `user`'s non-excluded repos (the exclusion list doesn't apply to these)
+            account (GitHubAccount, optional): account to look repo names up with (default: primary)
         """
-        # Repos to exclude (school/assignment repos)
-        EXCLUDED_REPOS = [
-            'fa23-lab-Martinlacsamana',
-            'fa23-proj1-a-khani',
-            'fa23-proj2-Martinlacsamana',
-            'fa23-proj3-a-khani',
-            'fa23-proj4-Martinlacsamana',
-            'prog-02-programming-practice-starter',
-            'programming-assignment-1-modal-medley-Martinlacsamana',
-            'programming-assignment-2-programming-practice-Martinlacsamana',
-            'programming-assignment-3-speedy-smarts-Martinlacsamana',
-            'programming-assignment-3-speedy-smarts-starter',
-            'sp24-proj2-martin',
-            'fa24-proj0-Martinlacsamana',
-            'fa24-proj1-Martinlacsamana',
-            'fa24-proj2-Martinlacsamana',
-            'fa24-proj3-Martinlacsamana',
-            'fa24-proj4-Martinlacsamana',
-            'fa24-proj5-Martinlacsamana',
-            'fa24-proj6-Martinlacsamana'
-        ]
+        if repos is not None:
+            client = (account or self.pool.primary).client
+            for repo in repos:
+                if isinstance(repo, str):
+                    repo = client.get_repo(repo if '/' in repo else f"{user.login}/{repo}")
+                yield repo
+            return
+        
+        # page by page so each listing request gets the retries of _call
+        listing = user.get_repos()
+        page = 0
+        while True:
+            repos_page = self._call(listing.get_page, page, account=account)
+            for repo in repos_page:
+                if self.is_excluded(repo.name):
+                    logger.debug(f"Skipping excluded repo: {repo.name}")
+                    continue
+                yield repo
+            if len(repos_page) < PER_PAGE:
+                return
+            page += 1
+    
+    def iter_sync_repos(self):
+        """Yield (login, repo) for every account's non-excluded repos, account by account
+        
+        Each account lists its repos with its own token, so its private repos are included.
+        """
+        for account in self.pool.accounts:
+            for repo in self.iter_repos(account.client.get_user(), account=account):
+                yield account.login, repo
+    
+    def iter_commits(self, username=None, repos=None, since=None, limit=None, with_files=False):
+        """Yield compact commit records repo by repo, one listing page in memory at a time
+        
+        Nothing past `limit` is requested, and closing the generator stops it where it is.
+        
+        Args:
+            username (str, optional): GitHub user whose commits to fetch (default: token owner)
+            repos (iterable, optional): repo names or Repository objects (default: all non-excluded repos)
+            since (datetime, optional): only commits after this date
+            limit (int, optional): stop after this many commits
+            with_files (bool, optional): add per-file changes, one extra request per commit (default False)
+        
+        Yields:
+            dict: commit_hash, commit_message, commit_date (ISO), repository, and files_changed
+                (list of filename/additions/deletions) when with_files is set
+        """
+        if with_files and self._detail_pool is None:
+            # file requests for a page go out concurrently; the pools close with the generator
+            with self._worker_pools():
+                yield from self.iter_commits(username, repos, since, limit, with_files)
+            return
         
-        logger.info("Starting commit fetch from GitHub...")
         user = self.github.get_user(username) if username else self.github.get_user()
+        filters = {'author': user.login}
+        if since:
+            filters['since'] = since
         
-        commits_data = []
-        for repo in user.get_repos():
-            # Skip if repo is in excluded list
-            if repo.name in EXCLUDED_REPOS:
-                logger.info(f"Skipping excluded repo: {repo.name}")
-                continue
-            
-            logger.info(f"Fetching commits from repo: {repo.name}")
+        count = 0
+        for repo in self.iter_repos(user, repos):
             try:
-                # Try to get commits for this repo
-                for commit in repo.get_commits(author=user.login):
-                    file_changes = [{
-                        'filename': f.filename,
-                        'additions': f.additions,
-                        'deletions': f.deletions,
-                    } for f in commit.files]
-                
-                    commits_data.append({
-                        'commit_hash': commit.sha,
-                        'commit_message': commit.commit.message,
-                        'commit_date': commit.commit.author.date.isoformat(),
-                        'repository': repo.name,
-                        'files_changed': file_changes
-                    })
-                    logger.info(f'Found commit: {commit.commit.message[:50]}...')
-                    
-                    if len(commits_data) % 100 == 0:
-                        logger.info(f"Processed {len(commits_data)} commits so far...")
-                    
+                for commits in self._iter_commit_pages(repo, **filters):
+                    if limit is not None:
+                        commits = commits[:limit - count]
+                    files = self._fetch_files(commits) if with_files else [None] * len(commits)
+                    for commit, file_changes in zip(commits, files):
+                        record = {
+                            'commit_hash': commit.sha,
+                            'commit_message': commit.commit.message,
+                            'commit_date': commit.commit.author.date.isoformat(),
+                            'repository': repo.name
+                        }
+                        if with_files:
+                            record['files_changed'] = file_changes
+                        yield record
+                    count += len(commits)
+                    if limit is not None and count >= limit:
+                        return
             except github.GithubException as e:
                 if e.status == 409:  # Empty repository
                     logger.info(f"Skipping empty repository: {repo.name}")
-                    continue
                 else:
                     logger.error(f"Error fetching commits from {repo.name}: {str(e)}")
                     raise
-
+    
+    def fetch_filtered_commits(self, username=None):
+        """Fetch all commits from non-excluded GitHub repos, with per-file changes
+        
+        Holds every commit in memory; iter_commits streams the same records.
+        
+        Args:
+            username (str, optional): GitHub username to fetch commits from
+        """
+        logger.info("Starting commit fetch from GitHub...")
+        commits_data = list(self.iter_commits(username, with_files=True))
         logger.info(f"Finished fetching commits. Total found: {len(commits_data)}")
         return commits_data
         
+    def to_learning_log(self, commit_data):
+        """Map extracted commit data onto the LearningLog document fields"""
+        return {
+            'commit_hash': commit_data['commit_hash'],
+            'commit_message': commit_data['commit_message'],
+            'commit_date': datetime.fromisoformat(commit_data['commit_date'].replace('Z', '+00:00')),
+            'repository': commit_data['repository'],
+            'author_account': commit_data.get('author_account'),
+            'lines_added': commit_data.get('lines_added', 0),  # use pre-calculated values
+            'lines_deleted': commit_data.get('lines_deleted', 0),  # use pre-calculated values
+            'files_changed': commit_data.get('files_changed', 0)  # use pre-calculated value
+        }
+    
     def process_and_store_commit(self, commit_data):
-        """Store a single learning log entry"""
+        """Store a single learning log entry, returns False if it already existed"""
         try:
-            # check for existing commit
-            if LearningLog.find_by_commit_hash(commit_data['commit_hash']):
-                return False
-
-            # create new learning log
-            LearningLog.create({
-                'commit_hash': commit_data['commit_hash'],
-                'commit_message': commit_data['commit_message'],
-                'commit_date': datetime.fromisoformat(commit_data['commit_date'].replace('Z', '+00:00')),
-                'repository': commit_data['repository'],
-                'lines_added': commit_data.get('lines_added', 0),  # use pre-calculated values
-                'lines_deleted': commit_data.get('lines_deleted', 0),  # use pre-calculated values
-                'files_changed': commit_data.get('files_changed', 0)  # use pre-calculated value
-            })
-            return True
+            # single upsert: no separate existence check round trip
+            return LearningLog.bulk_upsert([self.to_learning_log(commit_data)])['inserted'] == 1
         except Exception as e:
             logger.error(f"Error storing log: {e}")
             return False
     
-    def sync_logs(self):
-        """Backfill all previous commits"""
-        logger.info("Starting full commit sync...")
-        results = {'processed': 0, 'skipped': 0}
-        
-        user = self.github.get_user()
+    def sync_logs(self, full=False, workers=None):
+        """Sync commits into the learning log, in this request
+
+        Only commits newer than each repo's stored cursor are fetched, so a
+        sync with no new pushes costs roughly one listing call per repo.
+        Repos and commit details are fetched concurrently by `workers` threads
+        sharing one rate limiter. /sync runs the same per-repo steps as a
+        resumable background job (services/sync_jobs.py).
         
-        # Repos to exclude (school/assignment repos)
-        EXCLUDED_REPOS = [
-            'fa23-lab-Martinlacsamana',
-            'fa23-proj1-a-khani',
-            'fa23-proj2-Martinlacsamana',
-            'fa23-proj3-a-khani',
-            'fa23-proj4-Martinlacsamana',
-            'prog-02-programming-practice-starter',
-            'programming-assignment-1-modal-medley-Martinlacsamana',
-            'programming-assignment-2-programming-practice-Martinlacsamana',
-            'programming-assignment-3-speedy-smarts-Martinlacsamana',
-            'programming-assignment-3-speedy-smarts-starter',
-            'sp24-proj2-martin',
-            'fa24-proj0-Martinlacsamana',
-            'fa24-proj1-Martinlacsamana',
-            'fa24-proj2-Martinlacsamana',
-            'fa24-proj3-Martinlacsamana',
-            'fa24-proj4-Martinlacsamana',
-            'fa24-proj5-Martinlacsamana',
-            'fa24-proj6-Martinlacsamana',
-            'enigma-transit'
-        ]
+        Args:
+            full (bool, optional): ignore stored cursors and walk every commit (default False)
+            workers (int, optional): concurrent fetches, 1 syncs sequentially (default: self.workers)
+        """
+        logger.info(f"Starting {'full' if full else 'incremental'} commit sync...")
+        results = {'processed': 0, 'skipped': 0, 'failed': []}
         
-        for repo in user.get_repos():
-            # Skip if repo is in excluded list
-            if repo.name in EXCLUDED_REPOS:
-                logger.info(f"Skipping excluded repo: {repo.name}")
-                continue
-            
-            logger.info(f"Fetching commits from repo: {repo.name}")
+        def sync_unit(unit):
+            login, repo = unit
             try:
-                # Process commits one at a time
-                for commit in repo.get_commits(author=user.login):
-                    file_changes = [{
-                        'filename': f.filename,
-                        'additions': f.additions,
-                        'deletions': f.deletions,
-                    } for f in commit.files]
-                    
-                    commit_data = {
-                        'commit_hash': commit.sha,
-                        'commit_message': commit.commit.message,
-                        'commit_date': commit.commit.author.date.isoformat(),
-                        'repository': repo.name,
-                        'files_changed': len(file_changes),  # store count directly
-                        'lines_added': sum(f['additions'] for f in file_changes),
-                        'lines_deleted': sum(f['deletions'] for f in file_changes)
-                    }
-                    
-                    # Store immediately
-                    if self.process_and_store_commit(commit_data):
-                        results['processed'] += 1
-                        logger.info(f'Stored commit: {commit.commit.message[:50]}...')
-                    else:
-                        results['skipped'] += 1
-                        logger.info(f'Skipped existing commit: {commit.commit.message[:50]}...')
-                    
-                    # Log progress periodically
-                    if (results['processed'] + results['skipped']) % 50 == 0:
-                        logger.info(f"Progress: {results['processed']} stored, {results['skipped']} skipped")
-                    
-            except github.GithubException as e:
-                if e.status == 409:  # Empty repository
-                    logger.info(f"Skipping empty repository: {repo.name}")
+                return self.sync_repo(repo, login, full)
+            except Exception as e:
+                # the repo's cursor didn't move, so the next sync picks it up again
+                self.repo_failed(login, repo, e)
+                return None
+        
+        progress = ProgressLog('Sync progress')
+        with self._worker_pools(workers) as pool:
+            # sharded per (account, repo): every pair is one unit of work
+            units = list(self.iter_sync_repos())
+            for (login, repo), repo_results in zip(units, pool.map(sync_unit, units)):
+                if repo_results is None:
+                    results['failed'].append(self.pool.key(login, repo.name))
+                    progress.add(repos=1, failed=1)
                     continue
-                else:
-                    logger.error(f"Error fetching commits from {repo.name}: {str(e)}")
-                    raise
+                results['processed'] += repo_results['processed']
+                results['skipped'] += repo_results['skipped']
+                progress.add(repos=1, stored=repo_results['processed'], skipped=repo_results['skipped'])
+        progress.done()
         
-        logger.info(f"Sync completed. Processed {results['processed']} commits, skipped {results['skipped']} commits.")
+        logger.info(f"Sync completed. Processed {results['processed']} commits, skipped {results['skipped']} commits, {len(results['failed'])} repos failed.")
+        snapshot_exporter.refresh()
         return jsonify(results)
     
-    def test_extractor(self, username=None, limit=5):
-        """Test the extractor: fetch commits from github, excluding specific repos
+    def sync_repo(self, repo, login, full=False, start_page=0, newest=None, on_page=None):
+        """Sync one repository page by page, returns its processed/skipped counts
+        
+        Every listing page is stored before the next one is fetched, so a run can be
+        picked up again from `start_page` (with the `newest` commit the first run saw).
         
         Args:
-            username (str, optional): GitHub username to fetch commits
-            limit (int, optional): Maximum number of commits to fetch (default 5)
+            repo (Repository): repository to sync
+            login (str): only commits authored by this account
+            full (bool, optional): ignore the stored cursor (default False)
+            start_page (int, optional): listing page to start from when resuming (default 0)
+            newest (tuple, optional): (sha, committer date) of the newest commit, when resuming
+            on_page (callable, optional): called as on_page(next_page, stored, newest) after each stored page
         """
-        # Repos to exclude
-        EXCLUDED_REPOS = [
-            'fa23-lab-Martinlacsamana',
-            'fa23-proj1-a-khani',
-            'fa23-proj2-Martinlacsamana',
-            'fa23-proj3-a-khani',
-            'fa23-proj4-Martinlacsamana',
-            'prog-02-programming-practice-starter',
-            'programming-assignment-1-modal-medley-Martinlacsamana',
-            'programming-assignment-2-programming-practice-Martinlacsamana',
-            'programming-assignment-3-speedy-smarts-Martinlacsamana',
-            'programming-assignment-3-speedy-smarts-starter',
-            'sp24-proj2-martin',
-            'fa24-proj0-Martinlacsamana',
-            'fa24-proj1-Martinlacsamana',
-            'fa24-proj2-Martinlacsamana',
-            'fa24-proj3-Martinlacsamana',
-            'fa24-proj4-Martinlacsamana',
-            'fa24-proj5-Martinlacsamana',
-            'fa24-proj6-Martinlacsamana'
-        ]
+        cursor_key = self.pool.key(login, repo.name)
+        cursor = None if full else SyncState.get_cursor(cursor_key)
+        newest = [newest] if newest else []
+        results = {'processed': 0, 'skipped': 0}
+        if SyncState.is_unchanged(cursor, repo.pushed_at):
+            # pushed_at comes with the repo listing, so an idle repo costs no request at all
+            logger.debug(f"Skipping {repo.name}, nothing pushed since the last sync")
+            return results
         
-        user = self.github.get_user(username) if username else self.github.get_user()
+        for page, logs in self.iter_repo_pages(repo, login, cursor, start_page, newest):
+            stored = LearningLog.bulk_upsert(logs)
+            results['processed'] += stored['inserted']
+            results['skipped'] += stored['skipped']
+            if on_page:
+                on_page(page + 1, stored, newest[0] if newest else None)
+        
+        logger.debug(f"Stored {results['processed']} commits from {repo.name}, skipped {results['skipped']} existing")
+        COMMITS.inc(results['processed'], stage='sync', result='inserted')
+        COMMITS.inc(results['skipped'], stage='sync', result='skipped')
         
-        commits_data = []
-        for repo in user.get_repos():
-            # Skip if repo is in excluded list
-            if repo.name in EXCLUDED_REPOS:
-                continue
+        # only advance the cursor once the whole repo went through, so an aborted run is redone next time
+        SyncState.save_cursor(cursor_key, *(newest[0] if newest else ()), pushed_at=repo.pushed_at)
+        DeadLetter.resolve('sync_repo', cursor_key)
+        
+        return results
+    
+    def repo_failed(self, login, repo, error):
+        """Log a repo whose sync failed after its retries and leave a dead letter for it"""
+        logger.error(f"Syncing {repo.name} for {login} failed: {str(error)}")
+        DeadLetter.record('sync_repo', self.pool.key(login, repo.name), str(error), repository=repo.name, account=login)
+    
+    def iter_repo_pages(self, repo, login, cursor=None, start_page=0, newest=None):
+        """Yield (page number, learning logs) for a repo's commits newer than `cursor`
+        
+        Args:
+            repo (Repository): repository to read
+            login (str): only commits authored by this user
+            cursor (dict, optional): the repo's SyncState, None walks every commit
+            start_page (int, optional): listing page to start from (default 0)
+            newest (list, optional): gets (sha, committer date) of the newest commit appended
+        """
+        newest = [] if newest is None else newest
+        logger.debug(f"Fetching commits from repo: {repo.name}")
+        try:
+            if cursor and cursor.get('commit_sha'):
+                # listing is newest first; `since` trims everything older than the cursor
+                pages = self._iter_commit_pages(repo, start_page, author=login, since=cursor['commit_date'])
+            else:
+                pages = self._iter_commit_pages(repo, start_page, author=login)
             
-            for commit in repo.get_commits(author=user.login):
-                file_changes = [{
-                    'filename': f.filename,
-                    'additions': f.additions,
-                    'deletions': f.deletions,
-                } for f in commit.files]
+            yield from enumerate(self._iter_new_pages(repo, login, pages, cursor, newest), start_page)
             
-                commits_data.append({
-                    'commit_hash': commit.sha,
-                    'commit_message': commit.commit.message,
-                    'commit_date': commit.commit.author.date.isoformat(),
-                    'repository': repo.name,
-                    'files_changed': file_changes
-                })
-                logger.info(f'Found commit: {commit.commit.message}')
-                
-                # Return early once we have enough commits
-                if len(commits_data) >= limit:
-                    return commits_data
-
+        except github.GithubException as e:
+            if e.status == 409:  # Empty repository
+                logger.info(f"Skipping empty repository: {repo.name}")
+            else:
+                logger.error(f"Error fetching commits from {repo.name}: {str(e)}")
+                raise
+    
+    def _iter_new_pages(self, repo, login, pages, cursor, newest):
+        """Yield one list of learning logs per listing page, stopping at the cursor
+        
+        (sha, committer date) of the first commit seen is appended to `newest`.
+        """
+        for commits in pages:
+            # everything from the cursor onwards is already stored
+            shas = [commit.sha for commit in commits]
+            reached_cursor = bool(cursor) and cursor.get('commit_sha') in shas
+            if reached_cursor:
+                commits = commits[:shas.index(cursor['commit_sha'])]
             
-        return commits_data
+            if not newest and commits:
+                newest.append((commits[0].sha, commits[0].commit.committer.date))
             
+            with STAGE_SECONDS.time(stage='commit_details'):
+                stats = self.detail_fetcher.fetch_stats(repo, commits)
+            yield [self.to_learning_log({
+                'commit_hash': commit.sha,
+                'commit_message': commit.commit.message,
+                'commit_date': commit.commit.author.date.isoformat(),
+                'repository': repo.name,
+                'author_account': login,
+                **stats[commit.sha]  # files_changed, lines_added, lines_deleted
+            }) for commit in commits]
+            
+            if reached_cursor:
+                return
+    
+    def test_extractor(self, username=None, limit=5):
+        """Test the extractor: fetch commits from github, excluding specific repos
+        
+        Args:
+            username (str, optional): GitHub username to fetch commits
+            limit (int, optional): Maximum number of commits to fetch (default 5)
+        """
+        # stops requesting as soon as `limit` commits are in
+        return list(self.iter_commits(username, limit=limit, with_files=True))
     
     def test_db(self):
         """Test the database by creating and retrieving a sample learning log"""
@@ -266,7 +463,8 @@ class CommitExtractor:
             }
 
             logger.debug("Attempting to create learning log...")
-            result = LearningLog.create(sample_data)
+            # upserted so running the test again doesn't trip the unique commit_hash index
+            result = LearningLog.bulk_upsert([sample_data])
             logger.debug(f"Insert result: {result}")
             
             logger.debug("Attempting to retrieve learning log...")
@@ -307,7 +505,7 @@ class CommitExtractor:
             logger.debug(f"Starting extractor and storage test for {limit} commits...")
             
             # Get test commits
-            commits = self.test_extractor(username)[:limit]
+            commits = self.test_extractor(username, limit=limit)
             
             results = {
                 'status': 'success',
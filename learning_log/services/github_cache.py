@@ -0,0 +1,186 @@
+''' Conditional-request cache for GitHub REST responses, stored in Mongo '''
+
+from datetime import datetime
+from pymongo import DESCENDING
+from requests.structures import CaseInsensitiveDict
+from github.Requester import HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass, RequestsResponse
+import hashlib
+import logging
+import os
+import threading
+from learning_log import mongo
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+GITHUB_HTTP_CACHE = metrics.counter('github_http_cache_total', 'GitHub GET responses by cache result (hit = 304, miss, store)')
+
+# response headers worth keeping with a cached body; rate limit headers come fresh from the 304
+STORED_HEADERS = ('content-type', 'etag', 'last-modified', 'link')
+
+
+class GitHubResponseCache:
+    """Size-bounded store of GET bodies with their ETag / Last-Modified, in the `github_http_cache` collection
+
+    Revalidating an entry costs a request but GitHub answers unchanged resources
+    with a 304, which doesn't count against the rate limit. Keys include the
+    Authorization header, so tokens never see each other's responses.
+    """
+
+    def __init__(self, max_entries=None, max_body=None):
+        """
+        Args:
+            max_entries (int, optional): entries kept before the oldest are evicted (default: GITHUB_HTTP_CACHE_SIZE or 5000)
+            max_body (int, optional): larger bodies aren't cached, in bytes (default: GITHUB_HTTP_CACHE_MAX_BODY or 1MB)
+        """
+        self.max_entries = max_entries or int(os.getenv('GITHUB_HTTP_CACHE_SIZE', 5000))
+        self.max_body = max_body or int(os.getenv('GITHUB_HTTP_CACHE_MAX_BODY', 1_000_000))
+        self.lock = threading.Lock()
+        self.stores = 0
+
+    @staticmethod
+    def key(url, headers):
+        identity = f"{headers.get('Authorization', '')}\n{headers.get('Accept', '')}\n{url}"
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        return mongo.db.github_http_cache.find_one({'_id': key})
+
+    def set(self, key, body, headers):
+        if len(body) > self.max_body:
+            return
+        mongo.db.github_http_cache.replace_one(
+            {'_id': key},
+            {
+                'body': body,
+                'headers': {name: headers[name] for name in STORED_HEADERS if name in headers},
+                'stored_at': datetime.utcnow()
+            },
+            upsert=True
+        )
+        GITHUB_HTTP_CACHE.inc(result='store')
+        with self.lock:
+            self.stores += 1
+            # checking the size on every write would double the writes
+            evict = self.stores % 100 == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop the oldest-stored entries beyond max_entries"""
+        excess = mongo.db.github_http_cache.estimated_document_count() - self.max_entries
+        if excess <= 0:
+            return 0
+        # entries are re-stored whenever GitHub sends a new body, so stored_at tracks freshness
+        cutoff = next(iter(
+            mongo.db.github_http_cache.find({}, {'stored_at': 1}).sort('stored_at', DESCENDING).skip(self.max_entries).limit(1)
+        ), None)
+        if cutoff is None:
+            return 0
+        deleted = mongo.db.github_http_cache.delete_many({'stored_at': {'$lte': cutoff['stored_at']}}).deleted_count
+        logger.info(f"Evicted {deleted} GitHub response cache entries")
+        return deleted
+
+
+class CachedResponse:
+    """Mimics PyGithub's RequestsResponse for a cached body revalidated by a 304"""
+
+    def __init__(self, body, headers):
+        self.status = 200
+        self.headers = headers
+        self.body = body
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+class ConditionalRequestsMixin:
+    """Adds If-None-Match / If-Modified-Since to GETs and turns 304s back into the cached 200
+
+    The per-request state lives in a thread local and requests go straight to the
+    session: PyGithub shares one connection object between threads and calls
+    request() then getresponse() on it, which the base classes keep on the instance.
+    """
+    cache = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = threading.local()
+
+    def request(self, verb, url, input, headers, stream=False):
+        self._pending.args = (verb, url, input, headers, stream)
+
+    def getresponse(self):
+        verb, url, input, headers, stream = self._pending.args
+        if verb != 'GET' or stream or self.cache is None:
+            return self._send(verb, url, input, headers, stream)
+
+        key = self.cache.key(url, headers)
+        entry = self.cache.get(key)
+        if entry:
+            headers = dict(headers)
+            if 'etag' in entry['headers']:
+                headers['If-None-Match'] = entry['headers']['etag']
+            if 'last-modified' in entry['headers']:
+                headers['If-Modified-Since'] = entry['headers']['last-modified']
+
+        response = self._send(verb, url, input, headers, stream)
+        if response.status == 304 and entry:
+            GITHUB_HTTP_CACHE.inc(result='hit')
+            # fresh headers (rate limit, etag) over the stored ones
+            merged = CaseInsensitiveDict(entry['headers'])
+            merged.update(response.headers)
+            return CachedResponse(entry['body'], merged)
+
+        GITHUB_HTTP_CACHE.inc(result='miss')
+        if response.status == 200 and ('etag' in response.headers or 'last-modified' in response.headers):
+            body = response.read()
+            self.cache.set(key, body, CaseInsensitiveDict(response.headers))
+        return response
+
+    def _send(self, verb, url, input, headers, stream):
+        response = getattr(self.session, verb.lower())(
+            f"{self.protocol}://{self.host}:{self.port}{url}",
+            headers=headers,
+            data=input,
+            timeout=self.timeout,
+            verify=self.verify,
+            allow_redirects=False,
+            stream=stream
+        )
+        return RequestsResponse(response)
+
+
+class CachingHTTPSConnection(ConditionalRequestsMixin, HTTPSRequestsConnectionClass):
+    pass
+
+
+class CachingHTTPConnection(ConditionalRequestsMixin, HTTPRequestsConnectionClass):
+    pass
+
+
+def install(github_client, cache):
+    """Route a Github client's requests through `cache`
+
+    PyGithub only offers a process-wide hook (Requester.injectConnectionClasses), which
+    also turns off connection reuse, so the connection class is swapped on this client only.
+    That relies on PyGithub internals, hence the version range in requirements.txt; a
+    client that doesn't look the way this expects is left uncached rather than broken.
+    """
+    requester = github_client.requester
+    scheme_class = getattr(requester, '_Requester__connectionClass', None)
+    if not (isinstance(scheme_class, type) and issubclass(scheme_class, (HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass))):
+        logger.warning("Unsupported PyGithub connection internals, GitHub responses won't be cached")
+        return github_client
+    base = CachingHTTPSConnection if issubclass(scheme_class, HTTPSRequestsConnectionClass) else CachingHTTPConnection
+    requester._Requester__connectionClass = type(base.__name__, (base,), {'cache': cache})
+    return github_client
+
+
+github_response_cache = GitHubResponseCache()
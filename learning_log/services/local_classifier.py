@@ -0,0 +1,262 @@
+''' STAGE 2: LOCAL COMMIT CLASSIFICATION '''
+
+from array import array
+from datetime import datetime
+from pymongo import DESCENDING
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from learning_log import mongo
+from .classification_cache import normalize_message, message_key
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'<?[a-z]+>?')
+
+# model answers are only trusted up to this many chars, same as the batch prompt
+MAX_MESSAGE_CHARS = 500
+
+
+def features(message):
+    """Hashed word unigrams and bigrams of a message, plus its first word (usually the verb)"""
+    words = _WORD_RE.findall(normalize_message(message[:MAX_MESSAGE_CHARS]))
+    tokens = [f'w:{word}' for word in words]
+    tokens += [f'b:{first} {second}' for first, second in zip(words, words[1:])]
+    if words:
+        tokens.append(f'first:{words[0]}')
+    return [zlib.crc32(token.encode('utf-8')) for token in tokens]
+
+
+class LinearModel:
+    """Multinomial logistic regression over hashed n-gram features
+
+    Weights are sparse (feature hash -> one weight per label), so only features
+    seen in training take space, and prediction is a few dict lookups per word.
+    """
+
+    def __init__(self, labels, weights=None, bias=None):
+        self.labels = list(labels)
+        self.weights = weights or {}
+        self.bias = bias or [0.0] * len(self.labels)
+
+    def _scores(self, hashes):
+        scores = list(self.bias)
+        for h in hashes:
+            row = self.weights.get(h)
+            if row is not None:
+                for i, weight in enumerate(row):
+                    scores[i] += weight
+        return scores
+
+    def _probabilities(self, hashes):
+        scores = self._scores(hashes)
+        top = max(scores)
+        exps = [math.exp(score - top) for score in scores]
+        total = sum(exps)
+        return [value / total for value in exps]
+
+    def predict(self, message):
+        """
+        Returns:
+            tuple: (label, confidence), confidence being the label's probability
+        """
+        probabilities = self._probabilities(features(message))
+        best = max(range(len(probabilities)), key=probabilities.__getitem__)
+        return self.labels[best], probabilities[best]
+
+    @classmethod
+    def train(cls, samples, labels, epochs=8, learning_rate=0.5, l2=1e-5, seed=0):
+        """SGD on (message, label) pairs
+
+        Args:
+            samples (list): (message, label) pairs
+            labels (list): every label the model can answer with
+        """
+        model = cls(labels)
+        index = {label: i for i, label in enumerate(model.labels)}
+        data = [(features(message), index[label]) for message, label in samples]
+        order = list(range(len(data)))
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            rate = learning_rate / (1 + epoch)
+            for n in order:
+                hashes, target = data[n]
+                probabilities = model._probabilities(hashes)
+                gradient = [p - (1.0 if i == target else 0.0) for i, p in enumerate(probabilities)]
+                step = rate / max(len(hashes), 1) ** 0.5
+                for i, g in enumerate(gradient):
+                    model.bias[i] -= rate * g
+                for h in hashes:
+                    row = model.weights.get(h)
+                    if row is None:
+                        row = model.weights[h] = [0.0] * len(model.labels)
+                    for i, g in enumerate(gradient):
+                        row[i] -= step * g + l2 * row[i]
+        return model
+
+    def to_document(self):
+        """Packed weights: feature hashes and their rows as two binary arrays"""
+        hashes = array('I', self.weights)
+        values = array('f', (weight for h in hashes for weight in self.weights[h]))
+        return {'labels': self.labels, 'bias': self.bias, 'hashes': hashes.tobytes(), 'values': values.tobytes()}
+
+    @classmethod
+    def from_document(cls, doc):
+        hashes = array('I')
+        hashes.frombytes(doc['hashes'])
+        values = array('f')
+        values.frombytes(doc['values'])
+        width = len(doc['labels'])
+        weights = {h: list(values[i * width:(i + 1) * width]) for i, h in enumerate(hashes)}
+        return cls(doc['labels'], weights, list(doc['bias']))
+
+
+def evaluate(model, samples, threshold):
+    """Accuracy of `model` against the labels in `samples`, overall and above `threshold`"""
+    correct = confident = confident_correct = 0
+    per_type = {}
+    for message, label in samples:
+        predicted, confidence = model.predict(message)
+        hit = predicted == label
+        correct += hit
+        if confidence >= threshold:
+            confident += 1
+            confident_correct += hit
+        counts = per_type.setdefault(label, {'count': 0, 'correct': 0})
+        counts['count'] += 1
+        counts['correct'] += hit
+    total = max(len(samples), 1)
+    return {
+        'accuracy': round(correct / total, 4),
+        'threshold': threshold,
+        # share of commits the model would answer locally, and how often it's right on those
+        'coverage': round(confident / total, 4),
+        'confident_accuracy': round(confident_correct / confident, 4) if confident else None,
+        'per_type': {label: round(counts['correct'] / counts['count'], 4) for label, counts in per_type.items()}
+    }
+
+
+class LocalClassifier:
+    """Trained-in-process classifier that answers confident predictions without the LLM
+
+    Trained on LLM labels only: learning_logs messages whose classification_cache
+    entry (written for model answers, never for rules or local predictions) agrees
+    with the stored type. The newest model in `classifier_models` is picked up by
+    every process within LOCAL_CLASSIFIER_RELOAD_SECONDS of a retrain.
+    """
+
+    def __init__(self, threshold=None, reload_seconds=None, min_samples=None):
+        """
+        Args:
+            threshold (float, optional): confidence needed to skip the LLM (default: LOCAL_CLASSIFIER_THRESHOLD or 0.85)
+            reload_seconds (int, optional): how often to look for a newer model (default: LOCAL_CLASSIFIER_RELOAD_SECONDS or 300)
+            min_samples (int, optional): labeled messages needed to train (default: LOCAL_CLASSIFIER_MIN_SAMPLES or 1000)
+        """
+        self.enabled = os.getenv('LOCAL_CLASSIFIER_ENABLED', '1') == '1'
+        self.threshold = threshold or float(os.getenv('LOCAL_CLASSIFIER_THRESHOLD', 0.85))
+        self.reload_seconds = reload_seconds or int(os.getenv('LOCAL_CLASSIFIER_RELOAD_SECONDS', 300))
+        self.min_samples = min_samples or int(os.getenv('LOCAL_CLASSIFIER_MIN_SAMPLES', 1000))
+        self.lock = threading.Lock()
+        self.model = None
+        self.model_id = None
+        self.checked_at = 0
+
+    def _current(self):
+        if not self.enabled:
+            return None
+        with self.lock:
+            if time.monotonic() - self.checked_at < self.reload_seconds:
+                return self.model
+            self.checked_at = time.monotonic()
+        try:
+            latest = mongo.db.classifier_models.find_one({}, {'_id': 1}, sort=[('trained_at', DESCENDING)])
+            if latest and latest['_id'] != self.model_id:
+                model = LinearModel.from_document(mongo.db.classifier_models.find_one({'_id': latest['_id']}))
+                with self.lock:
+                    self.model, self.model_id = model, latest['_id']
+                logger.info(f"Loaded local classifier {latest['_id']}")
+        except Exception as e:
+            # keep using whatever is loaded, the LLM covers the rest
+            logger.error(f"Loading the local classifier failed: {str(e)}")
+        return self.model
+
+    def predict_many(self, messages):
+        """Confident local predictions
+
+        Returns:
+            dict: index -> commit type, only for messages at or above the threshold
+        """
+        model = self._current()
+        if model is None:
+            return {}
+        predictions = {}
+        for i, message in enumerate(messages):
+            commit_type, confidence = model.predict(message)
+            if confidence >= self.threshold:
+                predictions[i] = commit_type
+        return predictions
+
+    def training_samples(self):
+        """(message, LLM label) pairs, one per distinct normalized message"""
+        from learning_log.models import LearningLog
+        from .commit_classifier import rule_based_type
+        messages = {}  # message key -> (message, stored type)
+        logs = mongo.db.learning_logs.find({'commit_type': {'$ne': None}}, {'commit_message': 1, 'commit_type': 1, 'v': 1})
+        for log in map(LearningLog.decode, logs):
+            if rule_based_type(log['commit_message']):
+                continue
+            messages.setdefault(message_key(log['commit_message']), (log['commit_message'], log['commit_type']))
+
+        samples = []
+        keys = list(messages)
+        for start in range(0, len(keys), 1000):
+            for doc in mongo.db.classification_cache.find({'_id': {'$in': keys[start:start + 1000]}}, {'commit_type': 1}):
+                message, commit_type = messages[doc['_id']]
+                if doc['commit_type'] == commit_type:
+                    samples.append((message, commit_type))
+        return samples
+
+    def retrain(self, holdout=0.2):
+        """Train a model on the LLM labels, report its accuracy on a held-out share and store it
+
+        The report comes from a model trained without the held-out messages; the stored
+        model is then trained on all of them.
+
+        Returns:
+            dict: the accuracy report (None fields when there wasn't enough data)
+        """
+        from .commit_classifier import COMMIT_TYPES, MODEL_TYPES
+        labels = [COMMIT_TYPES[type_num] for type_num in MODEL_TYPES]
+        samples = [sample for sample in self.training_samples() if sample[1] in labels]
+        if len(samples) < self.min_samples:
+            logger.warning(f"Only {len(samples)} LLM-labeled messages, need {self.min_samples} to train")
+            return {'samples': len(samples), 'model_id': None}
+
+        # split on the message hash so the same split comes back every retrain
+        held_out = [sample for sample in samples if zlib.crc32(sample[0].encode('utf-8')) % 100 < holdout * 100]
+        training = [sample for sample in samples if zlib.crc32(sample[0].encode('utf-8')) % 100 >= holdout * 100]
+
+        started = time.perf_counter()
+        report = evaluate(LinearModel.train(training, labels), held_out, self.threshold)
+        model = LinearModel.train(samples, labels)
+        report.update(samples=len(samples), held_out=len(held_out), train_seconds=round(time.perf_counter() - started, 1))
+
+        doc = {**model.to_document(), 'trained_at': datetime.utcnow(), 'report': report}
+        report['model_id'] = str(mongo.db.classifier_models.insert_one(doc).inserted_id)
+        # only the newest is ever loaded, a couple of older ones are kept to compare reports
+        for old in mongo.db.classifier_models.find({}, {'_id': 1}).sort('trained_at', DESCENDING).skip(3):
+            mongo.db.classifier_models.delete_one({'_id': old['_id']})
+        with self.lock:
+            self.checked_at = 0
+        logger.info(f"Trained local classifier on {len(samples)} messages: {report}")
+        return report
+
+
+# shared so every CommitClassifier uses the same loaded model
+local_classifier = LocalClassifier()
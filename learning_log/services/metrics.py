@@ -0,0 +1,200 @@
+''' In-process counters, gauges and histograms rendered in the Prometheus text format '''
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from pymongo import monitoring
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# seconds, from a cached Mongo lookup up to a slow OpenAI batch
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label set"""
+    type = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            series = self.series.setdefault(key, [0] * (len(self.buckets) + 2))
+            # counts are stored per bucket and summed up when rendering
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            series = {key: list(values) for key, values in self.series.items()}
+        samples = []
+        for key, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', key + (('le', bound),), cumulative))
+            samples.append((f'{self.name}_sum', key, values[-1]))
+            samples.append((f'{self.name}_count', key, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help_text, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, help_text):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, key, value in metric.samples():
+                lines.append(f'{name}{_format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+GITHUB_REQUEST_SECONDS = metrics.histogram('github_request_seconds', 'GitHub API request latency by call')
+GITHUB_REQUEST_ERRORS = metrics.counter('github_request_errors_total', 'Failed GitHub API requests by call and status')
+GITHUB_RATE_LIMIT_REMAINING = metrics.gauge('github_rate_limit_remaining', 'GitHub requests left in the current rate limit window')
+MONGO_COMMAND_SECONDS = metrics.histogram('mongo_command_seconds', 'MongoDB command latency by collection and command')
+MONGO_COMMAND_ERRORS = metrics.counter('mongo_command_errors_total', 'Failed MongoDB commands by collection and command')
+OPENAI_REQUEST_SECONDS = metrics.histogram('openai_request_seconds', 'OpenAI chat completion latency by request kind')
+OPENAI_REQUEST_ERRORS = metrics.counter('openai_request_errors_total', 'Failed OpenAI chat completions by request kind')
+OPENAI_TOKENS = metrics.counter('openai_tokens_total', 'OpenAI tokens used by kind (prompt, completion)')
+STAGE_SECONDS = metrics.histogram('stage_seconds', 'Time spent per pipeline stage')
+COMMITS = metrics.counter('commits_total', 'Commits handled by stage and result')
+OUTBOUND_RETRIES = metrics.counter('outbound_retries_total', 'Outbound calls retried after a transient failure, by service')
+OUTBOUND_GIVEUPS = metrics.counter('outbound_giveups_total', 'Outbound calls that failed for good, by service and reason')
+CIRCUIT_OPEN = metrics.gauge('circuit_open', '1 while a service circuit breaker is open, by service')
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command the driver sends, passed to the client as an event listener"""
+
+    def __init__(self):
+        self.pending = {}  # request_id -> collection, started events don't come with durations
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self.lock:
+            self.pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ''
+
+    def _finish(self, event):
+        with self.lock:
+            collection = self.pending.pop((event.connection_id, event.request_id), '')
+        return {'collection': collection, 'command': event.command_name}
+
+    def succeeded(self, event):
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, **self._finish(event))
+
+    def failed(self, event):
+        labels = self._finish(event)
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, **labels)
+        MONGO_COMMAND_ERRORS.inc(**labels)
+
+
+class ProgressLog:
+    """Aggregated progress for long loops: counts are summed and logged at most every `interval` seconds"""
+
+    def __init__(self, label, interval=None):
+        self.label = label
+        self.interval = interval or float(os.getenv('PROGRESS_LOG_SECONDS', 10))
+        self.counts = {}
+        self.started = time.monotonic()
+        self.last_logged = self.started
+        self.lock = threading.Lock()
+
+    def _summary(self):
+        elapsed = time.monotonic() - self.started
+        return ', '.join(f"{count} {name}" for name, count in self.counts.items()) + f" in {elapsed:.1f}s"
+
+    def add(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + count
+            now = time.monotonic()
+            if now - self.last_logged < self.interval:
+                return
+            self.last_logged = now
+            summary = self._summary()
+        logger.info(f"{self.label}: {summary}")
+
+    def done(self):
+        with self.lock:
+            summary = self._summary()
+        logger.info(f"{self.label} finished: {summary}")
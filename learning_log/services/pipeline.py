@@ -0,0 +1,223 @@
+''' STAGE 1 + 2: FETCH, STORE AND CLASSIFY IN ONE PASS '''
+
+from datetime import datetime, timedelta
+import logging
+import os
+import queue
+import socket
+import threading
+import uuid
+from learning_log.models import LearningLog, SyncState
+from .metrics import metrics, STAGE_SECONDS, COMMITS
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_QUEUE_DEPTH = metrics.gauge('pipeline_queue_depth', 'Items waiting between pipeline stages')
+
+# tells a stage worker there is nothing more to come
+_DONE = object()
+
+
+class SyncPipeline:
+    """Sync that classifies new commits as they are stored
+
+    Three stages run concurrently, joined by bounded queues so a slow stage
+    blocks the one feeding it instead of piling up pages in memory:
+
+        fetch (repo workers) -> store pages (bulk_upsert) -> classify new commits (classify_batch)
+
+    New commits are inserted already leased to the pipeline, so the classification
+    scheduler leaves them alone; whatever the pipeline fails to classify is picked up
+    by the scheduler once the lease runs out. A repo's cursor only moves once every
+    one of its pages is stored.
+    """
+
+    def __init__(self, extractor, classifier, store_workers=None, classify_workers=None,
+                 queue_size=None, classify_batch=None, lease_seconds=None):
+        """
+        Args:
+            extractor (CommitExtractor): fetches pages; its `workers` is the fetch stage width
+            classifier (CommitClassifier): classifies new commits
+            store_workers (int, optional): concurrent bulk writers (default: PIPELINE_STORE_WORKERS or 2)
+            classify_workers (int, optional): concurrent classify_batch calls (default: PIPELINE_CLASSIFY_WORKERS or 2)
+            queue_size (int, optional): pages buffered between stages (default: PIPELINE_QUEUE_SIZE or 8)
+            classify_batch (int, optional): commits per classify_batch call (default: PIPELINE_CLASSIFY_BATCH or 200)
+            lease_seconds (int, optional): lease on new commits until classified (default: CLASSIFIER_LEASE_SECONDS or 600)
+        """
+        self.extractor = extractor
+        self.classifier = classifier
+        self.store_workers = store_workers or int(os.getenv('PIPELINE_STORE_WORKERS', 2))
+        self.classify_workers = classify_workers or int(os.getenv('PIPELINE_CLASSIFY_WORKERS', 2))
+        queue_size = queue_size or int(os.getenv('PIPELINE_QUEUE_SIZE', 8))
+        self.classify_batch = classify_batch or int(os.getenv('PIPELINE_CLASSIFY_BATCH', 200))
+        self.lease_seconds = lease_seconds or int(os.getenv('CLASSIFIER_LEASE_SECONDS', 600))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:pipeline-{uuid.uuid4().hex[:8]}"
+        self.store_queue = queue.Queue(maxsize=queue_size)
+        self.classify_queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.repos = {}  # cursor key -> progress of that repo through the stages
+        self.results = {'processed': 0, 'skipped': 0, 'classified': 0, 'unclassified': 0, 'failed_repos': {}}
+
+    def _put(self, q, name, item):
+        # blocks while the next stage is behind: that's the backpressure
+        q.put(item)
+        PIPELINE_QUEUE_DEPTH.set(q.qsize(), queue=name)
+
+    def _count(self, **amounts):
+        with self.lock:
+            for key, amount in amounts.items():
+                self.results[key] += amount
+
+    def run(self, full=False, repos=None, on_page=None, on_repo_done=None, on_repo_failed=None):
+        """Sync every repo through the three stages and wait for all of them
+
+        Hooks are called from stage threads and must not raise.
+
+        Args:
+            full (bool, optional): ignore stored cursors (default False)
+            repos (iterable, optional): (login, Repository) pairs to sync (default: every account's non-excluded repos)
+            on_page (callable, optional): on_page(login, repo, stored) after each stored page
+            on_repo_done (callable, optional): on_repo_done(login, repo) once all of a repo's pages are stored (or it was unchanged)
+            on_repo_failed (callable, optional): on_repo_failed(login, repo, error) when fetching or storing a repo failed
+
+        Returns:
+            dict: processed, skipped, classified, unclassified (left for the scheduler) and failed_repos
+        """
+        self.on_page = on_page
+        self.on_repo_done = on_repo_done
+        self.on_repo_failed = on_repo_failed
+        repos = list(self.extractor.iter_sync_repos() if repos is None else repos)
+        logger.info(f"Pipelined {'full' if full else 'incremental'} sync of {len(repos)} repos...")
+
+        # start consumers first so producers always have someone to block on
+        classifiers = self._start(self._classify_worker, self.classify_workers, 'pipeline-classify')
+        storers = self._start(self._store_worker, self.store_workers, 'pipeline-store')
+
+        try:
+            with self.extractor._worker_pools() as pool:
+                list(pool.map(lambda unit: self._fetch_repo(unit[1], unit[0], full), repos))
+        finally:
+            # even when a fetch blew up: pages already queued get stored, and no stage thread is left waiting
+            self._stop(self.store_queue, storers)
+            self._stop(self.classify_queue, classifiers)
+
+        logger.info(f"Pipelined sync completed: {self.results}")
+        return self.results
+
+    def _start(self, target, count, name):
+        threads = [threading.Thread(target=target, name=f'{name}-{i}', daemon=True) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _stop(self, q, threads):
+        for _ in threads:
+            q.put(_DONE)
+        for thread in threads:
+            thread.join()
+
+    def _fetch_repo(self, repo, login, full):
+        key = self.extractor.pool.key(login, repo.name)
+        state = {
+            'key': key, 'login': login, 'repo': repo, 'pending': 0, 'fetched': False, 'newest': [], 'error': None,
+            'results': {'processed': 0, 'skipped': 0}
+        }
+        try:
+            # in here so a failing cursor read fails this repo only
+            cursor = None if full else SyncState.get_cursor(key)
+            if SyncState.is_unchanged(cursor, repo.pushed_at):
+                if self.on_repo_done:
+                    self.on_repo_done(login, repo)
+                return
+            self.repos[key] = state
+            for _, logs in self.extractor.iter_repo_pages(repo, login, cursor, newest=state['newest']):
+                lease_expires = datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+                for log in logs:
+                    # only takes effect on insert ($setOnInsert), existing commits keep their state
+                    log.update(lease_owner=self.owner, lease_expires=lease_expires)
+                with self.lock:
+                    state['pending'] += 1
+                self._put(self.store_queue, 'store', (key, logs))
+        except Exception as e:
+            with self.lock:
+                state['error'] = state['error'] or e
+        with self.lock:
+            state['fetched'] = True
+        self._maybe_finish(state)
+
+    def _store_worker(self):
+        while True:
+            item = self.store_queue.get()
+            if item is _DONE:
+                return
+            key, logs = item
+            state = self.repos[key]
+            new_logs = []
+            try:
+                stored = LearningLog.bulk_upsert(logs, inserted=new_logs)
+                self._count(processed=stored['inserted'], skipped=stored['skipped'])
+                with self.lock:
+                    state['results']['processed'] += stored['inserted']
+                    state['results']['skipped'] += stored['skipped']
+                if self.on_page:
+                    self.on_page(state['login'], state['repo'], stored)
+            except Exception as e:
+                logger.error(f"Storing a page of {key} failed: {str(e)}", exc_info=True)
+                with self.lock:
+                    state['error'] = state['error'] or e
+            if new_logs:
+                self._put(self.classify_queue, 'classify', [(log['commit_hash'], log['commit_message']) for log in new_logs])
+            with self.lock:
+                state['pending'] -= 1
+            self._maybe_finish(state)
+
+    def _maybe_finish(self, state):
+        """Close out a repo once it's fully fetched and every page is stored"""
+        with self.lock:
+            if not state['fetched'] or state['pending'] or state.get('finished'):
+                return
+            state['finished'] = True
+        login, repo = state['login'], state['repo']
+        if state['error']:
+            logger.error(f"Pipelined sync of {state['key']} failed: {str(state['error'])}")
+            with self.lock:
+                self.results['failed_repos'][state['key']] = str(state['error'])
+            if self.on_repo_failed:
+                self.on_repo_failed(login, repo, state['error'])
+            return
+        newest = state['newest']
+        SyncState.save_cursor(state['key'], *(newest[0] if newest else ()), pushed_at=repo.pushed_at)
+        COMMITS.inc(state['results']['processed'], stage='sync', result='inserted')
+        COMMITS.inc(state['results']['skipped'], stage='sync', result='skipped')
+        if self.on_repo_done:
+            self.on_repo_done(login, repo)
+
+    def _classify_worker(self):
+        batch = []
+        while True:
+            item = self.classify_queue.get()
+            if item is not _DONE:
+                batch.extend(item)
+            if batch and (item is _DONE or len(batch) >= self.classify_batch):
+                self._classify(batch)
+                batch = []
+            if item is _DONE:
+                return
+
+    def _classify(self, batch):
+        try:
+            with STAGE_SECONDS.time(stage='pipeline_classify'):
+                errors = {}
+                types = self.classifier.classify_batch([message for _, message in batch], errors=errors)
+            results = {
+                commit_hash: commit_type
+                for (commit_hash, _), commit_type in zip(batch, types)
+                if commit_type is not None
+            }
+            updated = LearningLog.set_types(results, self.owner)
+            LearningLog.retry_later({batch[i][0]: error for i, error in errors.items()}, self.owner)
+        except Exception as e:
+            # the leases expire and the scheduler gets these
+            logger.error(f"Classifying {len(batch)} new commits failed: {str(e)}", exc_info=True)
+            updated = 0
+        self._count(classified=updated, unclassified=len(batch) - updated)
@@ -0,0 +1,83 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token bucket shared by concurrent workers
+
+    For GitHub the refill rate follows the primary rate limit headers PyGithub keeps
+    from the last response (remaining calls spread over the time left until reset)
+    and is capped at `max_rate` so workers stay under GitHub's secondary limits.
+    The classifier uses a fixed-rate bucket as its OpenAI token budget.
+    """
+
+    def __init__(self, max_rate=10.0, burst=10, reserve=100):
+        """
+        Args:
+            max_rate (float, optional): hard cap on requests per second (default 10)
+            burst (int, optional): bucket size, i.e. requests allowed back to back (default 10)
+            reserve (int, optional): calls left untouched for webhooks and manual requests (default 100)
+        """
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.reserve = reserve
+        self.blocked_until = 0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, cost=1):
+        """Block until `cost` tokens (one per request by default) are available"""
+        # a cost above the bucket size could never be paid in one go
+        cost = min(cost, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.blocked_until and self.blocked_until <= time.time():
+                    # window has reset, run at full speed until the next headers say otherwise
+                    self.blocked_until = 0
+                    self.rate = self.max_rate
+                if self.blocked_until > time.time():
+                    wait = self.blocked_until - time.time()
+                elif self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                else:
+                    wait = (cost - self.tokens) / self.rate if self.rate > 0 else 1
+            time.sleep(min(wait, 60))
+
+    def update(self, remaining, reset_time):
+        """Retune the refill rate from GitHub's rate limit headers
+
+        Args:
+            remaining (int): calls left in the current window
+            reset_time (int): unix timestamp at which the window resets
+        """
+        if remaining < 0:  # no response seen yet
+            return
+        with self.lock:
+            self._refill()
+            usable = remaining - self.reserve
+            window = max(reset_time - time.time(), 1)
+            if usable <= 0:
+                if self.blocked_until < reset_time:
+                    logger.warning(f"GitHub quota nearly exhausted, pausing until {time.ctime(reset_time)}")
+                self.blocked_until = reset_time
+                self.rate = 0
+            else:
+                self.blocked_until = 0
+                self.rate = min(self.max_rate, usable / window)
+
+    def update_from_github(self, github_client):
+        """Retune from the headers PyGithub stored on its last response"""
+        remaining, _ = github_client.rate_limiting
+        self.update(remaining, github_client.rate_limiting_resettime)
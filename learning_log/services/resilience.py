@@ -0,0 +1,233 @@
+''' Retries, backoff and circuit breaking shared by every outbound call (GitHub, OpenAI) '''
+
+from email.utils import parsedate_to_datetime
+import logging
+import os
+import random
+import re
+import threading
+import time
+from .metrics import OUTBOUND_RETRIES, OUTBOUND_GIVEUPS, CIRCUIT_OPEN
+
+logger = logging.getLogger(__name__)
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_SECONDS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+class CircuitOpen(Exception):
+    """A service's circuit breaker is open, the call wasn't attempted"""
+
+    def __init__(self, service, retry_in):
+        super().__init__(f"{service} circuit open, next attempt in {retry_in:.0f}s")
+        self.service = service
+        self.retry_in = retry_in
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff: uniform over [0, min(cap, base * 2**attempt)]
+
+    Jitter spreads retries of callers that failed together, so they don't come back together.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _headers(error):
+    # PyGithub keeps them on the exception, the OpenAI SDK on its httpx response
+    headers = getattr(error, 'headers', None) or getattr(getattr(error, 'response', None), 'headers', None)
+    return {key.lower(): value for key, value in (headers or {}).items()}
+
+
+def _duration(value):
+    """Seconds in an OpenAI reset header ('1s', '6m0s', '250ms')"""
+    parts = _DURATION_RE.findall(value)
+    return sum(float(number) * _DURATION_SECONDS[unit] for number, unit in parts) if parts else None
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait before trying again, None if it didn't say
+
+    Reads Retry-After (seconds or HTTP date), OpenAI's retry-after-ms, and the
+    rate limit reset headers of both APIs when the window is used up.
+    """
+    headers = _headers(error)
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            value = headers['retry-after']
+            if value.strip().isdigit():
+                return float(value)
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        if headers.get('x-ratelimit-remaining') == '0' and 'x-ratelimit-reset' in headers:
+            # GitHub: unix time the window resets
+            return max(float(headers['x-ratelimit-reset']) - time.time(), 0)
+        for kind in ('requests', 'tokens'):
+            if headers.get(f'x-ratelimit-remaining-{kind}') == '0' and f'x-ratelimit-reset-{kind}' in headers:
+                return _duration(headers[f'x-ratelimit-reset-{kind}'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def github_transient(error):
+    """Worth retrying: connection trouble, 5xx, 429 and rate limit 403s (not 404s, 409s, 422s...)"""
+    import github
+    import requests
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, github.GithubException):
+        if error.status in (429, 500, 502, 503, 504):
+            return True
+        return error.status == 403 and (isinstance(error, github.RateLimitExceededException) or retry_after(error) is not None)
+    return False
+
+
+def openai_transient(error):
+    """Worth retrying: connection trouble, timeouts, 408/409/429 and 5xx (not an exhausted quota)"""
+    import openai
+    if isinstance(error, openai.APIConnectionError):  # timeouts included
+        return True
+    if isinstance(error, openai.APIStatusError):
+        if getattr(error, 'code', None) == 'insufficient_quota':
+            return False
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """Stops calling a service that keeps failing, then lets a single probe through to test it
+
+    Closed: calls go through, `failure_threshold` transient failures in a row open it.
+    Open: calls fail fast with CircuitOpen for `reset_seconds`.
+    Half open: one call goes through; success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, service, failure_threshold=5, reset_seconds=30):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go out now"""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            retry_in = self.opened_at + self.reset_seconds - time.monotonic()
+            if retry_in > 0 or self.probing:
+                raise CircuitOpen(self.service, max(retry_in, 0))
+            # half open: this caller is the probe, everyone else keeps failing fast
+            self.probing = True
+
+    def succeeded(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info(f"{self.service} circuit closed")
+                CIRCUIT_OPEN.set(0, service=self.service)
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    logger.warning(f"{self.service} circuit opened after {self.failures} failures in a row")
+                self.opened_at = time.monotonic()
+                self.probing = False
+                CIRCUIT_OPEN.set(1, service=self.service)
+
+    def released(self):
+        """A probe ended without telling us anything (permanent error), let the next call probe"""
+        with self.lock:
+            self.probing = False
+
+
+class OutboundService:
+    """Retry policy and circuit breaker for one remote service
+
+    Transient failures are retried with full-jitter exponential backoff, waiting at
+    least as long as the server's Retry-After or rate limit reset, until
+    `max_attempts` or the call's deadline runs out; the last error is then raised
+    as is. Permanent errors are raised straight away and don't count against the
+    breaker. While the circuit is open, calls wait for the next probe if it comes
+    before their deadline and raise CircuitOpen otherwise. Settings come from <NAME>_MAX_ATTEMPTS, <NAME>_BACKOFF_SECONDS,
+    <NAME>_MAX_BACKOFF_SECONDS, <NAME>_DEADLINE_SECONDS, <NAME>_BREAKER_FAILURES
+    and <NAME>_BREAKER_RESET_SECONDS.
+    """
+
+    def __init__(self, name, is_transient, max_attempts=None, backoff=None, max_backoff=None, deadline=None,
+                 breaker_failures=None, breaker_reset=None):
+        """
+        Args:
+            name (str): service name, for metrics, logs and the env prefix
+            is_transient (callable): is_transient(error) -> True if trying again may work
+            max_attempts (int, optional): tries per call, the first included (default 5)
+            backoff (float, optional): base backoff in seconds (default 1)
+            max_backoff (float, optional): cap on one backoff in seconds (default 60)
+            deadline (float, optional): seconds a call may take including retries (default 300)
+            breaker_failures (int, optional): transient failures in a row that open the circuit (default 5)
+            breaker_reset (float, optional): seconds the circuit stays open before a probe (default 30)
+        """
+        prefix = name.upper()
+        self.name = name
+        self.is_transient = is_transient
+        self.max_attempts = max_attempts or int(os.getenv(f'{prefix}_MAX_ATTEMPTS', 5))
+        self.backoff = backoff or float(os.getenv(f'{prefix}_BACKOFF_SECONDS', 1))
+        self.max_backoff = max_backoff or float(os.getenv(f'{prefix}_MAX_BACKOFF_SECONDS', 60))
+        self.deadline = deadline or float(os.getenv(f'{prefix}_DEADLINE_SECONDS', 300))
+        self.breaker = CircuitBreaker(
+            name,
+            failure_threshold=breaker_failures or int(os.getenv(f'{prefix}_BREAKER_FAILURES', 5)),
+            reset_seconds=breaker_reset or float(os.getenv(f'{prefix}_BREAKER_RESET_SECONDS', 30))
+        )
+
+    def call(self, fn, *args, deadline=None, **kwargs):
+        """fn(*args, **kwargs) with retries, raises CircuitOpen if the service is being given a rest
+
+        Args:
+            deadline (float, optional): seconds this call may take, retries included (default: self.deadline)
+        """
+        give_up_at = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpen as e:
+                # jittered so the callers waiting on the circuit don't all come back at once
+                wait = e.retry_in + random.uniform(0, self.backoff)
+                if time.monotonic() + wait > give_up_at:
+                    OUTBOUND_GIVEUPS.inc(service=self.name, reason='circuit_open')
+                    raise
+                time.sleep(wait)
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not self.is_transient(e):
+                    self.breaker.released()
+                    raise
+                self.breaker.failed()
+                attempt += 1
+                delay = max(backoff_delay(attempt - 1, self.backoff, self.max_backoff), retry_after(e) or 0)
+                if attempt >= self.max_attempts or time.monotonic() + delay > give_up_at:
+                    reason = 'attempts' if attempt >= self.max_attempts else 'deadline'
+                    OUTBOUND_GIVEUPS.inc(service=self.name, reason=reason)
+                    logger.warning(f"{self.name}: giving up after {attempt} attempts ({reason}): {str(e)}")
+                    raise
+                OUTBOUND_RETRIES.inc(service=self.name)
+                logger.info(f"{self.name}: attempt {attempt} failed ({str(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            self.breaker.succeeded()
+            return result
+
+
+# one breaker per service for the whole process
+github_service = OutboundService('github', github_transient)
+openai_service = OutboundService('openai', openai_transient)
@@ -0,0 +1,91 @@
+''' In-process cache for read endpoints, invalidated by LearningLog writes '''
+
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from urllib.parse import urlencode
+from flask import Response, make_response, request
+import hashlib
+import os
+import threading
+import time
+from learning_log.models import LearningLog
+
+CacheEntry = namedtuple('CacheEntry', ['body', 'mimetype', 'etag', 'generation', 'expires_at'])
+
+
+class ResponseCache:
+    """TTL + LRU cache of serialized responses
+
+    Every entry remembers the LearningLog generation it was built from; any write
+    bumps the generation so older entries are dropped on their next lookup. The
+    generation is per process, the TTL bounds staleness from writes in other workers.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or int(os.getenv('RESPONSE_CACHE_SIZE', 512))
+        self.ttl = ttl or int(os.getenv('RESPONSE_CACHE_TTL', 300))
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, generation):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.generation != generation or entry.expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, generation, body, mimetype):
+        entry = CacheEntry(
+            body=body,
+            mimetype=mimetype,
+            etag=hashlib.sha1(body).hexdigest(),
+            generation=generation,
+            expires_at=time.monotonic() + self.ttl
+        )
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+def _cache_key():
+    # same params in any order (and empty ones) share an entry
+    params = sorted((key, value) for key, value in request.args.items(multi=True) if value != '')
+    return f"{request.path}?{urlencode(params)}"
+
+
+def cached_response(view):
+    """Serve a read route from the response cache, with a strong ETag and 304s for If-None-Match
+
+    Only complete 200 responses are cached; streamed responses pass straight through.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = _cache_key()
+        generation = LearningLog.generation
+        entry = response_cache.get(key, generation)
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            entry = response_cache.set(key, generation, response.get_data(), response.mimetype)
+
+        response = Response(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        # clients may keep the body but must revalidate, which is a cheap 304
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    return wrapper
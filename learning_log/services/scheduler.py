@@ -0,0 +1,106 @@
+''' STAGE 4: MAINTENANCE '''
+
+import logging
+import os
+import socket
+import threading
+import uuid
+from learning_log.models import LearningLog
+from .snapshot import snapshot_exporter
+
+logger = logging.getLogger(__name__)
+
+
+class ClassificationScheduler:
+    """Background loop that drains unclassified commits
+
+    Batches are claimed with leases (LearningLog.claim_unclassified), so any number
+    of processes can run a scheduler against the same collection without
+    classifying a commit twice. Failed classifications are pushed back with a
+    jittered backoff and parked after a few tries (LearningLog.retry_later).
+    """
+
+    def __init__(self, interval=None, batch_size=None, lease_seconds=None):
+        """
+        Args:
+            interval (float, optional): idle seconds between polls (default: CLASSIFIER_INTERVAL_SECONDS or 60)
+            batch_size (int, optional): commits claimed per batch (default: CLASSIFIER_CLAIM_SIZE or 100)
+            lease_seconds (int, optional): claim lifetime (default: CLASSIFIER_LEASE_SECONDS or 600)
+        """
+        self.interval = interval or float(os.getenv('CLASSIFIER_INTERVAL_SECONDS', 60))
+        self.batch_size = batch_size or int(os.getenv('CLASSIFIER_CLAIM_SIZE', 100))
+        self.lease_seconds = lease_seconds or int(os.getenv('CLASSIFIER_LEASE_SECONDS', 600))
+        # unique per process (and per scheduler) so leases can be told apart
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._classifier = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _get_classifier(self):
+        if self._classifier is None:
+            from .commit_classifier import CommitClassifier
+            self._classifier = CommitClassifier()
+        return self._classifier
+
+    def run_once(self):
+        """Claim, classify and store one batch
+
+        Returns:
+            int: number of commits claimed (0 when the backlog is empty)
+        """
+        claimed = LearningLog.claim_unclassified(self.owner, limit=self.batch_size, lease_seconds=self.lease_seconds)
+        if not claimed:
+            return 0
+
+        errors = {}
+        types = self._get_classifier().classify_batch([log['commit_message'] for log in claimed], errors=errors)
+        results = {
+            log['commit_hash']: commit_type
+            for log, commit_type in zip(claimed, types)
+            if commit_type is not None
+        }
+        updated = LearningLog.set_types(results, self.owner)
+        LearningLog.retry_later({claimed[i]['commit_hash']: error for i, error in errors.items()}, self.owner)
+        logger.info(f"Classified {updated} of {len(claimed)} claimed commits")
+        if updated:
+            snapshot_exporter.refresh()
+        return len(claimed)
+
+    def drain(self):
+        """Classify batches until nothing is left to claim, returns total claimed"""
+        total = 0
+        while True:
+            claimed = self.run_once()
+            if not claimed:
+                return total
+            total += claimed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                logger.error(f"Classification batch failed: {str(e)}", exc_info=True)
+                claimed = 0
+            # keep going straight away while there's a backlog
+            if not claimed:
+                self._stop.wait(self.interval)
+
+    def start(self):
+        """Start the polling thread (cheap to call again once running)"""
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='classification-scheduler', daemon=True)
+            self._thread.start()
+        logger.info(f"Classification scheduler started as {self.owner}")
+
+    def stop(self):
+        self._stop.set()
+
+
+classification_scheduler = ClassificationScheduler()
@@ -0,0 +1,228 @@
+''' STAGE 5: COMMIT MESSAGE SEARCH '''
+
+from array import array
+from bson import ObjectId
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import OperationFailure
+import heapq
+import logging
+import math
+import os
+import re
+import threading
+import time
+from learning_log import mongo
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset('a an and are as at be by for from in into is it of on or the to with'.split())
+
+# what the in-process index keeps per commit, besides its words
+INDEXED_FIELDS = ('commit_hash', 'commit_message', 'commit_date', 'repository', 'commit_type', 'author_account')
+
+
+def terms(text):
+    """Lowercased words without stop words, plurals folded so 'websockets' finds 'websocket'"""
+    words = []
+    for word in _WORD_RE.findall(text.lower()):
+        if word in STOP_WORDS:
+            continue
+        if len(word) > 4 and word.endswith('ies'):
+            word = word[:-3] + 'y'
+        elif len(word) > 4 and word.endswith(('ses', 'xes', 'zes', 'ches', 'shes')):
+            word = word[:-2]
+        elif len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+class InvertedIndex:
+    """Term -> commits postings kept in memory, for servers without text indexes
+
+    Postings are arrays of commit numbers, so 100k commits take a few MB. Scoring is
+    tf-idf with saturating term frequency, summed over the query's terms (any term
+    matches, like Mongo's $text).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = {}  # term -> array of commit numbers, once per commit
+        self.repeats = {}  # term -> {commit number: count} for the few commits using a word more than once
+        self.docs = []  # commit number -> [_id, commit_date, repository, commit_type, author_account]
+        self.numbers = {}  # commit_hash -> commit number
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, logs):
+        """Index new logs (ones already indexed are skipped), returns how many were added"""
+        added = 0
+        with self.lock:
+            for log in logs:
+                if log['commit_hash'] in self.numbers or '_id' not in log:
+                    continue
+                number = len(self.docs)
+                commit_date = log['commit_date']
+                if commit_date.tzinfo:
+                    # logs fresh from the extractor are aware, Mongo hands back naive UTC
+                    commit_date = commit_date.astimezone(timezone.utc).replace(tzinfo=None)
+                self.numbers[log['commit_hash']] = number
+                self.docs.append([log['_id'], commit_date, log['repository'], log.get('commit_type'), log.get('author_account')])
+                for term, count in Counter(terms(log['commit_message'])).items():
+                    postings = self.postings.get(term)
+                    if postings is None:
+                        postings = self.postings[term] = array('I')
+                    postings.append(number)
+                    if count > 1:
+                        self.repeats.setdefault(term, {})[number] = count
+                added += 1
+        return added
+
+    def set_types(self, types):
+        """Apply classifications (commit_hash -> commit_type)"""
+        with self.lock:
+            for commit_hash, commit_type in types.items():
+                number = self.numbers.get(commit_hash)
+                if number is not None:
+                    self.docs[number][3] = commit_type
+
+    def search(self, text, limit, after=None, by_date=False, repository=None, commit_type=None,
+               author_account=None, since=None, until=None):
+        """Best matches for `text`, same arguments as LearningLog.text_search
+
+        Returns:
+            list: (score, _id) pairs, in result order
+        """
+        query_terms = set(terms(text))
+        with self.lock:
+            total = len(self.docs)
+            scores = {}
+            for term in query_terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + total / len(postings))
+                if scores:
+                    for number in postings:
+                        scores[number] = scores.get(number, 0.0) + idf
+                else:
+                    # most queries are one word, this fills the dict without a python loop
+                    scores = dict.fromkeys(postings, idf)
+                for number, count in self.repeats.get(term, {}).items():
+                    scores[number] += idf * (2 * count / (count + 1) - 1)
+
+            docs = self.docs
+            filtered = repository or commit_type or author_account or since or until
+            candidates = []
+            for number, score in scores.items():
+                doc = docs[number]
+                if filtered and not (
+                    (not repository or doc[2] == repository)
+                    and (not commit_type or doc[3] == commit_type)
+                    and (not author_account or doc[4] == author_account)
+                    and (not since or doc[1] >= since)
+                    and (not until or doc[1] < until)
+                ):
+                    continue
+                candidates.append((doc[1] if by_date else score, doc[0], score))
+        if after:
+            after = tuple(after)
+            candidates = [candidate for candidate in candidates if candidate[:2] < after]
+        # floats survive the cursor's JSON round trip exactly, so the last score compares equal
+        return [(score, _id) for _, _id, score in heapq.nlargest(limit, candidates)]
+
+
+class CommitSearch:
+    """Searches commit messages through the Mongo text index, or the in-process index without one
+
+    SEARCH_BACKEND picks text, memory or auto (default: text index while it works,
+    rechecked every SEARCH_TEXT_RECHECK_SECONDS after a failure). The in-process index
+    is built by one scan on first use, then follows this process's writes through
+    LearningLog's insert/classify hooks and picks up other processes' inserts every
+    SEARCH_REFRESH_SECONDS (their classifications show on results, but only filter
+    by type once this process rebuilds).
+    """
+
+    def __init__(self, backend=None, refresh_seconds=None, recheck_seconds=None):
+        self.backend = backend or os.getenv('SEARCH_BACKEND', 'auto')
+        self.refresh_seconds = refresh_seconds or float(os.getenv('SEARCH_REFRESH_SECONDS', 30))
+        self.recheck_seconds = recheck_seconds or float(os.getenv('SEARCH_TEXT_RECHECK_SECONDS', 300))
+        self.index = InvertedIndex()
+        self.lock = threading.Lock()  # one build / catch-up at a time
+        self.built = False
+        self.synced_until = None  # created_at up to which other processes' inserts are indexed
+        self.refreshed_at = 0
+        self.text_failed_at = None
+
+    def on_insert(self, logs):
+        if self.built:
+            self.index.add(logs)
+
+    def on_classify(self, types):
+        if self.built:
+            self.index.set_types(types)
+
+    def _use_text(self):
+        if self.backend != 'auto':
+            return self.backend == 'text'
+        return self.text_failed_at is None or time.monotonic() - self.text_failed_at > self.recheck_seconds
+
+    def _refresh(self):
+        """Build the in-process index, or add what other processes inserted since the last refresh"""
+        if self.built and time.monotonic() - self.refreshed_at < self.refresh_seconds:
+            return
+        from learning_log.models import LearningLog
+        with self.lock:
+            if self.built and time.monotonic() - self.refreshed_at < self.refresh_seconds:
+                return
+            started = datetime.utcnow()
+            # _id carries the insert time and is indexed; a minute of overlap covers clock
+            # skew between app servers, repeats are skipped
+            query = {'_id': {'$gte': ObjectId.from_datetime(self.synced_until - timedelta(minutes=1))}} if self.synced_until else {}
+            logs = mongo.db.learning_logs.find(query, LearningLog._projection(INDEXED_FIELDS)).batch_size(1000)
+            added = self.index.add(map(LearningLog.decode, logs))
+            if not self.built:
+                logger.info(f"Built in-process search index over {added} commits in {(datetime.utcnow() - started).total_seconds():.1f}s")
+            self.synced_until = started
+            self.refreshed_at = time.monotonic()
+            self.built = True
+
+    def search(self, text, limit, after=None, by_date=False, fields=None, **filters):
+        """Matching logs with a `score`, best first (newest first when by_date)
+
+        Args:
+            text (str): words to look for
+            limit (int): maximum logs to return
+            after (tuple, optional): (score or commit_date, _id) of the previous page's last log
+            by_date (bool, optional): newest first instead of by relevance (default False)
+            fields (iterable, optional): projection (default: LearningLog.PUBLIC_FIELDS)
+            **filters: repository, commit_type, author_account, since, until
+
+        Returns:
+            tuple: (backend used, list of logs)
+        """
+        from learning_log.models import LearningLog
+        fields = fields or LearningLog.PUBLIC_FIELDS
+        if self._use_text():
+            try:
+                logs = list(LearningLog.text_search(text, limit, after, by_date, fields, **filters))
+                self.text_failed_at = None
+                return 'text', logs
+            except (OperationFailure, NotImplementedError) as e:
+                logger.warning(f"Text search unavailable, using the in-process index: {str(e)}")
+                self.text_failed_at = time.monotonic()
+
+        self._refresh()
+        hits = self.index.search(text, limit, after, by_date, **filters)
+        docs = {
+            doc['_id']: LearningLog.decode(doc)
+            for doc in mongo.db.learning_logs.find({'_id': {'$in': [_id for _, _id in hits]}}, LearningLog._projection(fields))
+        }
+        return 'memory', [{**docs[_id], 'score': score} for score, _id in hits if _id in docs]
+
+
+# shared so LearningLog's write hooks and /search see the same index
+commit_search = CommitSearch()
@@ -0,0 +1,225 @@
+''' STAGE 5: STATIC SNAPSHOT EXPORT '''
+
+from datetime import datetime
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+try:
+    import brotli
+except ImportError:  # optional, .br variants are skipped without it
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, exports there are only serialized within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_SLUG_RE = re.compile(r'[^a-z0-9._-]+')
+
+
+def slug(value):
+    return _SLUG_RE.sub('-', value.lower()).strip('-') or '-'
+
+
+def shard_name(value):
+    """Readable and unique file name for a repository or type: 'Foo.Bar' and 'foo-bar' slug the same"""
+    return f"{slug(value)}-{hashlib.sha256(value.encode('utf-8')).hexdigest()[:8]}"
+
+
+class SnapshotExporter:
+    """Writes the public commit history as static files the personal site can serve directly
+
+    Layout under SNAPSHOT_DIR:
+
+        repositories/<repo>-<hash>.ndjson   every commit of a repo, newest first
+        types/<type>-<hash>.ndjson          every classified commit of a type, newest first
+        latest/<n>.json                     paginated newest-first feed: {page, pages, next, logs}
+        manifest.json                       sha256, size, commit count and repository/type per shard
+
+    Every shard also gets .gz (and .br, when the brotli package is installed)
+    variants; <hash> is the start of the name's sha256, so names that slug alike
+    get shards of their own. Writes to learning_logs mark the repositories and types
+    they touch (LearningLog._on_insert / _on_classify), and a refresh only regenerates
+    those shards; a shard whose content hash didn't change is not rewritten. Files are
+    replaced atomically and the manifest goes last, so readers never see a half
+    written export. Every process that writes logs exports, so an export holds a lock
+    file in the directory while it reads, updates and rewrites the manifest.
+    """
+
+    # bumped when shard paths change, a manifest of another layout means a full export
+    LAYOUT = 2
+
+    def __init__(self, directory=None, page_size=None, latest_pages=None):
+        """
+        Args:
+            directory (str, optional): export root, exporting is off when unset (default: SNAPSHOT_DIR)
+            page_size (int, optional): commits per latest/ page (default: SNAPSHOT_PAGE_SIZE or 100)
+            latest_pages (int, optional): pages in the latest feed (default: SNAPSHOT_LATEST_PAGES or 20)
+        """
+        self.directory = directory or os.getenv('SNAPSHOT_DIR')
+        self.page_size = page_size or int(os.getenv('SNAPSHOT_PAGE_SIZE', 100))
+        self.latest_pages = latest_pages or int(os.getenv('SNAPSHOT_LATEST_PAGES', 20))
+        self.lock = threading.Lock()  # guards the dirty sets
+        self.export_lock = threading.Lock()  # one export at a time
+        self.dirty = {'repository': set(), 'commit_type': set()}
+
+    def mark_changed(self, logs, types=None):
+        """Record which shards a write touched
+
+        Args:
+            logs (list): logs as stored before the write (or just inserted)
+            types (dict, optional): commit_hash -> new commit_type, for classifications
+        """
+        if not self.directory:
+            return
+        with self.lock:
+            for log in logs:
+                self.dirty['repository'].add(log['repository'])
+                if log.get('commit_type'):
+                    self.dirty['commit_type'].add(log['commit_type'])
+                if types and types.get(log['commit_hash']):
+                    self.dirty['commit_type'].add(types[log['commit_hash']])
+
+    def _take_dirty(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, {'repository': set(), 'commit_type': set()}
+        return dirty
+
+    def _restore_dirty(self, dirty):
+        with self.lock:
+            for field, values in dirty.items():
+                self.dirty[field] |= values
+
+    def refresh(self):
+        """Export the shards changed since the last refresh, never raises
+
+        Returns:
+            dict: written/unchanged/removed shard counts, None when exporting is off
+        """
+        if not self.directory:
+            return None
+        dirty = self._take_dirty()
+        try:
+            return self.export(dirty)
+        except Exception as e:
+            self._restore_dirty(dirty)
+            logger.error(f"Snapshot export failed: {str(e)}", exc_info=True)
+            return None
+
+    def export(self, dirty=None):
+        """Regenerate the shards in `dirty` (field -> values), or all of them when None
+
+        A missing manifest also means a full export.
+        """
+        from learning_log.models import LearningLog
+        with self.export_lock, self._directory_lock():
+            manifest = self._load_manifest()
+            full = dirty is None or manifest is None or manifest.get('layout') != self.LAYOUT
+            stats = {'written': 0, 'unchanged': 0, 'removed': 0}
+            if not full and not any(dirty.values()):
+                return stats
+            # kept hashes let even a full export skip shards that came out the same
+            shards = dict(manifest['shards']) if manifest else {}
+
+            if full:
+                dirty = {field: LearningLog.distinct(field) for field in ('repository', 'commit_type')}
+            folders = {'repository': 'repositories', 'commit_type': 'types'}
+            for field, values in dirty.items():
+                for value in sorted(values):
+                    logs = LearningLog.find_page(batch_size=500, **{field: value})
+                    body = ''.join(json.dumps(LearningLog.to_public(log)) + '\n' for log in logs).encode('utf-8')
+                    path = f"{folders[field]}/{shard_name(value)}.ndjson"
+                    self._write_shard(shards, path, body, body.count(b'\n'), stats, **{field: value})
+
+            # new commits shift every page of the feed, but unchanged pages keep their hash
+            latest = [LearningLog.to_public(log) for log in LearningLog.find_page(limit=self.page_size * self.latest_pages)]
+            pages = max((len(latest) + self.page_size - 1) // self.page_size, 1)
+            for page in range(1, pages + 1):
+                page_logs = latest[(page - 1) * self.page_size:page * self.page_size]
+                body = json.dumps({
+                    'page': page,
+                    'pages': pages,
+                    'next': f"latest/{page + 1}.json" if page < pages else None,
+                    'logs': page_logs
+                }).encode('utf-8')
+                self._write_shard(shards, f"latest/{page}.json", body, len(page_logs), stats)
+            # the feed shrinks when page_size/latest_pages are lowered
+            for path in [path for path in shards if path.startswith('latest/') and int(path[7:-5]) > pages]:
+                self._remove_shard(shards, path, stats)
+
+            if full:
+                # shards of repositories or types that no longer have commits
+                expected = {f"{folders[field]}/{shard_name(value)}.ndjson" for field, values in dirty.items() for value in values}
+                for path in [path for path in shards if not path.startswith('latest/') and path not in expected]:
+                    self._remove_shard(shards, path, stats)
+
+            self._write_file('manifest.json', json.dumps({
+                'generated_at': datetime.utcnow().isoformat(),
+                'layout': self.LAYOUT,
+                'variants': ['gz', 'br'] if brotli else ['gz'],
+                'shards': shards
+            }, indent=1, sort_keys=True).encode('utf-8'))
+            logger.info(f"Snapshot exported to {self.directory}: {stats}")
+            return stats
+
+    @contextlib.contextmanager
+    def _directory_lock(self):
+        # web, scheduler, webhook worker and sync jobs may all export into the same directory
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.export.lock'), 'a') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.directory, 'manifest.json'), 'rb') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_shard(self, shards, path, body, commits, stats, **labels):
+        digest = hashlib.sha256(body).hexdigest()
+        if shards.get(path, {}).get('sha256') == digest and os.path.exists(os.path.join(self.directory, path)):
+            stats['unchanged'] += 1
+            return
+        self._write_file(path, body)
+        # mtime=0 keeps the gzip bytes stable for the same content
+        self._write_file(path + '.gz', gzip.compress(body, mtime=0))
+        if brotli:
+            self._write_file(path + '.br', brotli.compress(body))
+        shards[path] = {'sha256': digest, 'bytes': len(body), 'commits': commits, **labels}
+        stats['written'] += 1
+
+    def _remove_shard(self, shards, path, stats):
+        for suffix in ('', '.gz', '.br'):
+            try:
+                os.remove(os.path.join(self.directory, path + suffix))
+            except FileNotFoundError:
+                pass
+        del shards[path]
+        stats['removed'] += 1
+
+    def _write_file(self, path, data):
+        target = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temporary = f"{target}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, target)
+
+
+# shared so writes anywhere in the process mark shards for the next refresh
+snapshot_exporter = SnapshotExporter()
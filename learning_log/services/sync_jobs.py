@@ -0,0 +1,246 @@
+''' STAGE 1: COMMIT EXTRACTION AND STORAGE '''
+
+from datetime import datetime
+import logging
+import os
+import socket
+import threading
+import uuid
+from learning_log.models import SyncJob
+from .commit_extractor import CommitExtractor
+from .snapshot import snapshot_exporter
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """Another process took the job over (this one stalled past its lease)"""
+
+
+def job_progress(job):
+    """Progress report for /sync/<id>: repo counts, commit totals, throughput and ETA"""
+    repos = job['repos'].values()
+    done = sum(1 for repo in repos if repo['status'] == 'done')
+    failed = sum(1 for repo in repos if repo['status'] == 'failed')
+    end = job['finished_at'] or datetime.utcnow()
+    elapsed = max((end - job['created_at']).total_seconds(), 0.001)
+    handled = job['totals']['processed'] + job['totals']['skipped']
+
+    eta = None
+    if job['status'] == 'running' and done + failed:
+        # repos vary a lot in size, so this is only a rough guide
+        eta = round(elapsed / (done + failed) * (len(job['repos']) - done - failed), 1)
+
+    return {
+        'job_id': str(job['_id']),
+        'status': job['status'],
+        'full': job['full'],
+        'repos_total': len(job['repos']),
+        'repos_done': done,
+        'repos_failed': failed,
+        'failed_repos': {
+            f"{repo['account']}/{repo['name']}" if repo.get('account') else repo['name']: repo.get('error')
+            for repo in repos if repo['status'] == 'failed'
+        },
+        'processed': job['totals']['processed'],
+        'skipped': job['totals']['skipped'],
+        'commits_per_sec': round(handled / elapsed, 2),
+        'elapsed_seconds': round(elapsed, 1),
+        'eta_seconds': eta,
+        'resumes': job['resumes'],
+        'summary': job.get('summary'),
+        'error': job['error'],
+        'created_at': job['created_at'].isoformat(),
+        'finished_at': job['finished_at'].isoformat() if job['finished_at'] else None
+    }
+
+
+class SyncJobRunner:
+    """Runs syncs as background jobs that survive request timeouts and restarts
+
+    Progress is checkpointed in the sync_jobs collection after every listing page,
+    and a repo that fails is recorded and skipped instead of ending the run. The
+    lease is renewed at each checkpoint and by a heartbeat every third of a lease
+    (a page can wait out a rate limit reset for longer than a lease); when a process
+    dies its job's lease runs out and the watcher of any other (or the restarted)
+    process resumes it. Each run holds the job under its own owner token, so a run
+    that was taken over can no longer write to the job.
+    """
+
+    def __init__(self, lease_seconds=None):
+        """
+        Args:
+            lease_seconds (int, optional): job lease, renewed every page (default: SYNC_JOB_LEASE_SECONDS or 600)
+        """
+        self.lease_seconds = lease_seconds or int(os.getenv('SYNC_JOB_LEASE_SECONDS', 600))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def submit(self, full=False, workers=None, classify=False):
+        """Start a sync job, or hand back the one already running
+
+        Args:
+            full (bool, optional): ignore stored cursors (default False)
+            workers (int, optional): concurrent repo fetches (default: SYNC_WORKERS)
+            classify (bool, optional): run the pipelined sync that also classifies new commits (default False)
+
+        Returns:
+            tuple: (job, created)
+        """
+        with self._lock:
+            while True:
+                job = SyncJob.create(self._run_owner(), full=full, workers=workers, lease_seconds=self.lease_seconds, classify=classify)
+                if job:
+                    break
+                # another process got there first, or a dead process' job is waiting for a watcher to resume it
+                running = SyncJob.find_running()
+                if running:
+                    return running, False
+        self._start(job)
+        return job, True
+
+    def resume_stale(self):
+        """Resume every job whose owner stopped renewing its lease, returns how many"""
+        resumed = 0
+        job = SyncJob.claim_stale(self._run_owner(), self.lease_seconds)
+        while job:
+            logger.info(f"Resuming sync job {job['_id']} (resume #{job['resumes']})")
+            self._start(job)
+            resumed += 1
+            job = SyncJob.claim_stale(self._run_owner(), self.lease_seconds)
+        return resumed
+
+    def _run_owner(self):
+        return f"{self.owner}:{uuid.uuid4().hex[:8]}"
+
+    def _start(self, job):
+        threading.Thread(target=self.run, args=(job,), name=f"sync-job-{job['_id']}", daemon=True).start()
+
+    def run(self, job):
+        """Run (or continue) a job to the end in the calling thread"""
+        logger.info(f"Sync job {job['_id']} started ({'full' if job['full'] else 'incremental'})")
+        stopped = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job, stopped), name=f"sync-job-heartbeat-{job['_id']}", daemon=True).start()
+        try:
+            self._run(job)
+        finally:
+            stopped.set()
+
+    def _heartbeat(self, job, stopped):
+        while not stopped.wait(self.lease_seconds / 3):
+            if not SyncJob.renew(job['_id'], job['owner'], self.lease_seconds):
+                return
+
+    def _run(self, job):
+        try:
+            extractor = CommitExtractor(workers=job['workers'])
+            # one unit of work per (account, repo)
+            units = list(extractor.iter_sync_repos())
+            job = SyncJob.add_repos(job, {
+                extractor.pool.key(login, str(repo.id)): (repo.name, login) for login, repo in units
+            })
+            # done and failed repos are final for this job, failed ones get retried by the next sync
+            pending = [
+                (login, repo) for login, repo in units
+                if job['repos'][extractor.pool.key(login, str(repo.id))]['status'] not in ('done', 'failed')
+            ]
+            
+            summary = None
+            if job.get('classify'):
+                summary = self._run_pipeline(extractor, job, pending)
+            else:
+                with extractor._worker_pools(job['workers']) as pool:
+                    # list() so worker exceptions (LeaseLost) surface here
+                    list(pool.map(lambda unit: self._run_repo(extractor, job, unit[1], unit[0]), pending))
+        except LeaseLost:
+            logger.warning(f"Sync job {job['_id']} was taken over by another process, stopping here")
+            return
+        except Exception as e:
+            logger.error(f"Sync job {job['_id']} failed: {str(e)}", exc_info=True)
+            SyncJob.finish(job['_id'], job['owner'], 'failed', str(e))
+            return
+        
+        SyncJob.finish(job['_id'], job['owner'], 'completed', summary=summary)
+        logger.info(f"Sync job {job['_id']} completed")
+        snapshot_exporter.refresh()
+
+    def _run_repo(self, extractor, job, repo, login):
+        repo_id = extractor.pool.key(login, str(repo.id))
+        state = job['repos'][repo_id]
+        newest = (state['newest_sha'], state['newest_date']) if state.get('newest_sha') else None
+
+        def checkpoint(fields, stored=None):
+            stored = stored or {'inserted': 0, 'skipped': 0}
+            if not SyncJob.checkpoint(job['_id'], job['owner'], repo_id, fields, stored['inserted'], stored['skipped'], self.lease_seconds):
+                raise LeaseLost(job['_id'])
+
+        def on_page(next_page, stored, newest):
+            fields = {'status': 'running', 'next_page': next_page}
+            if newest:
+                fields['newest_sha'], fields['newest_date'] = newest
+            checkpoint(fields, stored)
+
+        try:
+            extractor.sync_repo(repo, login, job['full'], start_page=state['next_page'], newest=newest, on_page=on_page)
+        except LeaseLost:
+            raise
+        except Exception as e:
+            # one bad repo is recorded and skipped, the rest of the run carries on
+            extractor.repo_failed(login, repo, e)
+            checkpoint({'status': 'failed', 'error': str(e)})
+            return
+        checkpoint({'status': 'done'})
+
+    def _run_pipeline(self, extractor, job, repos):
+        """Pipelined run: checkpoints per repo once all its pages are stored (a resumed repo starts over)"""
+        from .commit_classifier import CommitClassifier
+        from .pipeline import SyncPipeline
+        lost = threading.Event()
+
+        def checkpoint(login, repo, fields, stored=None):
+            # pipeline hooks mustn't raise, so a lost lease is only noted here
+            stored = stored or {'inserted': 0, 'skipped': 0}
+            if not SyncJob.checkpoint(job['_id'], job['owner'], extractor.pool.key(login, str(repo.id)), fields, stored['inserted'], stored['skipped'], self.lease_seconds):
+                lost.set()
+
+        def repo_failed(login, repo, error):
+            extractor.repo_failed(login, repo, error)
+            checkpoint(login, repo, {'status': 'failed', 'error': str(error)})
+
+        summary = SyncPipeline(extractor, CommitClassifier()).run(
+            full=job['full'],
+            repos=repos,
+            on_page=lambda login, repo, stored: checkpoint(login, repo, {'status': 'running'}, stored),
+            on_repo_done=lambda login, repo: checkpoint(login, repo, {'status': 'done'}),
+            on_repo_failed=repo_failed
+        )
+        if lost.is_set():
+            raise LeaseLost(job['_id'])
+        return {key: summary[key] for key in ('classified', 'unclassified')}
+
+    def _watch(self):
+        while not self._stop.is_set():
+            try:
+                self.resume_stale()
+            except Exception as e:
+                logger.error(f"Checking for stale sync jobs failed: {str(e)}", exc_info=True)
+            self._stop.wait(self.lease_seconds / 2)
+
+    def start_watcher(self):
+        """Resume stale jobs now and keep checking every half lease (cheap to call again once running)"""
+        if self._watcher and self._watcher.is_alive():
+            return
+        with self._lock:
+            if self._watcher and self._watcher.is_alive():
+                return
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, name='sync-job-watcher', daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+sync_jobs = SyncJobRunner()
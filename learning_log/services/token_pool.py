@@ -0,0 +1,105 @@
+''' GitHub accounts synced by the extractor and the token pool their requests are spread over '''
+
+import logging
+import os
+import threading
+from learning_log.clients import get_github
+from .rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# what a token is assumed to have left before its first response says otherwise
+DEFAULT_QUOTA = 5000
+
+
+class GitHubAccount:
+    """A tracked GitHub user and the token it syncs with, with its own client and rate limiter"""
+
+    def __init__(self, username, token, client=None, max_rate=None):
+        """
+        Args:
+            username (str): GitHub login, None to look up the token's owner on first use
+            token (str): personal access token of that user
+            client (Github, optional): client to use (default: the shared pooled client for `token`)
+            max_rate (float, optional): requests per second cap (default: GITHUB_MAX_REQUESTS_PER_SECOND or 10)
+        """
+        self.username = username
+        self.token = token
+        self.client = client or get_github(token)
+        # GitHub's quota is per token, so is the bucket
+        self.rate_limiter = RateLimiter(max_rate=max_rate or float(os.getenv('GITHUB_MAX_REQUESTS_PER_SECOND', 10)))
+        self._lock = threading.Lock()
+
+    @property
+    def login(self):
+        """The account's login, one request the first time when no username was configured"""
+        if self.username is None:
+            with self._lock:
+                if self.username is None:
+                    self.username = self.client.get_user().login
+        return self.username
+
+    def remaining(self):
+        """Requests left in the current window, from the last response's headers (no request)"""
+        remaining, _ = self.client.requester.rate_limiting
+        return remaining if remaining >= 0 else DEFAULT_QUOTA
+
+
+class TokenPool:
+    """Every configured account, with routing of each request to the token best placed to serve it
+
+    Public repos can be read with any token, so their requests go through whichever
+    token has the most quota left; private repos only through the account that listed them.
+    """
+
+    def __init__(self, accounts):
+        """
+        Args:
+            accounts (list): GitHubAccount objects, the first one is the primary account
+        """
+        if not accounts:
+            raise ValueError("At least one GitHub account is needed")
+        self.accounts = list(accounts)
+        self.primary = self.accounts[0]
+        self._by_requester = {id(account.client.requester): account for account in reversed(self.accounts)}
+
+    @classmethod
+    def from_env(cls):
+        """Accounts from GITHUB_ACCOUNTS ('user:token,user2:token2'), else GITHUB_USERNAME/GITHUB_TOKEN"""
+        pairs = os.getenv('GITHUB_ACCOUNTS')
+        if not pairs:
+            return cls([GitHubAccount(os.getenv('GITHUB_USERNAME'), os.getenv('GITHUB_TOKEN'))])
+        accounts = []
+        for pair in pairs.split(','):
+            if not pair.strip():
+                continue
+            username, _, token = pair.strip().partition(':')
+            if not token:
+                raise ValueError(f"GITHUB_ACCOUNTS entries must be username:token, got {username!r}")
+            accounts.append(GitHubAccount(username, token))
+        return cls(accounts)
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def owner_of(self, obj):
+        """Account whose client fetched a PyGithub object (the primary for anything else)"""
+        return self._by_requester.get(id(getattr(obj, '_requester', None)), self.primary)
+
+    def best(self):
+        """Account with the most requests left"""
+        return max(self.accounts, key=lambda account: account.remaining())
+
+    def for_repo(self, repo):
+        """Account to send a request about `repo` through"""
+        # repos we know nothing about are treated as private
+        if getattr(repo, '_rawData', {}).get('private', True):
+            return self.owner_of(repo)
+        return self.best()
+
+    def key(self, login, name):
+        """Per-account key for sync state: the primary account keeps the plain name"""
+        return name if login == self.primary.login else f"{login}:{name}"
+
+    def find(self, login):
+        return next((account for account in self.accounts if account.login == login), None)
@@ -1,15 +1,195 @@
-from github import Github, Auth
-from datetime import datetime
-from ..models import LearningLog
-
-class CommitExtractor:
-    def __init__(self, github_token):
-        self.github = Github(auth=Auth.Token(github_token))
-    
-    def fetch_commits(self, username=None, since=None):
-        """Fetch commits from GitHub"""
-        # Move existing fetch_github_commits logic here
-        
-    def process_commit(self, commit_data):
-        """Process and store a single commit"""
-        # Move existing store_learning_log logic here
\ No newline at end of file
+''' STAGE 3: REAL-TIME UPDATES '''
+
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import threading
+import time
+from ..models import DeadLetter, LearningLog
+from .snapshot import snapshot_exporter
+
+logger = logging.getLogger(__name__)
+
+
+class PushCommit:
+    """Commit from a push payload, shaped like the PyGithub commits the detail fetchers expect
+
+    `files` is only loaded (one REST call) if the REST fallback needs it.
+    """
+
+    def __init__(self, repo, sha):
+        self.repo = repo
+        self.sha = sha
+
+    @property
+    def files(self):
+        return self.repo.get_commit(self.sha).files
+
+
+class WebhookHandler:
+    """Verifies GitHub push deliveries and stores their commits from a background worker
+
+    Requests only verify and enqueue, so GitHub gets its response in milliseconds; a
+    single worker drains the bounded queue in micro-batches into LearningLog.
+    """
+
+    def __init__(self, secret=None, max_queue=None, batch_size=None, flush_interval=None):
+        """
+        Args:
+            secret (str, optional): webhook secret configured on GitHub (default: GITHUB_WEBHOOK_SECRET, read on every delivery)
+            max_queue (int, optional): pushes held before new ones are dropped (default: WEBHOOK_QUEUE_SIZE or 1000)
+            batch_size (int, optional): pushes stored per micro-batch (default: WEBHOOK_BATCH_SIZE or 50)
+            flush_interval (float, optional): seconds to wait for a batch to fill (default: WEBHOOK_FLUSH_SECONDS or 2)
+        """
+        self._secret = secret
+        self.queue = queue.Queue(maxsize=max_queue or int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000)))
+        self.batch_size = batch_size or int(os.getenv('WEBHOOK_BATCH_SIZE', 50))
+        self.flush_interval = flush_interval or float(os.getenv('WEBHOOK_FLUSH_SECONDS', 2))
+        self.counters = {'received': 0, 'dropped': 0, 'processed': 0, 'stored': 0, 'skipped': 0, 'errors': 0}
+        self.lock = threading.Lock()
+        self._worker = None
+        self._extractor = None
+
+    @property
+    def secret(self):
+        # read late: the module singleton is built at import, before create_app loads .env
+        secret = self._secret or os.getenv('GITHUB_WEBHOOK_SECRET')
+        return secret.encode() if secret else None
+
+    def _count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, 'queue_depth': self.queue.qsize(), 'queue_capacity': self.queue.maxsize}
+
+    def verify_signature(self, body, signature):
+        """Check the X-Hub-Signature-256 header against the raw request body"""
+        secret = self.secret
+        if not secret:
+            logger.error("GITHUB_WEBHOOK_SECRET is not set, rejecting webhook")
+            return False
+        expected = 'sha256=' + hmac.new(secret, body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature or '')
+
+    def enqueue(self, payload):
+        """Queue a push payload without blocking, returns False if it was dropped"""
+        self._count('received')
+        self._ensure_worker()
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except queue.Full:
+            self._count('dropped')
+            logger.warning(f"Webhook queue full, dropped push to {payload.get('repository', {}).get('name')}")
+            return False
+
+    def _ensure_worker(self):
+        # started on first delivery so importing the app doesn't spawn threads
+        with self.lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='webhook-worker', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            try:
+                self.process(batch)
+            except Exception as e:
+                self._count('errors')
+                logger.error(f"Failed to store webhook batch of {len(batch)} pushes: {str(e)}", exc_info=True)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _get_extractor(self):
+        if self._extractor is None:
+            from .commit_extractor import CommitExtractor
+            self._extractor = CommitExtractor(workers=1)
+        return self._extractor
+
+    def process(self, payloads):
+        """Store the commits of several push payloads with one stats lookup per repo"""
+        extractor = self._get_extractor()
+        # only commits by tracked accounts are stored, like sync's author filter
+        logins = {account.login for account in extractor.pool.accounts}
+        logs = []
+        for payload in payloads:
+            try:
+                logs.extend(self._push_logs(extractor, logins, payload))
+            except (KeyError, TypeError, AttributeError, ValueError) as e:
+                # a malformed payload can't be replayed either, drop it and keep the rest of the batch
+                self._count('errors')
+                logger.error(f"Skipping malformed push payload: {type(e).__name__}: {str(e)}")
+
+        results = LearningLog.bulk_upsert(logs)
+        self._count('processed', len(payloads))
+        self._count('stored', results['inserted'])
+        self._count('skipped', results['skipped'])
+        logger.info(f"Webhook batch: {len(payloads)} pushes, {results['inserted']} stored, {results['skipped']} skipped")
+        if results['inserted']:
+            snapshot_exporter.refresh()
+        return results
+
+    def _push_logs(self, extractor, logins, payload):
+        """Learning logs for one push, [] if it's filtered out or its stats couldn't be fetched"""
+        repository = payload['repository']
+        # sync only follows the default branch, so do the same here
+        default_branch = repository.get('default_branch')
+        if not default_branch or payload.get('ref') != f"refs/heads/{default_branch}":
+            return []
+        if extractor.is_excluded(repository['name']):
+            return []
+
+        commits = [
+            commit for commit in payload.get('commits') or []
+            if (commit.get('author') or {}).get('username') in logins
+        ]
+        if not commits:
+            return []
+
+        # the payload has message, date and touched files but no line counts
+        repo = extractor.github.get_repo(repository['full_name'], lazy=True)
+        try:
+            stats = extractor.detail_fetcher.fetch_stats(repo, [PushCommit(repo, commit['id']) for commit in commits])
+        except Exception as e:
+            # GitHub calls are already retried, and GitHub got its 202 long ago: keep the push to replay
+            self.push_failed(payload, commits, e)
+            return []
+        return [
+            extractor.to_learning_log({
+                'commit_hash': commit['id'],
+                'commit_message': commit['message'],
+                'commit_date': commit['timestamp'],
+                'repository': repository['name'],
+                'author_account': commit['author']['username'],
+                **stats[commit['id']]
+            })
+            for commit in commits
+        ]
+
+    def push_failed(self, payload, commits, error):
+        """Record a push whose commits couldn't be stored, `flask retry-dead-letters` replays it"""
+        repository = payload['repository']
+        self._count('errors')
+        logger.error(f"Storing push to {repository['full_name']} failed: {str(error)}")
+        DeadLetter.record('webhook', f"{repository['full_name']}@{payload.get('after')}", str(error), payload={
+            'ref': payload.get('ref'),
+            'after': payload.get('after'),
+            'repository': {field: repository[field] for field in ('name', 'full_name', 'default_branch')},
+            'commits': commits
+        })
+
+
+webhook_handler = WebhookHandler()
@@ -0,0 +1,101 @@
+''' Shared fixtures: the app against an in-memory Mongo (mongomock), no network '''
+
+import os
+
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+# before learning_log reads them
+os.environ.update(
+    MONGO_URI='mongodb://localhost:27017/learning-logs',
+    MONGO_ENSURE_INDEXES='0',
+    SYNC_RESUME_JOBS='0',
+    CLASSIFICATION_SCHEDULER_ENABLED='0',
+    GITHUB_TOKEN='test-token',
+    OPENAI_API_KEY='test-key'
+)
+
+import flask_pymongo
+from mongomock.collection import BulkOperationBuilder
+
+
+class MongomockClient(mongomock.MongoClient):
+    """mongomock client that accepts the pool options create_app passes"""
+
+    def __init__(self, *args, **kwargs):
+        for option in ('tls', 'connect', 'maxPoolSize', 'serverSelectionTimeoutMS', 'connectTimeoutMS', 'socketTimeoutMS', 'event_listeners'):
+            kwargs.pop(option, None)
+        super().__init__(*args, **kwargs)
+
+
+flask_pymongo.MongoClient = MongomockClient
+
+# pymongo 4.11+ hands UpdateOne's sort to bulk builders, mongomock doesn't take it yet
+_add_update = BulkOperationBuilder.add_update
+BulkOperationBuilder.add_update = lambda self, *args, sort=None, **kwargs: _add_update(self, *args, **kwargs)
+
+# mongomock numbers bulk upserts among themselves, MongoDB by operation index (bulk_upsert relies on it)
+_execute = BulkOperationBuilder.execute
+_aggregate = BulkOperationBuilder._BulkOperationBuilder__aggregate_operation_result
+
+
+def _execute_by_index(self, write_concern=None):
+    def at(index, execute_func):
+        def run():
+            self.op_index = index
+            return execute_func()
+        run.__name__ = execute_func.__name__
+        return run
+    self.executors = [at(index, execute_func) for index, execute_func in enumerate(self.executors)]
+    return _execute(self, write_concern)
+
+
+def _aggregate_by_index(self, total_result, key, value):
+    if key == 'upserted':
+        total_result[key].append({'index': self.op_index, '_id': value})
+    else:
+        _aggregate(self, total_result, key, value)
+
+
+BulkOperationBuilder.execute = _execute_by_index
+BulkOperationBuilder._BulkOperationBuilder__aggregate_operation_result = _aggregate_by_index
+
+
+@pytest.fixture(scope='session')
+def app():
+    from learning_log import create_app
+    return create_app()
+
+
+@pytest.fixture
+def db(app):
+    """Empty database inside an app context, emptied again afterwards"""
+    from learning_log import mongo
+    from learning_log.models import Repository
+    with app.app_context():
+        yield mongo.db
+        for name in mongo.db.list_collection_names():
+            mongo.db.drop_collection(name)
+        Repository.forget()
+
+
+@pytest.fixture
+def make_logs(db):
+    """Store `count` unclassified logs (newest first: h0 is the newest), returns their hashes"""
+    from datetime import datetime, timedelta
+    from learning_log.models import LearningLog
+
+    def make_logs(count, prefix='h'):
+        LearningLog.bulk_upsert([{
+            'commit_hash': f'{prefix}{i}',
+            'commit_message': f'commit {i}',
+            'commit_date': datetime(2024, 6, 1) - timedelta(hours=i),
+            'repository': 'repo',
+            'author_account': 'alice',
+            'lines_added': i,
+            'lines_deleted': 0,
+            'files_changed': 1
+        } for i in range(count)])
+        return [f'{prefix}{i}' for i in range(count)]
+    return make_logs
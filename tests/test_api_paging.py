@@ -0,0 +1,94 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from learning_log.models import LearningLog
+from learning_log.services.response_cache import response_cache
+from learning_log.services.search import InvertedIndex, commit_search
+
+
+@pytest.fixture
+def client(app, db, monkeypatch):
+    response_cache.clear()
+    # mongomock has no $text, and the in-process index starts empty for every test
+    monkeypatch.setattr(commit_search, 'backend', 'memory')
+    monkeypatch.setattr(commit_search, 'index', InvertedIndex())
+    monkeypatch.setattr(commit_search, 'built', False)
+    monkeypatch.setattr(commit_search, 'synced_until', None)
+    return app.test_client()
+
+
+def pages(client, path, **params):
+    """Every page of `path` at limit=3, following next_cursor to the end"""
+    found = []
+    while True:
+        body = client.get(path, query_string={**params, 'limit': 3}).get_json()
+        found.append(body)
+        if body['next_cursor'] is None:
+            return found
+        params['cursor'] = body['next_cursor']
+
+
+def encode(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def test_logs_pages_follow_the_cursor(client, make_logs):
+    hashes = make_logs(7)
+    found = pages(client, '/logs')
+    assert [len(page['logs']) for page in found] == [3, 3, 1]
+    assert [log['commit_hash'] for page in found for log in page['logs']] == hashes
+
+
+@pytest.mark.parametrize('cursor', [
+    'zzz',
+    encode([1, 2]),
+    encode({'d': '2024-06-01T00:00:00'}),
+    encode({'d': 1, 'i': '0' * 24}),
+    encode({'d': '2024-06-01T00:00:00', 'i': 'not-an-object-id'}),
+])
+def test_logs_rejects_malformed_cursors(client, cursor):
+    response = client.get('/logs', query_string={'cursor': cursor})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid cursor'}
+
+
+@pytest.fixture
+def websocket_logs(db):
+    # scores differ by how often the word appears, some commits tie
+    LearningLog.bulk_upsert([{
+        'commit_hash': f'w{i}',
+        'commit_message': ' '.join(['websocket'] * (1 + i % 3)) + f' change {i}',
+        'commit_date': datetime(2024, 6, 1) - timedelta(hours=i),
+        'repository': 'repo',
+        'author_account': 'alice',
+        'files_changed': 1
+    } for i in range(7)] + [{
+        'commit_hash': 'other',
+        'commit_message': 'unrelated change',
+        'commit_date': datetime(2024, 6, 2),
+        'repository': 'repo',
+        'author_account': 'alice',
+        'files_changed': 1
+    }])
+
+
+@pytest.mark.parametrize('sort', ['relevance', 'date'])
+def test_search_pages_follow_the_cursor(client, websocket_logs, sort):
+    everything = client.get('/search', query_string={'q': 'websocket', 'sort': sort}).get_json()
+    found = pages(client, '/search', q='websocket', sort=sort)
+    assert everything['backend'] == 'memory'
+    assert [len(page['results']) for page in found] == [3, 3, 1]
+    assert [log['commit_hash'] for page in found for log in page['results']] == [log['commit_hash'] for log in everything['results']]
+    if sort == 'date':
+        assert [log['commit_hash'] for log in everything['results']] == [f'w{i}' for i in range(7)]
+    else:
+        scores = [log['score'] for log in everything['results']]
+        assert scores == sorted(scores, reverse=True) and len(set(scores)) == 3
+
+
+def test_search_rejects_malformed_cursors(client, websocket_logs):
+    response = client.get('/search', query_string={'q': 'websocket', 'cursor': 'zzz'})
+    assert response.status_code == 400
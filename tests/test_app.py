@@ -0,0 +1,28 @@
+import learning_log
+from learning_log.services.scheduler import ClassificationScheduler
+from learning_log.services.sync_jobs import SyncJobRunner
+
+
+def test_background_work_waits_for_the_first_request(monkeypatch):
+    started = []
+    monkeypatch.setenv('CLASSIFICATION_SCHEDULER_ENABLED', '1')
+    monkeypatch.setattr(learning_log, '_start_ensure_indexes', lambda: started.append('indexes'))
+    monkeypatch.setattr(SyncJobRunner, 'start_watcher', lambda self: started.append('watcher'))
+    monkeypatch.setattr(ClassificationScheduler, 'start', lambda self: started.append('scheduler'))
+    app = learning_log.create_app({'MONGO_ENSURE_INDEXES': True, 'SYNC_RESUME_JOBS': True})
+    # building the app (as every `flask <command>` does) starts nothing
+    assert started == []
+    with app.test_request_context('/'):
+        app.preprocess_request()
+    assert sorted(started) == ['indexes', 'scheduler', 'watcher']
+
+
+def test_dead_letter_commands(app, db):
+    from learning_log.models import DeadLetter
+    DeadLetter.record('sync_repo', 'repo', 'timed out', repository='repo', account='alice')
+    runner = app.test_cli_runner()
+    listed = runner.invoke(args=['dead-letters'])
+    assert listed.exit_code == 0
+    assert 'sync_repo repo (1x): timed out' in listed.output
+    assert runner.invoke(args=['retry-dead-letters']).output == 'Cleared 1 sync_repo dead letters\n'
+    assert runner.invoke(args=['dead-letters']).output == ''
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pytest
+from mongomock.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from learning_log.models import LearningLog
+
+
+def logs(*hashes):
+    return [{
+        'commit_hash': commit_hash,
+        'commit_message': f'commit {commit_hash}',
+        'commit_date': datetime(2024, 6, 1),
+        'repository': 'repo',
+        'files_changed': 1
+    } for commit_hash in hashes]
+
+
+def test_counts_inserted_and_skipped_across_batches(db):
+    LearningLog.bulk_upsert(logs('a', 'b'))
+    inserted = []
+    results = LearningLog.bulk_upsert(logs('a', 'c', 'b', 'd', 'e'), batch_size=2, inserted=inserted)
+    assert results == {'inserted': 3, 'skipped': 2}
+    assert [log['commit_hash'] for log in inserted] == ['c', 'd', 'e']
+    assert all('_id' in log for log in inserted)
+    assert db.learning_logs.count_documents({}) == 5
+
+
+def test_repeated_hash_in_one_call_is_stored_once(db):
+    assert LearningLog.bulk_upsert(logs('a', 'a')) == {'inserted': 1, 'skipped': 1}
+
+
+def race(db, monkeypatch, code):
+    """bulk_write fails like an unordered write that lost op 1's upsert to another writer"""
+    bulk_write_all = Collection.bulk_write
+
+    def bulk_write(self, operations, ordered=True, **kwargs):
+        if self.name != 'learning_logs':
+            return bulk_write_all(self, operations, ordered=ordered, **kwargs)
+        _id = db.learning_logs.insert_one({'commit_hash': 'a'}).inserted_id
+        db.learning_logs.insert_one({'commit_hash': 'b'})
+        raise BulkWriteError({
+            'writeErrors': [{'index': 1, 'code': code, 'errmsg': 'E11000 duplicate key error'}],
+            'upserted': [{'index': 0, '_id': _id}]
+        })
+    monkeypatch.setattr(Collection, 'bulk_write', bulk_write)
+
+
+def test_duplicate_key_race_counts_as_a_skip(db, monkeypatch):
+    race(db, monkeypatch, 11000)
+    inserted = []
+    assert LearningLog.bulk_upsert(logs('a', 'b'), inserted=inserted) == {'inserted': 1, 'skipped': 1}
+    assert [log['commit_hash'] for log in inserted] == ['a']
+
+
+def test_other_write_errors_are_raised(db, monkeypatch):
+    race(db, monkeypatch, 121)
+    with pytest.raises(BulkWriteError):
+        LearningLog.bulk_upsert(logs('a', 'b'))
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+from learning_log.models import DeadLetter, LearningLog
+from learning_log.services.commit_classifier import COMMIT_TYPES
+
+
+def test_claims_are_exclusive_and_newest_first(make_logs):
+    make_logs(5)
+    first = LearningLog.claim_unclassified('worker-a', limit=3)
+    second = LearningLog.claim_unclassified('worker-b', limit=3)
+    assert [log['commit_hash'] for log in first] == ['h0', 'h1', 'h2']
+    assert [log['commit_hash'] for log in second] == ['h3', 'h4']
+    assert LearningLog.claim_unclassified('worker-c') == []
+
+
+def test_expired_lease_is_reclaimed(db, make_logs):
+    make_logs(2)
+    LearningLog.claim_unclassified('crashed', limit=2)
+    db.learning_logs.update_one({'commit_hash': 'h1'}, {'$set': {'lease_expires': datetime.utcnow() - timedelta(seconds=1)}})
+    assert [log['commit_hash'] for log in LearningLog.claim_unclassified('worker')] == ['h1']
+
+
+def test_set_types_needs_the_lease(make_logs):
+    make_logs(2)
+    LearningLog.claim_unclassified('worker-a', limit=1)
+    LearningLog.claim_unclassified('worker-b', limit=1)
+    updated = LearningLog.set_types({'h0': COMMIT_TYPES[2], 'h1': COMMIT_TYPES[2]}, 'worker-a')
+    assert updated == 1
+    assert LearningLog.find_by_commit_hash('h0')['commit_type'] == COMMIT_TYPES[2]
+    assert LearningLog.find_by_commit_hash('h1')['commit_type'] is None
+
+
+def test_set_types_only_reports_commits_it_updated(make_logs, monkeypatch):
+    from learning_log.services.search import commit_search
+    reported = []
+    monkeypatch.setattr(commit_search, 'on_classify', reported.append)
+    make_logs(2)
+    LearningLog.claim_unclassified('worker-a', limit=1)
+    LearningLog.claim_unclassified('worker-b', limit=1)
+    LearningLog.set_types({'h0': COMMIT_TYPES[2], 'h1': COMMIT_TYPES[3]}, 'worker-a')
+    assert reported == [{'h0': COMMIT_TYPES[2]}]
+
+
+def test_retry_later_backs_off_then_parks(db, make_logs, monkeypatch):
+    monkeypatch.setenv('CLASSIFY_RETRY_SECONDS', '60')
+    make_logs(1)
+    for attempt in range(1, 3):
+        db.learning_logs.update_one({'commit_hash': 'h0'}, {'$unset': {'lease_expires': ''}})
+        assert LearningLog.claim_unclassified('worker')
+        assert LearningLog.retry_later({'h0': 'timeout'}, 'worker', max_attempts=3) == 0
+        doc = db.learning_logs.find_one({'commit_hash': 'h0'})
+        assert doc['classify_attempts'] == attempt
+        # full jitter: anywhere up to the doubled base
+        assert doc['lease_expires'] <= datetime.utcnow() + timedelta(seconds=60 * 2 ** (attempt - 1))
+        assert list(DeadLetter.find('classify')) == []
+
+    db.learning_logs.update_one({'commit_hash': 'h0'}, {'$unset': {'lease_expires': ''}})
+    LearningLog.claim_unclassified('worker')
+    assert LearningLog.retry_later({'h0': 'timeout'}, 'worker', max_attempts=3) == 1
+    assert db.learning_logs.find_one({'commit_hash': 'h0'})['lease_expires'] == LearningLog.PARKED
+    assert [(letter['key'], letter['error']) for letter in DeadLetter.find('classify')] == [('h0', 'timeout')]
+    assert LearningLog.claim_unclassified('worker') == []
+
+
+def test_retry_later_ignores_lost_leases(db, make_logs):
+    make_logs(1)
+    LearningLog.claim_unclassified('worker')
+    assert LearningLog.retry_later({'h0': 'timeout'}, 'someone-else', max_attempts=1) == 0
+    assert 'classify_attempts' not in db.learning_logs.find_one({'commit_hash': 'h0'})
+
+
+def test_retry_dead_letters_unparks(db, make_logs):
+    make_logs(1)
+    LearningLog.claim_unclassified('worker')
+    LearningLog.retry_later({'h0': 'timeout'}, 'worker', max_attempts=1)
+    assert DeadLetter.retry('classify') == {'classify': 1}
+    assert [log['commit_hash'] for log in LearningLog.claim_unclassified('worker')] == ['h0']
+    assert 'classify_attempts' not in db.learning_logs.find_one({'commit_hash': 'h0'})
@@ -0,0 +1,25 @@
+import pytest
+
+from learning_log.services.commit_classifier import COMMIT_TYPES, MODEL_TYPES, rule_based_type
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('Merge branch main into feature-3', 3),
+    ("Merge pull request #12 from alice/fix-login\n\nFix login", 3),
+    ("Merge remote-tracking branch 'origin/main'", 3),
+    ('feat(api): add /search', 1),
+    ('fix: off-by-one in paging', 2),
+    ('Bump requests from 2.31.0 to 2.32.0', 9),
+])
+def test_rules_only_answer_with_known_types(message, expected):
+    assert rule_based_type(message) == COMMIT_TYPES[expected]
+
+
+def test_other_messages_are_left_to_the_model():
+    assert rule_based_type('Merged some ideas from the spike') is None
+    assert rule_based_type('chore: tidy up') is None
+
+
+def test_every_type_can_come_from_the_model():
+    # rules have no types of their own, a classifier trained on model answers knows them all
+    assert sorted(COMMIT_TYPES) == list(MODEL_TYPES)
@@ -0,0 +1,39 @@
+import pytest
+
+from benchmarks.fakes import FakeGithub
+from learning_log.services.commit_details import GraphQLCommitDetailFetcher, RestCommitDetailFetcher
+from learning_log.services.commit_extractor import CommitExtractor
+from learning_log.services.token_pool import GitHubAccount, TokenPool
+
+
+@pytest.fixture
+def fake():
+    return FakeGithub(repos=1, commits=4, files=2)
+
+
+@pytest.fixture
+def extractor(db, fake):
+    return CommitExtractor(pool=TokenPool([GitHubAccount('bench', 'token', client=fake)]), workers=1)
+
+
+@pytest.mark.parametrize('response', [
+    {'data': {'repository': None}},
+    {'data': None, 'errors': [{'message': 'Could not resolve to a Repository'}]},
+    {'data': {'repository': {}}, 'errors': [{'message': 'Something went wrong'}]},
+])
+def test_unusable_graphql_answers_fall_back_to_rest(extractor, fake, monkeypatch, response):
+    monkeypatch.setattr(fake.requester, 'graphql_query', lambda query, variables: ({}, response))
+    repo = fake.repos[0]
+    commits = repo.commits
+
+    stats = GraphQLCommitDetailFetcher(extractor).fetch_stats(repo, commits)
+
+    assert stats == RestCommitDetailFetcher(extractor).fetch_stats(repo, commits)
+    assert set(stats) == {commit.sha for commit in commits}
+
+
+def test_graphql_answers_are_used(extractor, fake):
+    repo = fake.repos[0]
+    stats = GraphQLCommitDetailFetcher(extractor).fetch_stats(repo, repo.commits)
+    assert stats == RestCommitDetailFetcher(extractor).fetch_stats(repo, repo.commits)
+    assert fake.calls.counts['graphql'] == 1
@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+import pytest
+
+from benchmarks.fakes import FakeCommit, FakeGithub
+from learning_log.models import SyncState
+from learning_log.services.commit_extractor import CommitExtractor
+from learning_log.services.token_pool import GitHubAccount, TokenPool
+
+
+@pytest.fixture
+def fake():
+    return FakeGithub(repos=1, commits=150, files=1)
+
+
+@pytest.fixture
+def extractor(db, fake):
+    return CommitExtractor(pool=TokenPool([GitHubAccount('bench', 'token', client=fake)]), workers=1)
+
+
+def push(fake, repo, count):
+    """Add `count` commits on top of `repo`, like a push would"""
+    newest = repo.commits[0]
+    date = newest.commit.committer.date
+    commits = [
+        FakeCommit(fake, f'ff{n:038x}', f'pushed {n}', date + timedelta(minutes=n + 1), newest._files)
+        for n in reversed(range(count))
+    ]
+    repo.commits = commits + repo.commits
+    repo.pushed_at = commits[0].commit.committer.date
+
+
+def test_first_sync_stores_everything_and_saves_the_cursor(extractor, fake):
+    repo = fake.repos[0]
+    assert extractor.sync_repo(repo, 'bench') == {'processed': 150, 'skipped': 0}
+    cursor = SyncState.get_cursor(repo.name)
+    assert cursor['commit_sha'] == repo.commits[0].sha
+    assert SyncState.is_unchanged(cursor, repo.pushed_at)
+
+
+def test_nothing_pushed_costs_no_request(extractor, fake):
+    repo = fake.repos[0]
+    extractor.sync_repo(repo, 'bench')
+    before = fake.calls.total()
+    assert extractor.sync_repo(repo, 'bench') == {'processed': 0, 'skipped': 0}
+    assert fake.calls.total() == before
+
+
+def test_next_sync_stops_at_the_stored_sha(extractor, fake):
+    repo = fake.repos[0]
+    extractor.sync_repo(repo, 'bench')
+    push(fake, repo, 3)
+    pages = fake.calls.counts['commit_page']
+
+    # the cursor commit itself is listed (since is inclusive) but not stored again
+    assert extractor.sync_repo(repo, 'bench') == {'processed': 3, 'skipped': 0}
+    assert fake.calls.counts['commit_page'] == pages + 1
+    assert SyncState.get_cursor(repo.name)['commit_sha'] == repo.commits[0].sha
+
+
+def test_full_sync_ignores_the_cursor(extractor, fake):
+    repo = fake.repos[0]
+    extractor.sync_repo(repo, 'bench')
+    assert extractor.sync_repo(repo, 'bench', full=True) == {'processed': 0, 'skipped': 150}
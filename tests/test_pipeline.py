@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+from benchmarks.fakes import FakeGithub, StubOpenAI
+from learning_log.models import SyncState
+from learning_log.services.commit_classifier import CommitClassifier
+from learning_log.services.commit_extractor import CommitExtractor
+from learning_log.services.pipeline import SyncPipeline
+from learning_log.services.token_pool import GitHubAccount, TokenPool
+
+
+@pytest.fixture
+def pipeline(db):
+    fake = FakeGithub(repos=3, commits=5, files=1)
+    extractor = CommitExtractor(pool=TokenPool([GitHubAccount('bench', 'token', client=fake)]), workers=2)
+    return SyncPipeline(extractor, CommitClassifier(client=StubOpenAI()), queue_size=1), fake
+
+
+def stage_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith('pipeline-')]
+
+
+def test_cursor_read_failure_fails_only_that_repo(db, pipeline, monkeypatch):
+    pipeline, fake = pipeline
+    broken = fake.repos[1].name
+    get_cursor = SyncState.get_cursor
+
+    def flaky_cursor(key):
+        if key == broken:
+            raise RuntimeError('cursor read failed')
+        return get_cursor(key)
+    monkeypatch.setattr(SyncState, 'get_cursor', flaky_cursor)
+    failed, done = [], []
+
+    results = pipeline.run(
+        on_repo_failed=lambda login, repo, error: failed.append((repo.name, str(error))),
+        on_repo_done=lambda login, repo: done.append(repo.name)
+    )
+
+    assert failed == [(broken, 'cursor read failed')]
+    assert sorted(done) == sorted(repo.name for repo in fake.repos if repo.name != broken)
+    assert results['processed'] == 10
+    assert db.learning_logs.count_documents({}) == 10
+
+
+def test_stage_threads_stop_when_fetching_raises(db, pipeline, monkeypatch):
+    pipeline, fake = pipeline
+
+    def fetch(repo, login, full):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(pipeline, '_fetch_repo', fetch)
+
+    with pytest.raises(RuntimeError, match='boom'):
+        pipeline.run()
+    assert stage_threads() == []
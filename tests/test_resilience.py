@@ -0,0 +1,171 @@
+import github
+import pytest
+
+from learning_log.models import DeadLetter
+from learning_log.services import resilience
+from learning_log.services.resilience import CircuitBreaker, CircuitOpen, OutboundService, github_transient, retry_after
+
+
+class Clock:
+    """Stands in for time.monotonic/time.sleep, sleeping just moves it forward"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(resilience.time, 'sleep', clock.sleep)
+    return clock
+
+
+def fail(error):
+    def call():
+        raise error
+    return call
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_seconds=30)
+    breaker.failed()
+    breaker.failed()
+    breaker.succeeded()  # a success resets the count
+    breaker.failed()
+    breaker.failed()
+    breaker.before_call()
+    breaker.failed()
+    with pytest.raises(CircuitOpen) as raised:
+        breaker.before_call()
+    assert raised.value.retry_in == 30
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_seconds=30)
+    breaker.failed()
+    clock.now += 30
+    breaker.before_call()  # the probe
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    breaker.failed()  # failed probe: open for another reset period
+    with pytest.raises(CircuitOpen) as raised:
+        breaker.before_call()
+    assert raised.value.retry_in == 30
+
+    clock.now += 30
+    breaker.before_call()
+    breaker.succeeded()
+    breaker.before_call()
+    breaker.before_call()
+    assert breaker.opened_at is None
+
+
+def test_released_probe_lets_the_next_call_probe(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_seconds=1)
+    breaker.failed()
+    clock.now += 1
+    breaker.before_call()
+    breaker.released()
+    breaker.before_call()
+
+
+def test_transient_errors_are_retried_until_success(clock):
+    service = OutboundService('test', lambda error: isinstance(error, ConnectionError), max_attempts=5, backoff=1, breaker_failures=10)
+    outcomes = [ConnectionError('blip'), ConnectionError('blip'), 'ok']
+
+    def flaky():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert service.call(flaky) == 'ok'
+    assert len(clock.sleeps) == 2
+    # full jitter under a doubling cap
+    assert clock.sleeps[0] <= 1 and clock.sleeps[1] <= 2
+    assert service.breaker.failures == 0
+
+
+def test_gives_up_with_the_original_error(clock):
+    service = OutboundService('test', lambda error: isinstance(error, ConnectionError), max_attempts=3, backoff=1, breaker_failures=10)
+    with pytest.raises(ConnectionError, match='down'):
+        service.call(fail(ConnectionError('down')))
+    assert len(clock.sleeps) == 2
+
+
+def test_permanent_errors_are_not_retried_or_counted(clock):
+    service = OutboundService('test', lambda error: isinstance(error, ConnectionError), max_attempts=3, breaker_failures=1)
+    with pytest.raises(ValueError):
+        service.call(fail(ValueError('bad request')))
+    assert clock.sleeps == []
+    assert service.breaker.opened_at is None
+
+
+def test_open_circuit_fails_fast_past_the_deadline(clock):
+    service = OutboundService('test', lambda error: isinstance(error, ConnectionError), max_attempts=1, breaker_failures=1, breaker_reset=30)
+    with pytest.raises(ConnectionError):
+        service.call(fail(ConnectionError('down')))
+    calls = []
+    with pytest.raises(CircuitOpen):
+        service.call(lambda: calls.append(1), deadline=5)
+    assert calls == []
+    # a caller with time to spare waits for the probe and becomes it
+    assert service.call(lambda: 'back', deadline=60) == 'back'
+    assert service.breaker.opened_at is None
+
+
+def test_retry_after_reads_server_hints():
+    assert retry_after(github.GithubException(429, {}, {'Retry-After': '7'})) == 7
+    assert retry_after(github.GithubException(502, {}, {})) is None
+    rate_limited = github.GithubException(403, {'message': 'API rate limit exceeded'}, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '0'})
+    assert retry_after(rate_limited) == 0
+    assert github_transient(rate_limited)
+    assert github_transient(github.GithubException(503, {}, {}))
+    assert not github_transient(github.GithubException(404, {}, {}))
+    assert not github_transient(github.GithubException(403, {'message': 'Resource not accessible'}, {}))
+
+
+def test_dead_letters_count_failures_and_resolve(db):
+    DeadLetter.record('sync_repo', 'repo-0', 'bad gateway', repository='repo-0')
+    DeadLetter.record('sync_repo', 'repo-0', 'timed out', repository='repo-0')
+    letter, = DeadLetter.find('sync_repo')
+    assert (letter['failures'], letter['error'], letter['item']) == (2, 'timed out', {'repository': 'repo-0'})
+    DeadLetter.resolve('sync_repo', 'repo-0')
+    assert list(DeadLetter.find()) == []
+
+
+def test_failing_repo_is_dead_lettered_and_the_sync_goes_on(db, clock, monkeypatch):
+    from benchmarks.fakes import FakeGithub
+    from learning_log.services.commit_extractor import CommitExtractor
+    from learning_log.services.token_pool import GitHubAccount, TokenPool
+
+    monkeypatch.setattr(resilience.github_service, 'max_attempts', 2)
+    monkeypatch.setattr(resilience.github_service.breaker, 'failure_threshold', 100)
+    fake = FakeGithub(repos=2, commits=5, files=1)
+    broken = fake.repos[0]
+    get_commits = broken.get_commits
+
+    class BadGateway:
+        def get_page(self, page):
+            raise github.GithubException(502, {'message': 'bad gateway'}, {})
+    monkeypatch.setattr(broken, 'get_commits', lambda **kwargs: BadGateway())
+
+    extractor = CommitExtractor(pool=TokenPool([GitHubAccount('bench', 'token', client=fake)]), workers=1)
+    result = extractor.sync_logs(full=True).json
+    assert result['failed'] == [broken.name]
+    assert result['processed'] == 5
+    assert [letter['_id'] for letter in DeadLetter.find('sync_repo')] == [f'sync_repo:{broken.name}']
+
+    monkeypatch.setattr(broken, 'get_commits', get_commits)
+    assert extractor.sync_logs(full=True).json['failed'] == []
+    assert list(DeadLetter.find()) == []
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import pytest
+
+from learning_log.models import LearningLog
+from learning_log.services.commit_classifier import COMMIT_TYPES
+from learning_log.services.response_cache import ResponseCache, response_cache
+
+
+@pytest.fixture
+def client(app, db):
+    response_cache.clear()
+    return app.test_client()
+
+
+def hashes(response):
+    return [log['commit_hash'] for log in response.get_json()['logs']]
+
+
+def test_etag_revalidates_to_304(client, make_logs):
+    make_logs(2)
+    first = client.get('/logs')
+    assert first.status_code == 200 and first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    again = client.get('/logs', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+    # params in another order share the entry
+    assert client.get('/logs?limit=5&repository=').headers['ETag'] == client.get('/logs?limit=5').headers['ETag']
+
+
+def test_entries_are_served_until_a_write(client, db, make_logs):
+    make_logs(2)
+    cached = client.get('/logs')
+    # bypasses LearningLog, so nothing tells the cache
+    db.learning_logs.delete_one({'commit_hash': 'h0'})
+    assert client.get('/logs').headers['ETag'] == cached.headers['ETag']
+
+
+def test_create_invalidates(client, make_logs):
+    make_logs(1)
+    client.get('/logs')
+    LearningLog.create({'commit_hash': 'new', 'commit_message': 'new', 'commit_date': datetime(2024, 7, 1), 'repository': 'repo', 'files_changed': 1})
+    assert hashes(client.get('/logs')) == ['new', 'h0']
+
+
+def test_bulk_upsert_invalidates_only_when_it_inserts(client, make_logs):
+    make_logs(1)
+    cached = client.get('/logs')
+    make_logs(1)  # h0 again, nothing new
+    assert client.get('/logs').headers['ETag'] == cached.headers['ETag']
+    make_logs(1, prefix='n')
+    assert hashes(client.get('/logs')) == ['n0', 'h0']  # same date, newer _id first
+
+
+def test_set_types_invalidates(client, make_logs):
+    make_logs(1)
+    client.get('/logs')
+    LearningLog.claim_unclassified('worker')
+    LearningLog.set_types({'h0': COMMIT_TYPES[1]}, 'worker')
+    assert client.get('/logs').get_json()['logs'][0]['commit_type'] == COMMIT_TYPES[1]
+
+
+def test_entries_expire_and_the_oldest_is_evicted(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('learning_log.services.response_cache.time.monotonic', lambda: now[0])
+    cache = ResponseCache(max_entries=2, ttl=10)
+    for key in ('a', 'b'):
+        cache.set(key, 0, key.encode(), 'application/json')
+    assert cache.get('a', 0).body == b'a'  # a is now the most recent
+    cache.set('c', 0, b'c', 'application/json')
+    assert cache.get('b', 0) is None
+    assert cache.get('a', 1) is None  # older generation
+    now[0] += 11
+    assert cache.get('c', 0) is None
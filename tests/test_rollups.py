@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from learning_log.models import CommitRollup, LearningLog
+from learning_log.services.commit_classifier import COMMIT_TYPES
+
+
+def totals(**filters):
+    return {
+        (bucket['_id']['repository'], bucket['_id']['week'], bucket['_id']['commit_type']): (bucket['commits'], bucket['lines_added'])
+        for bucket in CommitRollup.query(**filters)
+    }
+
+
+def insert_old(db, count, commit_type=None):
+    """Logs stored two hours ago, before the rebuild's high-water mark"""
+    stored = datetime.utcnow() - timedelta(hours=2)
+    db.learning_logs.insert_many([{
+        '_id': ObjectId.from_datetime(stored + timedelta(seconds=i)),
+        'commit_hash': f'old{i}',
+        'commit_message': f'old {i}',
+        'commit_date': datetime(2024, 1, 3 + i),  # wed, thu, fri, sat...
+        'repository': 'repo',
+        'lines_added': 10,
+        'lines_deleted': 0,
+        'files_changed': 1,
+        'created_at': stored,
+        'commit_type': commit_type
+    } for i in range(count)])
+
+
+def test_rebuild_matches_incremental_rollups(db, make_logs):
+    make_logs(5)
+    LearningLog.claim_unclassified('worker', limit=2)
+    LearningLog.set_types({'h0': COMMIT_TYPES[1], 'h1': COMMIT_TYPES[2]}, 'worker')
+    incremental = totals()
+
+    CommitRollup.rebuild()
+
+    assert totals() == incremental
+
+
+def test_rebuild_groups_days_into_iso_weeks(db):
+    insert_old(db, 6, COMMIT_TYPES[1])
+    CommitRollup.rebuild()
+    # 3-7 Jan 2024 fall in the week of Monday the 1st, the 8th starts the next one
+    assert totals() == {
+        ('repo', datetime(2024, 1, 1), COMMIT_TYPES[1]): (5, 50),
+        ('repo', datetime(2024, 1, 8), COMMIT_TYPES[1]): (1, 10),
+    }
+
+
+def test_writes_during_the_scan_are_replayed(db, make_logs, monkeypatch):
+    insert_old(db, 2)
+    replay = CommitRollup._replay.__func__
+
+    def write_then_replay(cls, *args, **kwargs):
+        # lands after the scan, its live $inc goes to the collection about to be replaced
+        LearningLog.claim_unclassified('worker', limit=10)
+        LearningLog.set_types({'old0': COMMIT_TYPES[3]}, 'worker')
+        make_logs(1, prefix='new')
+        return replay(cls, *args, **kwargs)
+    monkeypatch.setattr(CommitRollup, '_replay', classmethod(write_then_replay))
+
+    CommitRollup.rebuild()
+
+    assert totals() == {
+        ('repo', datetime(2024, 1, 1), COMMIT_TYPES[3]): (1, 10),
+        ('repo', datetime(2024, 1, 1), None): (1, 10),
+        ('repo', datetime(2024, 5, 27), None): (1, 0),  # new0, committed on Saturday 1 June
+    }
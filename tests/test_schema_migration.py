@@ -0,0 +1,80 @@
+from datetime import datetime
+
+from learning_log.models import LearningLog
+from learning_log.services.commit_classifier import COMMIT_TYPES
+
+
+def insert_v1(db, count, commit_type=None):
+    """Logs as the code before schema v2 stored them"""
+    db.learning_logs.insert_many([{
+        'commit_hash': f'old{i}',
+        'commit_message': f'old commit {i}',
+        'commit_date': datetime(2024, 1, 1, i),
+        'repository': 'legacy-repo',
+        'lines_added': i,
+        'lines_deleted': 1,
+        'files_changed': 2,
+        'created_at': datetime(2024, 1, 2),
+        'author_account': 'alice',
+        'commit_type': commit_type
+    } for i in range(count)])
+
+
+def test_migration_rewrites_v1_and_reads_stay_the_same(db):
+    insert_v1(db, 5, COMMIT_TYPES[1])
+    before = sorted(LearningLog.find_page(), key=lambda log: log['commit_hash'])
+
+    stats = LearningLog.migrate(batch_size=2)
+
+    assert stats == {'migrated': 5, 'retried': 0, 'skipped': 0}
+    doc = db.learning_logs.find_one({'commit_hash': 'old3'})
+    assert doc['v'] == LearningLog.SCHEMA_VERSION
+    assert doc['la'] == 3 and 'lines_added' not in doc
+    assert doc['commit_type'] == 1
+    assert sorted(LearningLog.find_page(), key=lambda log: log['commit_hash']) == before
+    assert [log['commit_hash'] for log in LearningLog.find_page(commit_type=COMMIT_TYPES[1], repository='legacy-repo')][:1] == ['old4']
+
+
+def test_migration_resumes_from_its_checkpoint(db):
+    insert_v1(db, 4)
+    LearningLog.migrate(batch_size=2)
+    # a process still on the old code writes one more v1 log, only it is read again
+    db.learning_logs.insert_one({
+        'commit_hash': 'late', 'commit_message': 'late', 'commit_date': datetime(2024, 2, 1), 'repository': 'legacy-repo',
+        'lines_added': 0, 'lines_deleted': 0, 'files_changed': 1, 'created_at': datetime(2024, 2, 1), 'commit_type': None
+    })
+    assert LearningLog.migrate(batch_size=2)['migrated'] == 1
+    assert db.learning_logs.count_documents({'v': LearningLog.SCHEMA_VERSION}) == 5
+
+
+def test_classification_during_a_batch_is_not_overwritten(db, monkeypatch):
+    insert_v1(db, 3)
+    migrate_batch = LearningLog._migrate_batch.__func__
+    raced = []
+
+    def classify_first(cls, docs):
+        if not raced:
+            # lands between the batch's read and its rewrite
+            raced.append(db.learning_logs.update_one({'commit_hash': 'old1'}, {'$set': {'commit_type': COMMIT_TYPES[2]}}))
+        return migrate_batch(cls, docs)
+    monkeypatch.setattr(LearningLog, '_migrate_batch', classmethod(classify_first))
+
+    stats = LearningLog.migrate()
+
+    assert stats == {'migrated': 3, 'retried': 1, 'skipped': 0}
+    assert LearningLog.find_by_commit_hash('old1')['commit_type'] == COMMIT_TYPES[2]
+
+
+def test_logs_left_behind_are_retried_by_the_next_run(db, monkeypatch):
+    insert_v1(db, 4)
+    stuck = db.learning_logs.find_one({'commit_hash': 'old1'})['_id']
+    migrate_batch = LearningLog._migrate_batch.__func__
+    # old1 keeps changing underneath every rewrite
+    monkeypatch.setattr(LearningLog, '_migrate_batch', classmethod(lambda cls, docs: migrate_batch(cls, [doc for doc in docs if doc['_id'] != stuck])))
+
+    assert LearningLog.migrate(batch_size=2)['skipped'] == 1
+    assert db.schema_migrations.find_one({'_id': 'learning_logs'})['skipped'] == [stuck]
+
+    monkeypatch.undo()
+    assert LearningLog.migrate(batch_size=2) == {'migrated': 1, 'retried': 0, 'skipped': 0}
+    assert db.learning_logs.count_documents({'v': {'$ne': LearningLog.SCHEMA_VERSION}}) == 0
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks.fakes import FakeGithub
+from learning_log.models import SyncJob
+from learning_log.services.commit_extractor import CommitExtractor
+from learning_log.services.sync_jobs import LeaseLost, SyncJobRunner, job_progress
+from learning_log.services.token_pool import GitHubAccount, TokenPool
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    """SyncJobRunner factory whose jobs are recorded instead of run"""
+    started = []
+    monkeypatch.setattr(SyncJobRunner, '_start', lambda self, job: started.append(job))
+
+    def runner(**kwargs):
+        return SyncJobRunner(**kwargs)
+    runner.started = started
+    return runner
+
+
+def test_one_job_at_a_time_across_runners(db, runner):
+    job, created = runner().submit(full=True)
+    # a fresh runner stands in for another process, it shares no lock with the first
+    again, created_again = runner().submit()
+    assert created and not created_again
+    assert again['_id'] == job['_id']
+    assert [started['_id'] for started in runner.started] == [job['_id']]
+
+
+def test_stale_job_blocks_new_ones_until_resumed(db, runner):
+    job, _ = runner(lease_seconds=-1).submit()
+    # its owner is gone, the watcher resumes it instead of a second job starting
+    again, created = runner().submit()
+    assert not created and again['_id'] == job['_id']
+
+
+def test_finished_job_frees_the_slot(db, runner):
+    job, _ = runner().submit()
+    SyncJob.finish(job['_id'], job['owner'], 'completed')
+    _, created = runner().submit()
+    assert created
+
+
+def test_stale_job_is_claimed_once_under_a_new_owner(db, runner):
+    job, _ = runner(lease_seconds=-1).submit()
+    assert runner().resume_stale() == 1
+    resumed = runner.started[-1]
+    assert resumed['_id'] == job['_id'] and resumed['resumes'] == 1
+    assert resumed['owner'] != job['owner']
+    # the new owner's lease is fresh, nobody else takes it
+    assert runner().resume_stale() == 0
+
+
+@pytest.fixture
+def fake():
+    return FakeGithub(repos=1, commits=250, files=1)
+
+
+@pytest.fixture
+def extractor(db, fake, monkeypatch):
+    extractor = CommitExtractor(pool=TokenPool([GitHubAccount('bench', 'token', client=fake)]), workers=1)
+    monkeypatch.setattr('learning_log.services.sync_jobs.CommitExtractor', lambda workers=None: extractor)
+    return extractor
+
+
+def test_stolen_job_raises_lease_lost(db, extractor, fake, runner):
+    job, _ = runner().submit()
+    repo = fake.repos[0]
+    job = SyncJob.add_repos(job, {str(repo.id): (repo.name, 'bench')})
+    # another process claimed the job after this run's lease ran out
+    db.sync_jobs.update_one({'_id': job['_id']}, {'$set': {'owner': 'thief'}})
+    with pytest.raises(LeaseLost):
+        SyncJobRunner()._run_repo(extractor, job, repo, 'bench')
+    assert SyncJob.get(job['_id'])['repos'][str(repo.id)]['status'] == 'pending'
+
+
+def test_taken_over_job_resumes_from_its_last_checkpoint(db, extractor, runner, monkeypatch):
+    job, _ = runner().submit(workers=1)
+    checkpoint = SyncJob.checkpoint
+    stealing = [True]
+
+    def stolen_after_first_page(job_id, owner, *args, **kwargs):
+        written = checkpoint(job_id, owner, *args, **kwargs)
+        if stealing[0]:
+            # the lease runs out right after page 0 is recorded, and another process claims the job
+            db.sync_jobs.update_one({'_id': job_id}, {'$set': {'owner': 'thief', 'lease_expires': datetime.utcnow() - timedelta(seconds=1)}})
+        return written
+    monkeypatch.setattr(SyncJob, 'checkpoint', stolen_after_first_page)
+
+    SyncJobRunner().run(job)
+    taken = SyncJob.get(job['_id'])
+    # the first run stopped at the lost lease without finishing the job
+    assert taken['status'] == 'running' and taken['owner'] == 'thief'
+    assert [repo['next_page'] for repo in taken['repos'].values()] == [1]
+
+    stealing[0] = False
+    resumer = runner()
+    assert resumer.resume_stale() == 1
+    resumer.run(runner.started[-1])
+
+    progress = job_progress(SyncJob.get(job['_id']))
+    assert progress['status'] == 'completed'
+    assert (progress['repos_total'], progress['repos_done'], progress['resumes']) == (1, 1, 1)
+    # page 1 was stored by the first run but never checkpointed, so it's redone (as skips) and page 0 isn't
+    assert (progress['processed'], progress['skipped']) == (150, 100)
+    assert db.learning_logs.count_documents({}) == 250
+
+
+def test_job_progress_reports_failures_and_eta():
+    created = datetime.utcnow() - timedelta(seconds=30)
+    job = {
+        '_id': 'job', 'status': 'running', 'full': False, 'resumes': 0, 'error': None,
+        'created_at': created, 'finished_at': None,
+        'totals': {'processed': 50, 'skipped': 10},
+        'repos': {
+            '1': {'name': 'api', 'account': None, 'status': 'done'},
+            '2': {'name': 'web', 'account': 'bob', 'status': 'failed', 'error': 'boom'},
+            '3': {'name': 'cli', 'account': None, 'status': 'running'},
+            '4': {'name': 'docs', 'account': None, 'status': 'pending'}
+        }
+    }
+    progress = job_progress(job)
+    assert (progress['repos_total'], progress['repos_done'], progress['repos_failed']) == (4, 1, 1)
+    assert progress['failed_repos'] == {'bob/web': 'boom'}
+    # two of four repos took ~30s, so ~30s more
+    assert progress['eta_seconds'] == pytest.approx(30, abs=1)
+    assert progress['commits_per_sec'] == pytest.approx(2, abs=0.1)
+    assert progress['finished_at'] is None
@@ -0,0 +1,111 @@
+import hashlib
+import hmac
+import json
+import queue
+
+import pytest
+
+from benchmarks.fakes import FakeGithub
+from learning_log.models import DeadLetter, LearningLog
+from learning_log.services.commit_extractor import CommitExtractor
+from learning_log.services.token_pool import GitHubAccount, TokenPool
+from learning_log.services.webhook_handler import WebhookHandler, webhook_handler
+
+SECRET = 'webhook-secret'
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    monkeypatch.setenv('GITHUB_WEBHOOK_SECRET', SECRET)
+    # deliveries stay queued, nothing reaches GitHub
+    monkeypatch.setattr(webhook_handler, '_ensure_worker', lambda: None)
+    monkeypatch.setattr(webhook_handler, 'queue', queue.Queue(maxsize=1))
+    return app.test_client()
+
+
+def deliver(client, body, event='push', content_type='application/json', secret=SECRET):
+    body = body.encode()
+    signature = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return client.post('/webhook/github', data=body, content_type=content_type, headers={
+        'X-GitHub-Event': event,
+        'X-Hub-Signature-256': signature
+    })
+
+
+def test_bad_signature_is_rejected(client):
+    response = deliver(client, '{}', secret='wrong')
+    assert response.status_code == 401
+    assert webhook_handler.queue.empty()
+
+
+def test_ping_is_answered(client):
+    response = deliver(client, '{"zen": "Keep it logically awesome."}', event='ping')
+    assert response.status_code == 200
+    assert response.get_json() == {'status': 'pong'}
+
+
+def test_push_is_queued_then_dropped_when_the_queue_is_full(client):
+    assert deliver(client, '{"ref": "refs/heads/main"}').status_code == 202
+    response = deliver(client, '{"ref": "refs/heads/main"}')
+    assert response.status_code == 503
+    assert response.get_json() == {'status': 'dropped'}
+
+
+def test_form_encoded_push_is_queued(client):
+    body = 'payload=%7B%22ref%22%3A%20%22refs%2Fheads%2Fmain%22%7D'
+    response = deliver(client, body, content_type='application/x-www-form-urlencoded')
+    assert response.status_code == 202
+    assert webhook_handler.queue.get_nowait() == {'ref': 'refs/heads/main'}
+
+
+def test_unreadable_body_is_a_bad_request(client):
+    response = deliver(client, 'payload=not-json', content_type='application/x-www-form-urlencoded')
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def fake():
+    return FakeGithub(repos=2, commits=3, files=1)
+
+
+@pytest.fixture
+def handler(db, fake, monkeypatch):
+    monkeypatch.setenv('EXCLUDED_REPOS', 'repo-1')
+    handler = WebhookHandler(SECRET)
+    handler._extractor = CommitExtractor(pool=TokenPool([GitHubAccount('bench', 'token', client=fake)]), workers=1)
+    return handler
+
+
+def push(fake, repo=0, ref='refs/heads/main', author='bench', **repository):
+    repo = fake.repos[repo]
+    return {
+        'ref': ref,
+        'after': repo.commits[0].sha,
+        'repository': {'name': repo.name, 'full_name': repo.full_name, 'default_branch': 'main', **repository},
+        'commits': [{
+            'id': commit.sha,
+            'message': commit.commit.message,
+            'timestamp': commit.commit.committer.date.isoformat(),
+            'author': {'username': author}
+        } for commit in repo.commits]
+    }
+
+
+def test_process_only_stores_default_branch_pushes_to_tracked_repos(handler, fake):
+    results = handler.process([
+        push(fake),
+        push(fake, ref='refs/heads/feature'),
+        push(fake, repo=1),
+        push(fake, author='someone-else')
+    ])
+    assert results['inserted'] == 3
+    assert LearningLog.distinct('repository') == {'repo-0'}
+
+
+def test_malformed_payload_only_drops_itself(handler, fake):
+    no_branch = push(fake)
+    del no_branch['repository']['default_branch']
+    results = handler.process([{'ref': 'refs/heads/main'}, no_branch, push(fake)])
+    assert results['inserted'] == 3
+    assert handler.stats()['errors'] == 1
+    assert list(DeadLetter.find()) == []